@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from app import metricas
+from app.ingesta import LimiteJusto
+
+# Control de admisión de la API: un cubo de tokens por cliente (API key reconocida o IP) y un límite global
+# de peticiones en curso con una cola de espera acotada, atendida por turnos entre clientes.
+# Cuando no hay cabida se responde enseguida (429 por cliente, 503 por saturación) con
+# Retry-After, en lugar de acumular peticiones que acaparan los workers.
+ADMISION_RUTAS = tuple(r for r in os.environ.get("ADMISION_RUTAS", "/api/rag").split(",") if r)
+# Peticiones por segundo y ráfaga de cada cliente (0 desactiva el límite por cliente)
+ADMISION_TASA = float(os.environ.get("ADMISION_TASA", "5"))
+ADMISION_RAFAGA = float(os.environ.get("ADMISION_RAFAGA", "20"))
+ADMISION_CLIENTES_MAX = int(os.environ.get("ADMISION_CLIENTES_MAX", "10000"))
+# Peticiones simultáneas en todo el proceso (0 desactiva), tamaño de la cola y espera máxima en ella
+ADMISION_CONCURRENCIA = int(os.environ.get("ADMISION_CONCURRENCIA", "32"))
+ADMISION_COLA_MAX = int(os.environ.get("ADMISION_COLA_MAX", "64"))
+ADMISION_ESPERA_MAX_SEGUNDOS = float(os.environ.get("ADMISION_ESPERA_MAX_SEGUNDOS", "2"))
+ADMISION_RETRY_AFTER_SATURADO = int(os.environ.get("ADMISION_RETRY_AFTER_SATURADO", "1"))
+# API keys reconocidas, separadas por comas: sólo éstas tienen cubo propio. Cualquier otra clave
+# se ignora y cuenta la IP; si no, rotar claves inventadas saltaría el límite y echaría del LRU
+# a los clientes legítimos
+ADMISION_CLAVES = tuple(c.strip() for c in os.environ.get("ADMISION_CLAVES", "").split(",") if c.strip())
+# Sólo detrás de un proxy de confianza se usa X-Forwarded-For para identificar al cliente
+ADMISION_CONFIAR_PROXY = os.environ.get("ADMISION_CONFIAR_PROXY", "false").lower() in ("1", "true", "yes")
+
+
+class CuboTokens:
+    def __init__(self, tasa: float, rafaga: float):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.tokens = rafaga
+        self.actualizado = time.monotonic()
+
+    def tomar(self, ahora: float, coste: float = 1) -> float:
+        # 0 si hay tokens; si no, segundos hasta que los haya. Un coste mayor que la ráfaga se
+        # admite con el cubo lleno y queda en deuda (saldo negativo) que se paga con el tiempo
+        self.tokens = min(self.rafaga, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+        necesarios = min(coste, self.rafaga)
+        if self.tokens >= necesarios:
+            self.tokens -= coste
+            return 0.0
+        return (necesarios - self.tokens) / self.tasa
+
+
+class LimitadorClientes:
+    # Un cubo por cliente; se olvidan los menos recientes al superar max_clientes
+    def __init__(self, tasa: float, rafaga: float, max_clientes: int = ADMISION_CLIENTES_MAX):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.max_clientes = max_clientes
+        self._cubos: "OrderedDict[str, CuboTokens]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tomar(self, cliente: str, coste: float = 1) -> float:
+        with self._lock:
+            cubo = self._cubos.get(cliente)
+            if cubo is None:
+                cubo = self._cubos[cliente] = CuboTokens(self.tasa, self.rafaga)
+                while len(self._cubos) > self.max_clientes:
+                    self._cubos.popitem(last=False)
+            else:
+                self._cubos.move_to_end(cliente)
+            return cubo.tomar(time.monotonic(), coste)
+
+    def __len__(self) -> int:
+        return len(self._cubos)
+
+
+_limitador: Optional[LimitadorClientes] = None
+_limitador_lock = threading.Lock()
+# Las primitivas de asyncio pertenecen a un event loop: una instancia por loop
+_concurrencia: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LimiteJusto]" = weakref.WeakKeyDictionary()
+
+
+def limitador() -> LimitadorClientes:
+    global _limitador
+    with _limitador_lock:
+        if _limitador is None or (_limitador.tasa, _limitador.rafaga) != (ADMISION_TASA, ADMISION_RAFAGA):
+            _limitador = LimitadorClientes(ADMISION_TASA, ADMISION_RAFAGA)
+        return _limitador
+
+
+def limite_concurrencia() -> LimiteJusto:
+    loop = asyncio.get_running_loop()
+    limite = _concurrencia.get(loop)
+    if limite is None or limite.capacidad != ADMISION_CONCURRENCIA:
+        limite = _concurrencia[loop] = LimiteJusto(ADMISION_CONCURRENCIA)
+    return limite
+
+
+def reiniciar() -> None:
+    global _limitador
+    with _limitador_lock:
+        _limitador = None
+    _concurrencia.clear()
+
+
+def identificar_cliente(scope: Dict[str, Any]) -> str:
+    # API key reconocida (hasheada: no se guarda en claro) o, si no, la IP
+    cabeceras = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    clave = cabeceras.get("x-api-key") or ""
+    autorizacion = cabeceras.get("authorization", "")
+    if not clave and autorizacion.lower().startswith("bearer "):
+        clave = autorizacion[7:].strip()
+    if clave and clave in ADMISION_CLAVES:
+        return "key:" + hashlib.sha256(clave.encode("utf-8")).hexdigest()[:16]
+    if ADMISION_CONFIAR_PROXY and cabeceras.get("x-forwarded-for"):
+        return "ip:" + cabeceras["x-forwarded-for"].split(",")[0].strip()
+    cliente = scope.get("client")
+    return "ip:" + (cliente[0] if cliente else "desconocido")
+
+
+def _rechazo(motivo: str) -> None:
+    metricas.registro.incrementar("rag_admision_rechazos_total", motivo=motivo)
+
+
+def cobrar(scope: Dict[str, Any], coste: float) -> float:
+    # Tokens adicionales para peticiones que valen por varias (lotes): el middleware ya cobró uno.
+    # 0 si hay cabida; si no, segundos de espera (y cuenta como rechazo)
+    if ADMISION_TASA <= 0 or coste <= 0:
+        return 0.0
+    espera = limitador().tomar(identificar_cliente(scope), coste)
+    if espera > 0:
+        _rechazo("limite_cliente")
+    return espera
+
+
+def _metricas_admision() -> Iterator[Tuple[str, Dict[str, str], float]]:
+    limites = list(_concurrencia.values())
+    yield "rag_admision_en_curso", {}, sum(l.en_uso for l in limites)
+    yield "rag_admision_en_cola", {}, sum(l.esperando for l in limites)
+    yield "rag_admision_clientes", {}, len(_limitador) if _limitador is not None else 0
+
+
+metricas.registro.agregar_colector(_metricas_admision)
+
+
+async def _responder(send: Callable, estado: int, codigo: str, mensaje: str, retry_after: float) -> None:
+    cuerpo = json.dumps({"detail": {"codigo": codigo, "mensaje": mensaje}}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": estado,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+class Admision:
+    # Middleware ASGI puro: el turno se mantiene hasta terminar de enviar la respuesta (streams incluidos)
+    def __init__(self, app: Any, rutas: Tuple[str, ...] = ADMISION_RUTAS):
+        self.app = app
+        self.rutas = rutas
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope.get("method") == "OPTIONS" or not scope["path"].startswith(self.rutas):
+            await self.app(scope, receive, send)
+            return
+        cliente = identificar_cliente(scope)
+        if ADMISION_TASA > 0:
+            espera = limitador().tomar(cliente)
+            if espera > 0:
+                _rechazo("limite_cliente")
+                await _responder(send, 429, "limite_cliente", "Demasiadas peticiones: espera antes de reintentar.", espera)
+                return
+        if ADMISION_CONCURRENCIA <= 0:
+            await self.app(scope, receive, send)
+            return
+        limite = limite_concurrencia()
+        if limite.en_uso >= limite.capacidad and limite.esperando >= ADMISION_COLA_MAX:
+            _rechazo("cola_llena")
+            await _responder(send, 503, "saturado", "Servicio saturado: inténtalo de nuevo en unos segundos.", ADMISION_RETRY_AFTER_SATURADO)
+            return
+        inicio = time.perf_counter()
+        try:
+            await limite.adquirir(cliente, ADMISION_ESPERA_MAX_SEGUNDOS)
+        except asyncio.TimeoutError:
+            _rechazo("espera_agotada")
+            await _responder(send, 503, "saturado", "Servicio saturado: inténtalo de nuevo en unos segundos.", ADMISION_RETRY_AFTER_SATURADO)
+            return
+        metricas.registro.observar("admision_espera", time.perf_counter() - inicio)
+        metricas.registro.incrementar("rag_admision_admitidas_total")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limite.liberar()
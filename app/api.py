@@ -1,6 +1,14 @@
-from fastapi import FastAPI, APIRouter
+import json
+import math
+from fastapi import FastAPI, APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from app import admision, fanout, ingesta, upstream
+from app.metricas import registro
+from app.states import rag_state
+from app.validacion import validar_pregunta
 
 api = FastAPI(  # Esto permite exponer Swagger en /docs
     title="RAG API",
@@ -8,6 +16,10 @@ api = FastAPI(  # Esto permite exponer Swagger en /docs
     version="1.0.0",
 )
 
+# Control de admisión (tasa por cliente y límite global) en las rutas /api/rag. Se añade antes
+# que CORS para que éste quede por fuera y también los 429/503 lleven sus cabeceras.
+api.add_middleware(admision.Admision)
+
 # Permitir CORS desde cualquier origen
 api.add_middleware(
     CORSMiddleware,
@@ -21,15 +33,148 @@ api.add_middleware(
 router = APIRouter()
 
 # Modelo de entrada
+# namespaces: colecciones en las que buscar (por defecto PINECONE_NAMESPACE); con varias se
+# consultan en paralelo y se fusionan los resultados
 class Pregunta(BaseModel):
     pregunta: str
+    namespaces: Optional[List[str]] = None
+
+class PreguntasLote(BaseModel):
+    preguntas: List[str]
+    concurrencia: Optional[int] = None
+    namespaces: Optional[List[str]] = None
+
+def _validar_namespaces(namespaces: Optional[List[str]]) -> None:
+    error = fanout.validar(namespaces)
+    if error:
+        raise HTTPException(status_code=422, detail={"codigo": "namespaces", "mensaje": error})
+
+def _validar(pregunta: str, namespaces: Optional[List[str]] = None) -> None:
+    # La entrada inválida se rechaza antes de llamar a los proveedores
+    error = validar_pregunta(pregunta)
+    if error:
+        raise HTTPException(status_code=422, detail=error.a_dict())
+    _validar_namespaces(namespaces)
 
 # Ruta POST
 @router.post("/rag", summary="Responder una pregunta usando RAG")
-def responder_pregunta(p: Pregunta):
-    from app.states.rag_state import responder_pregunta_rag
-    respuesta = responder_pregunta_rag(p.pregunta)
-    return {"respuesta": respuesta}
+async def responder_pregunta(p: Pregunta):
+    _validar(p.pregunta, p.namespaces)
+    resultado = await rag_state.ejecutar_rag_async(p.pregunta, p.namespaces)
+    # Los tiempos van en campos propios (segundos, tiempos por etapa), no dentro del texto
+    return {**resultado, "respuesta": resultado["error"] or resultado["respuesta"]}
+
+@router.post("/rag/batch", summary="Responder una lista de preguntas usando RAG")
+async def responder_lote(p: PreguntasLote, request: Request):
+    if len(p.preguntas) > rag_state.RAG_LOTE_MAX_PREGUNTAS:
+        raise HTTPException(status_code=422, detail=f"Máximo {rag_state.RAG_LOTE_MAX_PREGUNTAS} preguntas por lote.")
+    # Cada pregunta cuesta un token del cliente, no uno por lote
+    espera = admision.cobrar(request.scope, len(p.preguntas) - 1)
+    if espera > 0:
+        raise HTTPException(
+            status_code=429,
+            detail={"codigo": "limite_cliente", "mensaje": "Demasiadas preguntas: espera antes de reintentar."},
+            headers={"Retry-After": str(max(1, math.ceil(espera)))},
+        )
+    _validar_namespaces(p.namespaces)
+    # Las preguntas inválidas no tumban el lote: se informan en su posición y se responde al resto
+    errores = [validar_pregunta(pregunta) for pregunta in p.preguntas]
+    validas = [pregunta for pregunta, error in zip(p.preguntas, errores) if error is None]
+    respuestas = iter(await rag_state.ejecutar_rag_lote_async(
+        validas, min(max(1, p.concurrencia or rag_state.RAG_LOTE_CONCURRENCIA), rag_state.RAG_LOTE_CONCURRENCIA),
+        p.namespaces,
+    ) if validas else [])
+    resultados = []
+    for pregunta, error in zip(p.preguntas, errores):
+        if error:
+            resultados.append({
+                "pregunta": pregunta, "respuesta": "", "error": error.mensaje, "cache": False,
+                "segundos": 0.0, "tiempos": {}, "validacion": error.a_dict(),
+            })
+        else:
+            resultados.append({"pregunta": pregunta, **next(respuestas)})
+    return {"resultados": resultados}
+
+async def _eventos_sse(pregunta: str, namespaces: Optional[List[str]] = None):
+    async for evento in rag_state.responder_pregunta_rag_stream_async(pregunta, namespaces):
+        if evento["tipo"] == "token":
+            datos = {"texto": evento["texto"]}
+        else:
+            datos = {**evento, "respuesta_formateada": rag_state.formatear_respuesta(evento)}
+            datos.pop("tipo")
+        yield f"event: {evento['tipo']}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+# Server-Sent Events: un evento "token" por fragmento y un evento "fin" con el resultado
+@router.post("/rag/stream", summary="Responder una pregunta usando RAG con streaming (SSE)")
+async def responder_pregunta_stream(p: Pregunta):
+    _validar(p.pregunta, p.namespaces)
+    return StreamingResponse(_eventos_sse(p.pregunta, p.namespaces), media_type="text/event-stream")
+
+@router.get("/rag/stream", summary="Responder una pregunta usando RAG con streaming (SSE, compatible con EventSource)")
+async def responder_pregunta_stream_get(pregunta: str, namespaces: Optional[List[str]] = Query(None)):
+    _validar(pregunta, namespaces)
+    return StreamingResponse(_eventos_sse(pregunta, namespaces), media_type="text/event-stream")
+
+@router.get("/cache/embeddings", summary="Estadísticas de la caché de embeddings")
+def estadisticas_cache_embeddings():
+    return rag_state.cache_embeddings.estadisticas()
+
+@router.get("/cache/respuestas", summary="Estadísticas de la caché semántica de respuestas")
+def estadisticas_cache_respuestas():
+    return rag_state.cache_respuestas.estadisticas()
+
+# Estado de los clientes; la comprobación contra el almacén se cachea (SALUD_TTL_SEGUNDOS)
+@router.get("/health", summary="Estado de los clientes de OpenAI y del almacén vectorial")
+def salud(refrescar: bool = False):
+    estado = rag_state.estado_salud(refrescar)
+    return JSONResponse(estado, status_code=200 if estado["ok"] else 503)
+
+@router.get("/upstreams", summary="Llamadas, reintentos, latencia y estado del circuito por proveedor")
+def estadisticas_upstreams():
+    return upstream.estadisticas()
+
+# Ingesta en segundo plano: devuelve un job_id para consultar el progreso
+@router.post("/ingest", summary="Subir un documento y lanzar su ingesta en segundo plano")
+async def lanzar_ingesta(request: Request, file: UploadFile = File(...)):
+    nombre = file.filename or "documento"
+    path = await rag_state.guardar_archivo_subido(file, nombre)
+    # El documento queda ligado al cliente: otro con el mismo nombre de archivo no lo reemplaza
+    documento = rag_state.documento_de(nombre, admision.identificar_cliente(request.scope))
+    trabajo = rag_state.lanzar_ingesta(path, nombre, documento)
+    return trabajo.a_dict()
+
+# Ingesta masiva: varios archivos y/o ZIP; un trabajo por documento
+@router.post("/ingest/batch", summary="Subir varios documentos o un ZIP y lanzar su ingesta")
+async def lanzar_ingesta_lote(request: Request, files: List[UploadFile] = File(...)):
+    if len(files) > rag_state.INGESTA_MAX_ARCHIVOS:
+        raise HTTPException(status_code=422, detail=f"Máximo {rag_state.INGESTA_MAX_ARCHIVOS} archivos por petición.")
+    subidas = []
+    for file in files:
+        nombre = file.filename or "documento"
+        subidas.append((await rag_state.guardar_archivo_subido(file, nombre), nombre))
+    documentos, rechazados = await rag_state.preparar_subidas(subidas)
+    trabajos = rag_state.lanzar_ingesta_lote(documentos, admision.identificar_cliente(request.scope))
+    return {"trabajos": [t.a_dict() for t in trabajos], "rechazados": rechazados}
+
+@router.get("/ingest/{job_id}", summary="Consultar el estado de una ingesta")
+async def estado_ingesta(job_id: str):
+    trabajo = ingesta.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo de ingesta no encontrado.")
+    return trabajo.a_dict()
+
+@router.delete("/ingest/{job_id}", summary="Cancelar una ingesta en curso")
+async def cancelar_ingesta(job_id: str):
+    trabajo = ingesta.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo de ingesta no encontrado.")
+    cancelado = trabajo.cancelar()
+    return {**trabajo.a_dict(), "cancelado": cancelado}
 
 # Montar en /api
 api.include_router(router, prefix="/api")
+
+# Métricas en formato de texto de Prometheus
+@api.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metricas_prometheus():
+    return PlainTextResponse(registro.prometheus(), media_type="text/plain; version=0.0.4")
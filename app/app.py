@@ -1,18 +1,19 @@
 import reflex as rx
-from app.states.rag_state import RAGState
+from app.states.rag_state import INGESTA_MAX_ARCHIVOS, RAGState
 from rxconfig import config
 
 def index() -> rx.Component:
     return rx.el.div(
         rx.el.div(
             rx.el.h1(
-                "Sube un documento",
+                "Sube documentos (o un ZIP)",
                 class_name="text-2xl font-bold mb-4"
             ),
             rx.upload(
                 id="archivo_usuario",
-                accept=[".pdf", ".txt", ".docx"],
-                max_files=1,
+                accept=[".pdf", ".txt", ".docx", ".zip"],
+                multiple=True,
+                max_files=INGESTA_MAX_ARCHIVOS,
                 show_file_list=True,
                 class_name="mb-4",
             ),
@@ -29,6 +30,26 @@ def index() -> rx.Component:
                 ),
                 rx.fragment()
             ),
+            rx.foreach(
+                RAGState.trabajos_ingesta,
+                lambda trabajo: rx.el.div(
+                    rx.el.div(
+                        rx.el.span(trabajo["nombre"], class_name="font-semibold"),
+                        rx.el.span(f" ({trabajo['estado']})", class_name="text-gray-500"),
+                    ),
+                    rx.el.div(trabajo["progreso"], class_name="text-xs text-gray-600"),
+                    rx.cond(
+                        (trabajo["estado"] == "procesando") | (trabajo["estado"] == "pendiente"),
+                        rx.el.button(
+                            "Cancelar",
+                            on_click=RAGState.cancelar_ingesta(trabajo["id"]),
+                            class_name="text-xs text-red-600 hover:text-red-800 underline",
+                        ),
+                        rx.el.div(trabajo["mensaje"], class_name="text-xs text-gray-700"),
+                    ),
+                    class_name="p-2 mb-2 border rounded bg-gray-50 text-sm",
+                ),
+            ),
             rx.el.a(
                 "Ir al asistente",
                 href="/chat",
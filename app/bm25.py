@@ -0,0 +1,283 @@
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.vectores import Match
+
+# Índice léxico BM25 en memoria: postings en arrays compactos (id de documento uint32 y tf uint16)
+# por término. Con BM25_PATH se persiste como log JSONL (altas, bajas y cambios de metadatos) que se
+# reproduce al arrancar. Las bajas son lógicas: cuando los documentos (o las líneas del log) pasan del
+# doble de los vivos y de BM25_COMPACTAR_MIN se reconstruyen los postings y el log se reescribe como
+# una instantánea de los vivos.
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+BM25_PATH = os.environ.get("BM25_PATH", "")
+RRF_K = int(os.environ.get("RRF_K", "60"))
+BM25_COMPACTAR_MIN = int(os.environ.get("BM25_COMPACTAR_MIN", "1000"))
+
+# Palabras y códigos con separadores internos (AB-123, v2.1, art. 14/2020); los códigos también
+# se indexan por partes para que "AB-123" encuentre "ab 123" y viceversa
+_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+_PARTES = re.compile(r"[-./]")
+
+
+def tokenizar(texto: str) -> List[str]:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    tokens: List[str] = []
+    for token in _TOKEN.findall(texto):
+        tokens.append(token)
+        if _PARTES.search(token):
+            tokens.extend(p for p in _PARTES.split(token) if p)
+    return tokens
+
+
+class _EspacioBM25:
+    def __init__(self):
+        self.terminos: Dict[str, int] = {}
+        self.postings_docs: List[array] = []
+        self.postings_tf: List[array] = []
+        self.ids: List[str] = []
+        self.metadatos: List[Optional[Dict[str, Any]]] = []
+        self.longitudes = array("I")
+        self.vivos = bytearray()
+        self.doc_de: Dict[str, int] = {}
+        self.longitud_total = 0
+        self.n_vivos = 0
+
+    def agregar(self, id_: str, texto: str, metadata: Dict[str, Any]) -> None:
+        self.eliminar(id_)
+        doc = len(self.ids)
+        frecuencias: Dict[str, int] = {}
+        tokens = tokenizar(texto)
+        for token in tokens:
+            frecuencias[token] = frecuencias.get(token, 0) + 1
+        for token, tf in frecuencias.items():
+            termino = self.terminos.get(token)
+            if termino is None:
+                termino = self.terminos[token] = len(self.postings_docs)
+                self.postings_docs.append(array("I"))
+                self.postings_tf.append(array("H"))
+            self.postings_docs[termino].append(doc)
+            self.postings_tf[termino].append(min(tf, 65535))
+        self.ids.append(id_)
+        self.metadatos.append(metadata)
+        self.longitudes.append(len(tokens))
+        self.vivos.append(1)
+        self.doc_de[id_] = doc
+        self.longitud_total += len(tokens)
+        self.n_vivos += 1
+
+    def eliminar(self, id_: str) -> None:
+        # Baja lógica: los postings del documento se ignoran al puntuar
+        doc = self.doc_de.pop(id_, None)
+        if doc is None:
+            return
+        self.vivos[doc] = 0
+        self.metadatos[doc] = None
+        self.longitud_total -= self.longitudes[doc]
+        self.n_vivos -= 1
+
+    def necesita_compactar(self) -> bool:
+        return len(self.ids) > max(BM25_COMPACTAR_MIN, 2 * self.n_vivos)
+
+    def compactar(self) -> None:
+        # Quita los documentos borrados de todas las estructuras y renumera los vivos
+        vivos = np.frombuffer(self.vivos, dtype=np.uint8).astype(bool)
+        nuevo = (np.cumsum(vivos) - 1).astype(np.uint32)
+        terminos: Dict[str, int] = {}
+        postings_docs: List[array] = []
+        postings_tf: List[array] = []
+        for token, termino in self.terminos.items():
+            docs = np.frombuffer(self.postings_docs[termino], dtype=np.uint32)
+            mascara = vivos[docs]
+            if not mascara.any():
+                continue
+            terminos[token] = len(postings_docs)
+            postings_docs.append(array("I", nuevo[docs[mascara]].tobytes()))
+            postings_tf.append(array("H", np.frombuffer(self.postings_tf[termino], dtype=np.uint16)[mascara].tobytes()))
+        vivas = np.flatnonzero(vivos)
+        self.terminos = terminos
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.ids = [self.ids[doc] for doc in vivas]
+        self.metadatos = [self.metadatos[doc] for doc in vivas]
+        self.longitudes = array("I", np.frombuffer(self.longitudes, dtype=np.uint32)[vivas].tobytes())
+        self.vivos = bytearray(b"\x01" * len(vivas))
+        self.doc_de = {id_: doc for doc, id_ in enumerate(self.ids)}
+
+    def actualizar_metadatos(self, id_: str, metadata: Dict[str, Any]) -> None:
+        doc = self.doc_de.get(id_)
+        if doc is not None:
+            self.metadatos[doc] = {**(self.metadatos[doc] or {}), **metadata}
+
+    def buscar(self, consulta: str, top_k: int, k1: float, b: float) -> List[Tuple[int, float]]:
+        if not self.n_vivos:
+            return []
+        media = self.longitud_total / self.n_vivos or 1.0
+        longitudes = np.frombuffer(self.longitudes, dtype=np.uint32).astype(np.float32)
+        normalizacion = k1 * (1 - b + b * longitudes / media)
+        vivos = np.frombuffer(self.vivos, dtype=np.uint8).astype(bool)
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for token in set(tokenizar(consulta)):
+            termino = self.terminos.get(token)
+            if termino is None:
+                continue
+            # Sólo cuentan los documentos vivos, también para el idf
+            docs = np.frombuffer(self.postings_docs[termino], dtype=np.uint32)
+            mascara = vivos[docs]
+            docs = docs[mascara]
+            df = len(docs)
+            if not df:
+                continue
+            tf = np.frombuffer(self.postings_tf[termino], dtype=np.uint16)[mascara].astype(np.float32)
+            idf = math.log(1 + (self.n_vivos - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (k1 + 1) / (tf + normalizacion[docs])
+        candidatos = np.flatnonzero(scores > 0)
+        if candidatos.size == 0:
+            return []
+        k = min(top_k, candidatos.size)
+        mejores = candidatos[np.argpartition(-scores[candidatos], k - 1)[:k]]
+        mejores = mejores[np.argsort(-scores[mejores])]
+        return [(int(doc), float(scores[doc])) for doc in mejores]
+
+
+class IndiceBM25:
+    def __init__(self, path: Optional[str] = None, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self._espacios: Dict[str, _EspacioBM25] = {}
+        self._lock = threading.Lock()
+        # Líneas del log, vivas o no
+        self.registros = 0
+        if self.path and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        self.registros += 1
+                        self._aplicar(json.loads(linea))
+            self._compactar_log()
+
+    def _aplicar(self, registro: Dict[str, Any]) -> None:
+        espacio = self._espacios.setdefault(registro["namespace"], _EspacioBM25())
+        if registro.get("borrado"):
+            espacio.eliminar(registro["id"])
+        elif "texto" not in registro:
+            espacio.actualizar_metadatos(registro["id"], registro["metadata"])
+        else:
+            espacio.agregar(registro["id"], registro["texto"], registro["metadata"])
+        if espacio.necesita_compactar():
+            espacio.compactar()
+
+    def _registrar(self, registros: List[Dict[str, Any]]) -> None:
+        # Llamar con el lock tomado
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self.registros += len(registros)
+        for registro in registros:
+            self._aplicar(registro)
+        self._compactar_log()
+
+    def _compactar_log(self) -> None:
+        # Llamar con el lock tomado. El texto no se guarda en memoria: se copia del log la última alta
+        # de cada documento vivo, con sus metadatos actuales
+        vivos = sum(espacio.n_vivos for espacio in self._espacios.values())
+        if not self.path or self.registros <= max(BM25_COMPACTAR_MIN, 2 * vivos):
+            return
+        ultimas: Dict[Tuple[str, str], int] = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for numero, linea in enumerate(f):
+                if linea.strip():
+                    registro = json.loads(linea)
+                    if "texto" in registro:
+                        ultimas[(registro["namespace"], registro["id"])] = numero
+        temporal = self.path.with_suffix(".tmp")
+        escritos = 0
+        with open(self.path, "r", encoding="utf-8") as f, open(temporal, "w", encoding="utf-8") as salida:
+            for numero, linea in enumerate(f):
+                if not linea.strip():
+                    continue
+                registro = json.loads(linea)
+                espacio = self._espacios.get(registro["namespace"])
+                doc = espacio.doc_de.get(registro["id"]) if espacio else None
+                if doc is None or ultimas.get((registro["namespace"], registro["id"])) != numero:
+                    continue
+                registro["metadata"] = espacio.metadatos[doc]
+                salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                escritos += 1
+        os.replace(temporal, self.path)
+        self.registros = escritos
+
+    def agregar(self, documentos: Iterable[Tuple[str, str, Dict[str, Any]]], namespace: str) -> None:
+        registros = [
+            {"namespace": namespace, "id": id_, "texto": texto, "metadata": metadata}
+            for id_, texto, metadata in documentos
+        ]
+        with self._lock:
+            self._registrar(registros)
+
+    def eliminar(self, ids: Sequence[str], namespace: str) -> None:
+        with self._lock:
+            espacio = self._espacios.get(namespace)
+            if espacio is None:
+                return
+            self._registrar([{"namespace": namespace, "id": id_, "borrado": True} for id_ in ids if id_ in espacio.doc_de])
+
+    def actualizar_metadatos(self, cambios: Iterable[Tuple[str, Dict[str, Any]]], namespace: str) -> None:
+        # Registro sin texto: sólo fusiona metadatos, no reindexa
+        with self._lock:
+            espacio = self._espacios.get(namespace)
+            if espacio is None:
+                return
+            self._registrar([
+                {"namespace": namespace, "id": id_, "metadata": metadata}
+                for id_, metadata in cambios if id_ in espacio.doc_de
+            ])
+
+    def buscar(self, consulta: str, top_k: int, namespace: str) -> List[Match]:
+        with self._lock:
+            espacio = self._espacios.get(namespace)
+            if espacio is None:
+                return []
+            return [
+                Match(espacio.ids[doc], score, espacio.metadatos[doc])
+                for doc, score in espacio.buscar(consulta, top_k, self.k1, self.b)
+            ]
+
+    def contiene(self, id_: str, namespace: str) -> bool:
+        with self._lock:
+            espacio = self._espacios.get(namespace)
+            return espacio is not None and id_ in espacio.doc_de
+
+    def documentos(self, namespace: str) -> int:
+        with self._lock:
+            espacio = self._espacios.get(namespace)
+            return espacio.n_vivos if espacio else 0
+
+
+def fusion_rrf(listas: Sequence[Sequence[Match]], top_k: int, k: int = RRF_K) -> List[Match]:
+    # Reciprocal rank fusion: suma de 1 / (k + posición) en cada lista; sólo importa el orden
+    puntos: Dict[str, float] = {}
+    matches: Dict[str, Match] = {}
+    for lista in listas:
+        for posicion, match in enumerate(lista, start=1):
+            puntos[match.id] = puntos.get(match.id, 0.0) + 1.0 / (k + posicion)
+            if match.id not in matches or (not matches[match.id].metadata and match.metadata):
+                matches[match.id] = match
+    ordenados = sorted(puntos, key=lambda id_: puntos[id_], reverse=True)[:top_k]
+    return [Match(id_, puntos[id_], matches[id_].metadata, matches[id_].values) for id_ in ordenados]
+
+
+def crear_desde_entorno() -> IndiceBM25:
+    return IndiceBM25(BM25_PATH)
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Caché de embeddings: LRU en memoria acotada por bytes y, opcionalmente, SQLite en disco
+EMBEDDING_CACHE_MAX_MB = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", "64"))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "")
+
+
+def normalizar_texto(texto: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", texto).split())
+
+
+def clave_embedding(modelo: str, texto: str) -> str:
+    return hashlib.sha256(f"{modelo}\0{normalizar_texto(texto)}".encode("utf-8")).hexdigest()
+
+
+class CacheEmbeddings:
+    def __init__(self, max_bytes: int, path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.path = path or None
+        self._lru: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.hits_disco = 0
+        self.misses = 0
+        self.desalojos = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (clave TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+
+    @property
+    def persistente(self) -> bool:
+        return self._db is not None
+
+    def _insertar_lru(self, clave: str, blob: bytes) -> None:
+        # Llamar con el lock tomado
+        anterior = self._lru.pop(clave, None)
+        if anterior is not None:
+            self._bytes -= len(anterior)
+        self._lru[clave] = blob
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes and self._lru:
+            _, desalojado = self._lru.popitem(last=False)
+            self._bytes -= len(desalojado)
+            self.desalojos += 1
+
+    def obtener_varios(self, modelo: str, textos: List[str]) -> List[Optional[List[float]]]:
+        claves = [clave_embedding(modelo, t) for t in textos]
+        resultado: List[Optional[bytes]] = [None] * len(claves)
+        faltantes: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, clave in enumerate(claves):
+                blob = self._lru.get(clave)
+                if blob is not None:
+                    self._lru.move_to_end(clave)
+                    resultado[i] = blob
+                else:
+                    faltantes.setdefault(clave, []).append(i)
+            if faltantes and self._db is not None:
+                lista = list(faltantes)
+                for inicio in range(0, len(lista), 500):
+                    parte = lista[inicio:inicio + 500]
+                    filas = self._db.execute(
+                        f"SELECT clave, vector FROM embeddings WHERE clave IN ({','.join('?' * len(parte))})",
+                        parte,
+                    ).fetchall()
+                    for clave, blob in filas:
+                        self._insertar_lru(clave, blob)
+                        for i in faltantes.pop(clave):
+                            resultado[i] = blob
+                            self.hits_disco += 1
+            self.misses += sum(len(v) for v in faltantes.values())
+            self.hits += sum(1 for blob in resultado if blob is not None)
+        return [array("f", blob).tolist() if blob is not None else None for blob in resultado]
+
+    def obtener(self, modelo: str, texto: str) -> Optional[List[float]]:
+        return self.obtener_varios(modelo, [texto])[0]
+
+    def guardar_varios(self, modelo: str, textos: List[str], embeddings: List[List[float]]) -> None:
+        filas = [(clave_embedding(modelo, t), array("f", e).tobytes()) for t, e in zip(textos, embeddings)]
+        with self._lock:
+            for clave, blob in filas:
+                self._insertar_lru(clave, blob)
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (clave, vector) VALUES (?, ?)", filas)
+                self._db.commit()
+
+    def guardar(self, modelo: str, texto: str, embedding: List[float]) -> None:
+        self.guardar_varios(modelo, [texto], [embedding])
+
+    def estadisticas(self) -> Dict[str, float]:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+                "ratio_hits": round(self.hits / consultas, 4) if consultas else 0.0,
+                "entradas_memoria": len(self._lru),
+                "bytes_memoria": self._bytes,
+                "desalojos": self.desalojos,
+                "persistente": self._db is not None,
+            }
+
+
+def crear_desde_entorno() -> CacheEmbeddings:
+    return CacheEmbeddings(int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024), EMBEDDING_CACHE_PATH)
@@ -0,0 +1,109 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Caché semántica de respuestas: misma huella de contexto + pregunta con coseno >= umbral
+RESPUESTA_CACHE_UMBRAL = float(os.environ.get("RESPUESTA_CACHE_UMBRAL", "0.95"))
+RESPUESTA_CACHE_TTL_SEGUNDOS = float(os.environ.get("RESPUESTA_CACHE_TTL_SEGUNDOS", "3600"))
+RESPUESTA_CACHE_MAX_ENTRADAS = int(os.environ.get("RESPUESTA_CACHE_MAX_ENTRADAS", "1000"))
+
+
+def huella_contexto(namespace: str, ids: List[str]) -> str:
+    # Cambia cuando cambian los chunks recuperados (nuevas subidas, borrados o cambio de namespace)
+    return hashlib.sha1("\0".join([namespace, *sorted(ids)]).encode("utf-8")).hexdigest()
+
+
+def _normalizar(vector: List[float]) -> List[float]:
+    norma = math.sqrt(sum(x * x for x in vector))
+    return [x / norma for x in vector] if norma else list(vector)
+
+
+class _Entrada:
+    __slots__ = ("vector", "huella", "respuesta", "creado")
+
+    def __init__(self, vector: List[float], huella: str, respuesta: str):
+        self.vector = vector
+        self.huella = huella
+        self.respuesta = respuesta
+        self.creado = time.monotonic()
+
+
+class CacheRespuestas:
+    def __init__(self, umbral: float, ttl_segundos: float, max_entradas: int):
+        self.umbral = umbral
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[int, _Entrada]" = OrderedDict()
+        self._por_huella: Dict[str, List[int]] = {}
+        self._siguiente_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expiradas = 0
+        self.desalojos = 0
+
+    def _eliminar(self, entrada_id: int) -> None:
+        # Llamar con el lock tomado
+        entrada = self._entradas.pop(entrada_id)
+        ids = self._por_huella[entrada.huella]
+        ids.remove(entrada_id)
+        if not ids:
+            del self._por_huella[entrada.huella]
+
+    def buscar(self, embedding: List[float], huella: str) -> Optional[Tuple[str, float]]:
+        # Sólo se compara contra las entradas con la misma huella de contexto, que son pocas
+        vector = _normalizar(embedding)
+        ahora = time.monotonic()
+        with self._lock:
+            mejor: Optional[Tuple[int, float]] = None
+            for entrada_id in list(self._por_huella.get(huella, ())):
+                entrada = self._entradas[entrada_id]
+                if ahora - entrada.creado > self.ttl_segundos:
+                    self._eliminar(entrada_id)
+                    self.expiradas += 1
+                    continue
+                similitud = sum(a * b for a, b in zip(vector, entrada.vector))
+                if similitud >= self.umbral and (mejor is None or similitud > mejor[1]):
+                    mejor = (entrada_id, similitud)
+            if mejor is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entradas.move_to_end(mejor[0])
+            return self._entradas[mejor[0]].respuesta, mejor[1]
+
+    def guardar(self, embedding: List[float], huella: str, respuesta: str) -> None:
+        entrada = _Entrada(_normalizar(embedding), huella, respuesta)
+        with self._lock:
+            entrada_id = self._siguiente_id
+            self._siguiente_id += 1
+            self._entradas[entrada_id] = entrada
+            self._por_huella.setdefault(huella, []).append(entrada_id)
+            while len(self._entradas) > self.max_entradas:
+                self._eliminar(next(iter(self._entradas)))
+                self.desalojos += 1
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._por_huella.clear()
+
+    def estadisticas(self) -> Dict[str, float]:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "ratio_hits": round(self.hits / consultas, 4) if consultas else 0.0,
+                "entradas": len(self._entradas),
+                "expiradas": self.expiradas,
+                "desalojos": self.desalojos,
+            }
+
+
+def crear_desde_entorno() -> CacheRespuestas:
+    return CacheRespuestas(RESPUESTA_CACHE_UMBRAL, RESPUESTA_CACHE_TTL_SEGUNDOS, RESPUESTA_CACHE_MAX_ENTRADAS)
@@ -0,0 +1,223 @@
+import operator
+import os
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.contexto import contar_tokens
+
+# División de documentos en chunks sin dependencias externas. Mismo criterio que el
+# RecursiveCharacterTextSplitter de langchain (separadores de mayor a menor, solape entre chunks
+# consecutivos), pero trabajando con offsets sobre el texto: sólo se copia el texto de cada chunk.
+# Las páginas llegan como un flujo: los bloques seguidos de una misma página (un .txt) se dividen
+# igual que la página entera, guardando sólo lo que va desde el último chunk emitido.
+CHUNK_TAMANO = int(os.environ.get("CHUNK_TAMANO", "500"))
+CHUNK_SOLAPE = int(os.environ.get("CHUNK_SOLAPE", "50"))
+# "caracteres" o "tokens" (con tiktoken si está instalado; si no, la aproximación de contexto)
+CHUNK_UNIDAD = os.environ.get("CHUNK_UNIDAD", "caracteres")
+CHUNK_CODIFICACION = os.environ.get("CHUNK_CODIFICACION", "cl100k_base")
+SEPARADORES = ("\n\n", "\n", " ", "")
+
+
+class Chunk(NamedTuple):
+    texto: str
+    pagina: Optional[int] = None
+    # Posición en caracteres dentro del documento extraído (todas las páginas seguidas)
+    inicio: Optional[int] = None
+    fin: Optional[int] = None
+
+
+def contador(unidad: str = CHUNK_UNIDAD, codificacion: str = CHUNK_CODIFICACION) -> Optional[Callable[[str], int]]:
+    # None = se mide en caracteres, sin copiar el texto
+    if unidad != "tokens":
+        return None
+    try:
+        import tiktoken
+    except ImportError:
+        return contar_tokens
+    codificador = tiktoken.get_encoding(codificacion)
+    return lambda texto: len(codificador.encode_ordinary(texto))
+
+
+class Divisor:
+    # Caracteres sin separador de primer nivel que se acumulan antes de cortar por los siguientes
+    cola_max = 64 * 1024
+
+    def __init__(
+        self,
+        tamano: int = CHUNK_TAMANO,
+        solape: int = CHUNK_SOLAPE,
+        medir: Optional[Callable[[str], int]] = None,
+        separadores: Sequence[str] = SEPARADORES,
+    ):
+        if solape >= tamano:
+            raise ValueError("El solape debe ser menor que el tamaño del chunk.")
+        self.tamano = tamano
+        self.solape = solape
+        self.medir = medir
+        self.separadores = tuple(separadores)
+        if self.separadores[-1] != "":
+            self.separadores += ("",)
+        self._patrones = [re.compile(re.escape(s)) for s in self.separadores]
+
+    def _medida(self, texto: str, inicio: int, fin: int) -> int:
+        return fin - inicio if self.medir is None else self.medir(texto[inicio:fin])
+
+    def _cortar(self, texto: str, inicio: int, fin: int, nivel: int, cortes: List[int], medidas: List[int]) -> None:
+        # Baja hasta el primer separador que aparece en [inicio, fin)
+        while self.separadores[nivel] and texto.find(self.separadores[nivel], inicio, fin) == -1:
+            nivel += 1
+        self._partir(texto, inicio, fin, nivel, cortes, medidas)
+
+    def _partir(self, texto: str, inicio: int, fin: int, nivel: int, cortes: List[int], medidas: List[int]) -> None:
+        # Parte [inicio, fin) en tramos que caben en un chunk y anota dónde empieza cada uno y su
+        # medida. El separador queda al principio del tramo siguiente: tramos vecinos unidos
+        # reproducen el texto original, así un chunk es siempre texto[inicio:fin]
+        if not self.separadores[nivel]:
+            # Sin separadores: ventanas fijas (en tokens, con el ancho en caracteres estimado)
+            medida = self._medida(texto, inicio, fin)
+            paso = self.tamano if self.medir is None else max(1, self.tamano * (fin - inicio) // max(medida, 1))
+            for corte in range(inicio, fin, paso):
+                cortes.append(corte)
+                medidas.append(self._medida(texto, corte, min(corte + paso, fin)))
+            return
+        limites = [inicio]
+        limites.extend(m.start() for m in self._patrones[nivel].finditer(texto, inicio + 1, fin))
+        limites.append(fin)
+        if self.medir is None:
+            tramos = list(map(operator.sub, limites[1:], limites))
+        else:
+            tramos = [self.medir(texto[a:b]) for a, b in zip(limites, limites[1:])]
+        if max(tramos) <= self.tamano:
+            # Lo habitual: todo cabe y no hace falta bajar de nivel
+            cortes.extend(limites[:-1])
+            medidas.extend(tramos)
+            return
+        for a, b, medida in zip(limites, limites[1:], tramos):
+            if medida > self.tamano:
+                self._cortar(texto, a, b, nivel + 1, cortes, medidas)
+            else:
+                cortes.append(a)
+                medidas.append(medida)
+
+    def _retomar(self, texto: str, inicio: int, fin: int, nivel: Optional[int], cortes: List[int], medidas: List[int]) -> None:
+        # Tramos de [inicio, fin) cuando `inicio` es un corte de `nivel`. A mitad de un párrafo largo
+        # se sigue partiendo por los niveles inferiores hasta el siguiente separador de primer nivel
+        if nivel:
+            siguiente = self._patrones[0].search(texto, inicio + 1, fin)
+            medio = siguiente.start() if siguiente else fin
+            self._cortar(texto, inicio, medio, 1, cortes, medidas)
+            inicio = medio
+        if inicio < fin:
+            self._partir(texto, inicio, fin, 0, cortes, medidas)
+
+    def _agrupar(self, cortes: List[int], medidas: List[int], fin: int, completo: bool) -> Tuple[List[Tuple[int, int]], int]:
+        # Une tramos hasta el tamaño y empieza el siguiente chunk con los últimos tramos que quepan
+        # en el solape. Con las medidas acumuladas cada chunk se resuelve con dos búsquedas binarias.
+        # Si el texto no está completo, el último chunk aún puede crecer: se devuelve el tramo en el
+        # que empieza para retomarlo cuando llegue más texto
+        acumulado = list(accumulate(medidas, initial=0))
+        limites = cortes + [fin]
+        n = len(medidas)
+        rangos: List[Tuple[int, int]] = []
+        i = 0
+        while i < n:
+            j = max(i + 1, bisect_right(acumulado, acumulado[i] + self.tamano) - 1)
+            if j >= n and not completo:
+                break
+            rangos.append((limites[i], limites[j]))
+            if j >= n:
+                return rangos, n
+            i = max(i + 1, bisect_left(acumulado, max(acumulado[j] - self.solape, acumulado[j + 1] - self.tamano)))
+        return rangos, i
+
+    def _limite(self, texto: str, desde: int) -> Tuple[int, int]:
+        # Último separador de primer nivel a partir del cual el texto que llegue ya no cambia los
+        # tramos anteriores, y su nivel. Si no hay párrafos y la cola crece mucho se usan los niveles
+        # siguientes, para no acumular la página entera
+        niveles = len(self.separadores) - 1 if len(texto) - desde > self.cola_max else 1
+        for nivel, separador in enumerate(self.separadores[:niveles]):
+            if not separador:
+                break
+            largo = len(separador)
+            posicion = texto.rfind(separador, desde + 1)
+            # Descarta apariciones solapadas ("\n\n\n"): el corte podría no coincidir con el del texto entero
+            while posicion > desde and (
+                texto.find(separador, max(posicion - largo + 1, desde + 1), posicion + 2 * largo - 1) != posicion
+                or texto.find(separador, posicion + 1, posicion + 2 * largo - 1) != -1
+                or posicion + 2 * largo - 1 > len(texto)
+            ):
+                posicion = texto.rfind(separador, desde + 1, posicion)
+            if posicion > desde:
+                return posicion, nivel
+        return desde, 0
+
+    def _chunks(self, texto: str, desplazamiento: int, pagina: Optional[int], rangos: Iterable[Tuple[int, int]]) -> Iterator[Chunk]:
+        for inicio, fin in rangos:
+            # Sin espacios en los extremos, ajustando los offsets
+            while inicio < fin and texto[inicio].isspace():
+                inicio += 1
+            while fin > inicio and texto[fin - 1].isspace():
+                fin -= 1
+            if fin > inicio:
+                yield Chunk(texto[inicio:fin], pagina, desplazamiento + inicio, desplazamiento + fin)
+
+    def dividir_texto(self, texto: str) -> List[str]:
+        return [c.texto for c in self.dividir([(None, texto)])]
+
+    def dividir(self, paginas: Iterable[Tuple[Optional[int], str]]) -> Iterator[Chunk]:
+        # Los tramos de `texto` anteriores a `estable` ya son definitivos; `desplazamiento` es el
+        # offset en el documento del principio de `texto`. Bloques seguidos de la misma página dan
+        # los mismos chunks que la página entera
+        texto = ""
+        desplazamiento = 0
+        estable = 0
+        nivel: Optional[int] = None
+        cortes: List[int] = []
+        medidas: List[int] = []
+        pagina_actual: Optional[int] = None
+
+        def cerrar() -> Iterator[Chunk]:
+            restantes = list(cortes)
+            medidas_restantes = list(medidas)
+            if len(texto) > estable:
+                if nivel is None:
+                    self._cortar(texto, estable, len(texto), 0, restantes, medidas_restantes)
+                else:
+                    self._retomar(texto, estable, len(texto), nivel, restantes, medidas_restantes)
+            rangos, _ = self._agrupar(restantes, medidas_restantes, len(texto), True)
+            return self._chunks(texto, desplazamiento, pagina_actual, rangos)
+
+        for pagina, bloque in paginas:
+            if texto and pagina != pagina_actual:
+                yield from cerrar()
+                desplazamiento += len(texto)
+                texto, estable, nivel, cortes, medidas = "", 0, None, [], []
+            pagina_actual = pagina
+            texto += bloque
+            limite, nivel_limite = self._limite(texto, estable)
+            if limite <= estable:
+                continue
+            if nivel_limite == 0:
+                self._retomar(texto, estable, limite, nivel, cortes, medidas)
+            else:
+                # Párrafo más largo que la cola: se corta por los niveles inferiores
+                self._cortar(texto, estable, limite, 1, cortes, medidas)
+            estable, nivel = limite, nivel_limite
+            rangos, siguiente = self._agrupar(cortes, medidas, estable, False)
+            yield from self._chunks(texto, desplazamiento, pagina, rangos)
+            if siguiente:
+                # Lo ya emitido deja de hacer falta
+                recorte = cortes[siguiente]
+                texto = texto[recorte:]
+                desplazamiento += recorte
+                estable -= recorte
+                cortes = [c - recorte for c in cortes[siguiente:]]
+                del medidas[:siguiente]
+        if texto:
+            yield from cerrar()
+
+
+def crear_desde_entorno() -> Divisor:
+    return Divisor(CHUNK_TAMANO, CHUNK_SOLAPE, contador())
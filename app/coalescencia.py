@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import copy
+import os
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from app import metricas
+from app.cache_embeddings import normalizar_texto
+
+# Coalescencia (single-flight): las peticiones idénticas que llegan mientras otra está en vuelo
+# no lanzan su propio pipeline, sino que esperan el resultado de la primera. Las suscripciones
+# a un stream reciben los eventos ya emitidos y después los nuevos, a medida que llegan.
+COALESCENCIA = os.environ.get("COALESCENCIA", "true").lower() in ("1", "true", "yes")
+
+
+def clave(namespace: str, pregunta: str) -> str:
+    # Misma pregunta salvo espacios, forma Unicode o mayúsculas
+    return f"{namespace}\0{normalizar_texto(pregunta).casefold()}"
+
+
+def _contar(camino: str) -> None:
+    metricas.registro.incrementar("rag_coalescidas_total", camino=camino)
+
+
+class _Vuelo:
+    def __init__(self) -> None:
+        self.listo = threading.Event()
+        self.resultado: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class Vuelo:
+    # Camino síncrono: el primer hilo ejecuta, los demás esperan su resultado
+    def __init__(self, camino: str):
+        self.camino = camino
+        self._lock = threading.Lock()
+        self._vuelos: Dict[str, _Vuelo] = {}
+
+    def hacer(self, clave: str, funcion: Callable[[], Any]) -> Any:
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+        if not lider:
+            _contar(self.camino)
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return copy.deepcopy(vuelo.resultado)
+        try:
+            vuelo.resultado = funcion()
+            return copy.deepcopy(vuelo.resultado)
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._vuelos[clave]
+            vuelo.listo.set()
+
+    def en_vuelo(self) -> int:
+        return len(self._vuelos)
+
+
+class _VueloAsync:
+    def __init__(self, tarea: asyncio.Task):
+        self.tarea = tarea
+        self.suscriptores = 0
+
+
+class VueloAsync:
+    # Camino asíncrono: el pipeline corre en su propia tarea y cada petición la espera con shield,
+    # así la cancelación de una petición (cliente desconectado) no afecta a las demás. Si se
+    # cancelan todas, se cancela también la tarea.
+    def __init__(self, camino: str):
+        self.camino = camino
+        self._vuelos: Dict[str, _VueloAsync] = {}
+
+    def _soltar(self, clave: str, vuelo: _VueloAsync) -> None:
+        if self._vuelos.get(clave) is vuelo:
+            del self._vuelos[clave]
+
+    async def hacer(self, clave: str, funcion: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        vuelo = self._vuelos.get(clave)
+        # Las tareas pertenecen a un event loop: desde otro no se pueden esperar
+        if vuelo is None or vuelo.tarea.done() or vuelo.tarea.get_loop() is not loop:
+            vuelo = _VueloAsync(loop.create_task(funcion()))
+            self._vuelos[clave] = vuelo
+            vuelo.tarea.add_done_callback(lambda _, vuelo=vuelo: self._soltar(clave, vuelo))
+        else:
+            _contar(self.camino)
+        vuelo.suscriptores += 1
+        try:
+            resultado = await asyncio.shield(vuelo.tarea)
+        finally:
+            vuelo.suscriptores -= 1
+            if vuelo.suscriptores == 0 and not vuelo.tarea.done():
+                self._soltar(clave, vuelo)
+                vuelo.tarea.cancel()
+        return copy.deepcopy(resultado)
+
+    def en_vuelo(self) -> int:
+        return len(self._vuelos)
+
+
+class _Emision:
+    def __init__(self) -> None:
+        self.eventos: List[Any] = []
+        self.terminado = False
+        self.error: Optional[BaseException] = None
+        self.suscriptores = 0
+        # Sólo en DifusionAsync: la tarea productora y el evento que despierta a los suscriptores
+        self.tarea: Optional[asyncio.Task] = None
+        self.cambio: Optional[asyncio.Event] = None
+
+
+class Difusion:
+    # Streams síncronos: un hilo consume el generador y reparte cada evento entre los suscriptores
+    def __init__(self, camino: str):
+        self.camino = camino
+        self._cambio = threading.Condition()
+        self._emisiones: Dict[str, _Emision] = {}
+
+    def _producir(self, clave: str, emision: _Emision, generador: Callable[[], Iterator[Any]]) -> None:
+        try:
+            for evento in generador():
+                with self._cambio:
+                    emision.eventos.append(evento)
+                    self._cambio.notify_all()
+                    if emision.suscriptores == 0:
+                        # Nadie escucha: se deja de generar y las nuevas peticiones empiezan de cero
+                        if self._emisiones.get(clave) is emision:
+                            del self._emisiones[clave]
+                        break
+        except BaseException as e:
+            emision.error = e
+        finally:
+            with self._cambio:
+                emision.terminado = True
+                if self._emisiones.get(clave) is emision:
+                    del self._emisiones[clave]
+                self._cambio.notify_all()
+
+    def suscribir(self, clave: str, generador: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        with self._cambio:
+            emision = self._emisiones.get(clave)
+            if emision is None:
+                emision = self._emisiones[clave] = _Emision()
+                contexto = contextvars.copy_context()
+                threading.Thread(
+                    target=contexto.run, args=(self._producir, clave, emision, generador),
+                    name=f"difusion-{self.camino}", daemon=True,
+                ).start()
+            else:
+                _contar(self.camino)
+            emision.suscriptores += 1
+        leidos = 0
+        try:
+            while True:
+                with self._cambio:
+                    while leidos >= len(emision.eventos) and not emision.terminado:
+                        self._cambio.wait()
+                    nuevos = emision.eventos[leidos:]
+                    terminado = emision.terminado
+                leidos += len(nuevos)
+                yield from nuevos
+                if terminado and leidos >= len(emision.eventos):
+                    if emision.error is not None:
+                        raise emision.error
+                    return
+        finally:
+            with self._cambio:
+                emision.suscriptores -= 1
+
+    def en_vuelo(self) -> int:
+        return len(self._emisiones)
+
+
+class DifusionAsync:
+    # Igual que Difusion, con una tarea por stream; se cancela si no queda ningún suscriptor
+    def __init__(self, camino: str):
+        self.camino = camino
+        self._emisiones: Dict[str, _Emision] = {}
+
+    def _soltar(self, clave: str, emision: _Emision) -> None:
+        if self._emisiones.get(clave) is emision:
+            del self._emisiones[clave]
+
+    async def _producir(self, clave: str, emision: _Emision, generador: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async for evento in generador():
+                emision.eventos.append(evento)
+                # Despierta a los suscriptores en espera; los siguientes esperarán al evento nuevo
+                emision.cambio.set()
+                emision.cambio = asyncio.Event()
+        except BaseException as e:
+            emision.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            emision.terminado = True
+            self._soltar(clave, emision)
+            emision.cambio.set()
+
+    async def suscribir(self, clave: str, generador: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        loop = asyncio.get_running_loop()
+        emision = self._emisiones.get(clave)
+        if emision is None or emision.terminado or emision.tarea.get_loop() is not loop:
+            emision = self._emisiones[clave] = _Emision()
+            emision.cambio = asyncio.Event()
+            emision.tarea = loop.create_task(self._producir(clave, emision, generador))
+        else:
+            _contar(self.camino)
+        emision.suscriptores += 1
+        leidos = 0
+        try:
+            while True:
+                while leidos < len(emision.eventos):
+                    leidos += 1
+                    yield emision.eventos[leidos - 1]
+                if emision.terminado:
+                    if emision.error is not None:
+                        raise emision.error
+                    return
+                await emision.cambio.wait()
+        finally:
+            emision.suscriptores -= 1
+            if emision.suscriptores == 0 and not emision.terminado:
+                self._soltar(clave, emision)
+                emision.tarea.cancel()
+
+    def en_vuelo(self) -> int:
+        return len(self._emisiones)
@@ -0,0 +1,146 @@
+import hashlib
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Montaje del contexto antes de llamar al LLM: descarta duplicados casi exactos, une chunks
+# contiguos del mismo documento (quitando el solape del splitter) y llena un presupuesto de tokens
+# por orden de score
+CONTEXTO_MAX_TOKENS = int(os.environ.get("CONTEXTO_MAX_TOKENS", "3000"))
+CONTEXTO_SCORE_MIN = float(os.environ.get("CONTEXTO_SCORE_MIN", "0.0"))
+CONTEXTO_UMBRAL_DUPLICADO = float(os.environ.get("CONTEXTO_UMBRAL_DUPLICADO", "0.85"))
+CONTEXTO_SOLAPE_MAX = int(os.environ.get("CONTEXTO_SOLAPE_MAX", "200"))
+SEPARADOR = "\n---\n"
+
+_PALABRA = re.compile(r"\w+")
+
+
+def contar_tokens(texto: str) -> int:
+    # Aproximación de ~4 caracteres por token, suficiente para repartir el presupuesto
+    return math.ceil(len(texto) / 4)
+
+
+def filtrar_por_score(matches: Sequence[Any], minimo: float = CONTEXTO_SCORE_MIN) -> List[Any]:
+    return [m for m in matches if m.score is None or m.score >= minimo]
+
+
+def _shingles(texto: str) -> set:
+    palabras = _PALABRA.findall(texto.lower())
+    if len(palabras) < 3:
+        return {" ".join(palabras)}
+    return {" ".join(palabras[i:i + 3]) for i in range(len(palabras) - 2)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _unir_solapados(anterior: str, siguiente: str) -> str:
+    # El splitter repite el final del chunk anterior al principio del siguiente
+    for largo in range(min(len(anterior), len(siguiente), CONTEXTO_SOLAPE_MAX), 0, -1):
+        if anterior.endswith(siguiente[:largo]):
+            return anterior + siguiente[largo:]
+    return f"{anterior}\n{siguiente}"
+
+
+class _Pieza:
+    __slots__ = ("texto", "score", "documento", "posicion", "ultima")
+
+    def __init__(self, texto: str, score: float, documento: Optional[str], posicion: Optional[int]):
+        self.texto = texto
+        self.score = score
+        self.documento = documento
+        self.posicion = posicion
+        self.ultima = posicion
+
+
+def _deduplicar(matches: Sequence[Any], umbral: float) -> Tuple[List[_Pieza], int]:
+    piezas: List[_Pieza] = []
+    vistos: set = set()
+    firmas: List[set] = []
+    duplicados = 0
+    for match in sorted(matches, key=lambda m: m.score or 0.0, reverse=True):
+        metadata = match.metadata or {}
+        texto = metadata.get("texto")
+        if not texto:
+            continue
+        clave = hashlib.sha1(" ".join(texto.lower().split()).encode("utf-8")).digest()
+        firma = _shingles(texto)
+        if clave in vistos or any(_jaccard(firma, otra) >= umbral for otra in firmas):
+            duplicados += 1
+            continue
+        vistos.add(clave)
+        firmas.append(firma)
+        posicion = metadata.get("posicion")
+        # Se agrupa por la identidad del documento: dos documentos con el mismo nombre (de ámbitos
+        # distintos) no se fusionan. Los chunks anteriores a guardarla sólo tienen la fuente
+        documento = metadata.get("documento") or metadata.get("fuente")
+        piezas.append(_Pieza(texto, match.score or 0.0, documento, int(posicion) if posicion is not None else None))
+    return piezas, duplicados
+
+
+def _fusionar_contiguos(piezas: List[_Pieza]) -> Tuple[List[_Pieza], int]:
+    por_documento: Dict[str, List[_Pieza]] = {}
+    resultado: List[_Pieza] = []
+    for pieza in piezas:
+        if pieza.documento is None or pieza.posicion is None:
+            resultado.append(pieza)
+        else:
+            por_documento.setdefault(pieza.documento, []).append(pieza)
+    fusionados = 0
+    for grupo in por_documento.values():
+        grupo.sort(key=lambda p: p.posicion)
+        actual = grupo[0]
+        for pieza in grupo[1:]:
+            if pieza.posicion == actual.ultima + 1:
+                actual.texto = _unir_solapados(actual.texto, pieza.texto)
+                actual.score = max(actual.score, pieza.score)
+                actual.ultima = pieza.posicion
+                fusionados += 1
+            else:
+                resultado.append(actual)
+                actual = pieza
+        resultado.append(actual)
+    return resultado, fusionados
+
+
+def empaquetar(
+    matches: Sequence[Any],
+    max_tokens: int = CONTEXTO_MAX_TOKENS,
+    umbral_duplicado: float = CONTEXTO_UMBRAL_DUPLICADO,
+) -> Dict[str, Any]:
+    # Devuelve el texto final y un informe con los tokens ahorrados frente a unir todos los matches
+    originales = [m.metadata["texto"] for m in matches if m.metadata and m.metadata.get("texto")]
+    tokens_originales = contar_tokens(SEPARADOR.join(originales))
+    piezas, duplicados = _deduplicar(matches, umbral_duplicado)
+    piezas, fusionados = _fusionar_contiguos(piezas)
+    piezas.sort(key=lambda p: p.score, reverse=True)
+
+    elegidas: List[str] = []
+    usados = 0
+    fuera_de_presupuesto = 0
+    for pieza in piezas:
+        tokens = contar_tokens(pieza.texto) + (contar_tokens(SEPARADOR) if elegidas else 0)
+        if usados + tokens <= max_tokens:
+            elegidas.append(pieza.texto)
+            usados += tokens
+        elif not elegidas:
+            # El mejor chunk no cabe entero: se recorta antes que mandar un contexto vacío
+            elegidas.append(pieza.texto[: max_tokens * 4])
+            usados = contar_tokens(elegidas[0])
+        else:
+            fuera_de_presupuesto += 1
+    texto = SEPARADOR.join(elegidas)
+    tokens_contexto = contar_tokens(texto)
+    return {
+        "texto": texto,
+        "chunks_originales": len(originales),
+        "chunks_usados": len(elegidas),
+        "duplicados": duplicados,
+        "fusionados": fusionados,
+        "fuera_de_presupuesto": fuera_de_presupuesto,
+        "tokens_originales": tokens_originales,
+        "tokens_contexto": tokens_contexto,
+        "tokens_ahorrados": max(0, tokens_originales - tokens_contexto),
+    }
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Deque, Iterator, List, Optional, Tuple
+
+# fitz (PyMuPDF) y python-docx se importan en la primera extracción, no al arrancar
+# Extracción página a página: los PDF grandes se reparten por rangos de páginas entre procesos
+# (cada proceso abre su propio documento) y las páginas se entregan en orden a medida que llegan,
+# con un número acotado de rangos en vuelo para no acumular el documento entero en memoria
+EXTRACCION_PROCESOS = int(os.environ.get("EXTRACCION_PROCESOS", str(min(4, os.cpu_count() or 1))))
+EXTRACCION_PAGINAS_POR_TAREA = int(os.environ.get("EXTRACCION_PAGINAS_POR_TAREA", "16"))
+EXTRACCION_TXT_BLOQUE = int(os.environ.get("EXTRACCION_TXT_BLOQUE", str(64 * 1024)))
+# Límites al expandir ZIP subidos (número de documentos y bytes descomprimidos en total)
+ZIP_MAX_ARCHIVOS = int(os.environ.get("ZIP_MAX_ARCHIVOS", "1000"))
+ZIP_MAX_MB = float(os.environ.get("ZIP_MAX_MB", "2048"))
+
+EXTENSIONES_SOPORTADAS = (".pdf", ".txt", ".docx")
+
+Pagina = Tuple[Optional[int], str]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    # spawn: el proceso principal tiene hilos (pools, event loop) y fork no es seguro con ellos
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACCION_PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _extraer_rango_pdf(path: str, inicio: int, fin: int) -> List[str]:
+    import fitz
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(inicio, fin)]
+
+
+def paginas_pdf(path: str) -> Iterator[Pagina]:
+    import fitz
+    with fitz.open(path) as doc:
+        total = doc.page_count
+        if EXTRACCION_PROCESOS <= 1 or total <= EXTRACCION_PAGINAS_POR_TAREA:
+            for i, pagina in enumerate(doc, start=1):
+                yield i, pagina.get_text()
+            return
+    pool = _obtener_pool()
+    rangos = iter(range(0, total, EXTRACCION_PAGINAS_POR_TAREA))
+    en_vuelo: Deque[Tuple[int, Future]] = deque()
+
+    def lanzar_siguiente() -> None:
+        inicio = next(rangos, None)
+        if inicio is not None:
+            fin = min(total, inicio + EXTRACCION_PAGINAS_POR_TAREA)
+            en_vuelo.append((inicio, pool.submit(_extraer_rango_pdf, path, inicio, fin)))
+
+    try:
+        for _ in range(EXTRACCION_PROCESOS * 2):
+            lanzar_siguiente()
+        while en_vuelo:
+            inicio, futuro = en_vuelo.popleft()
+            textos = futuro.result()
+            lanzar_siguiente()
+            for i, texto in enumerate(textos, start=inicio + 1):
+                yield i, texto
+    finally:
+        # Si el consumidor abandona (cancelación, error) no se sigue extrayendo
+        for _, futuro in en_vuelo:
+            futuro.cancel()
+
+
+def paginas_docx(path: str) -> Iterator[Pagina]:
+    # DOCX no tiene páginas fijas: se usan los saltos de página que guarda Word (renderizados o manuales)
+    import docx
+    from docx.oxml.ns import qn
+    pagina = 1
+    parrafos: List[str] = []
+    for parrafo in docx.Document(path).paragraphs:
+        saltos = len(parrafo.rendered_page_breaks) or sum(
+            1 for br in parrafo._p.xpath(".//w:br") if br.get(qn("w:type")) == "page"
+        )
+        if saltos and parrafos:
+            yield pagina, "\n".join(parrafos)
+            parrafos = []
+        pagina += saltos
+        parrafos.append(parrafo.text)
+    if parrafos:
+        yield pagina, "\n".join(parrafos)
+
+
+def paginas_txt(path: str) -> Iterator[Pagina]:
+    # Bloques de líneas completas para no partir palabras entre bloques
+    with open(path, "r", encoding="utf-8") as f:
+        bloque: List[str] = []
+        tamano = 0
+        for linea in f:
+            bloque.append(linea)
+            tamano += len(linea)
+            if tamano >= EXTRACCION_TXT_BLOQUE:
+                yield None, "".join(bloque)
+                bloque, tamano = [], 0
+        if bloque:
+            yield None, "".join(bloque)
+
+
+def paginas(path: str, nombre: str) -> Optional[Iterator[Pagina]]:
+    # None si el tipo de archivo no está soportado
+    if nombre.endswith(".pdf"):
+        return paginas_pdf(path)
+    elif nombre.endswith(".txt"):
+        return paginas_txt(path)
+    elif nombre.endswith(".docx"):
+        return paginas_docx(path)
+    return None
+
+
+def soportado(nombre: str) -> bool:
+    return nombre.lower().endswith(EXTENSIONES_SOPORTADAS)
+
+
+def expandir_zip(path: Path, destino: Path) -> Tuple[List[Tuple[Path, str]], List[Tuple[str, str]]]:
+    # Extrae los documentos soportados del ZIP; devuelve (extraídos, rechazados con su motivo).
+    # En disco sólo se usa el nombre base de cada entrada, para que no pueda escribir fuera de
+    # destino; como nombre del documento se conserva la ruta dentro del ZIP.
+    extraidos: List[Tuple[Path, str]] = []
+    rechazados: List[Tuple[str, str]] = []
+    presupuesto = int(ZIP_MAX_MB * 1024 * 1024)
+    with zipfile.ZipFile(path) as archivo:
+        for entrada in archivo.infolist():
+            if entrada.is_dir():
+                continue
+            nombre = Path(entrada.filename).name
+            if not soportado(nombre):
+                rechazados.append((entrada.filename, "Tipo de archivo no soportado."))
+            elif len(extraidos) >= ZIP_MAX_ARCHIVOS:
+                rechazados.append((entrada.filename, f"El ZIP supera {ZIP_MAX_ARCHIVOS} documentos."))
+            elif entrada.file_size > presupuesto:
+                rechazados.append((entrada.filename, "El ZIP supera el tamaño máximo descomprimido."))
+            else:
+                presupuesto -= entrada.file_size
+                salida = destino / f"{uuid.uuid4().hex[:8]}_{nombre}"
+                with archivo.open(entrada) as origen, open(salida, "wb") as f:
+                    shutil.copyfileobj(origen, f, 1024 * 1024)
+                extraidos.append((salida, entrada.filename))
+    return extraidos, rechazados
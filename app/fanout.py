@@ -0,0 +1,129 @@
+import asyncio
+import concurrent.futures
+import heapq
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app import metricas
+from app.vectores import Match
+
+# Búsqueda en varios namespaces (colecciones o tenants del mismo índice): se consultan en paralelo,
+# se espera como mucho FANOUT_TIMEOUT_SEGUNDOS y se fusionan por score. Un namespace lento o caído
+# se descarta en lugar de retrasar la respuesta; la latencia queda acotada por el plazo.
+FANOUT_TIMEOUT_SEGUNDOS = float(os.environ.get("FANOUT_TIMEOUT_SEGUNDOS", "2"))
+FANOUT_MAX_NAMESPACES = int(os.environ.get("FANOUT_MAX_NAMESPACES", "8"))
+# Consultas densas en vuelo por namespace: con uno lento, las siguientes se descartan enseguida en
+# lugar de ocupar más hilos del pool compartido y retrasar a los demás namespaces (0 = sin límite)
+FANOUT_EN_VUELO_NAMESPACE = int(os.environ.get("FANOUT_EN_VUELO_NAMESPACE", "4"))
+# Máximo de resultados de un mismo namespace en la lista fusionada (0 = sin límite)
+FANOUT_CUOTA = int(os.environ.get("FANOUT_CUOTA", "0"))
+# Namespaces que se pueden pedir por la API, separados por comas. Sin configurar sólo el de por
+# defecto: cada namespace puede ser un tenant y la API no debe leer los de otros
+NAMESPACES_PERMITIDOS = tuple(
+    n.strip() for n in os.environ.get("NAMESPACES_PERMITIDOS", "").split(",") if n.strip()
+) or (os.environ.get("PINECONE_NAMESPACE", "Pruebas"),)
+
+
+def normalizar(namespaces: Optional[Sequence[str]], defecto: str) -> List[str]:
+    # Sin repetidos y ordenados: la misma selección da la misma clave de caché y de coalescencia
+    limpios = sorted({n.strip() for n in namespaces or [] if n and n.strip()})
+    return limpios or [defecto]
+
+
+def validar(namespaces: Optional[Sequence[str]]) -> Optional[str]:
+    # Mensaje de error, o None si la selección es válida
+    if not namespaces:
+        return None
+    limpios = {n.strip() for n in namespaces if n and n.strip()}
+    if len(limpios) > FANOUT_MAX_NAMESPACES:
+        return f"Máximo {FANOUT_MAX_NAMESPACES} namespaces por pregunta."
+    desconocidos = sorted(limpios - set(NAMESPACES_PERMITIDOS))
+    if desconocidos:
+        return f"Namespaces no permitidos: {', '.join(desconocidos)}."
+    return None
+
+
+def etiqueta(namespace: str) -> str:
+    # Valor para las métricas: sólo namespaces conocidos, para acotar la cardinalidad
+    return namespace if namespace in NAMESPACES_PERMITIDOS else "otro"
+
+
+def fusionar(listas: Sequence[Sequence[Match]], top_k: int, cuota: Optional[int] = None) -> List[Match]:
+    # Cada lista viene ordenada por score: se mezclan sin reordenar todo, sin ids repetidos
+    # y con como mucho `cuota` resultados por lista
+    cuota = FANOUT_CUOTA if cuota is None else cuota
+    ordenadas = [[(-(m.score or 0.0), fuente, m) for m in lista] for fuente, lista in enumerate(listas)]
+    usados: Dict[int, int] = {}
+    vistos = set()
+    fusionados: List[Match] = []
+    for _, fuente, match in heapq.merge(*ordenadas, key=lambda t: (t[0], t[1])):
+        if match.id in vistos or (cuota > 0 and usados.get(fuente, 0) >= cuota):
+            continue
+        vistos.add(match.id)
+        usados[fuente] = usados.get(fuente, 0) + 1
+        fusionados.append(match)
+        if len(fusionados) >= top_k:
+            break
+    return fusionados
+
+
+# Las consultas se identifican por (namespace, tipo de búsqueda)
+Clave = Tuple[str, str]
+
+
+def _descartar(clave: Clave, motivo: str, error: Optional[BaseException] = None) -> None:
+    namespace, tipo = clave
+    metricas.registro.incrementar("rag_fanout_descartados_total", namespace=etiqueta(namespace), tipo=str(tipo), motivo=motivo)
+    print(f"⚠️ Búsqueda descartada en '{namespace}' ({tipo}): {error or motivo}")
+
+
+_en_vuelo: Dict[str, threading.BoundedSemaphore] = {}
+_en_vuelo_lock = threading.Lock()
+
+
+def reservar(clave: Clave) -> Optional[Callable[[], None]]:
+    # Función que libera la plaza al terminar la consulta, o None si el namespace está saturado
+    if FANOUT_EN_VUELO_NAMESPACE <= 0:
+        return lambda: None
+    with _en_vuelo_lock:
+        semaforo = _en_vuelo.get(clave[0])
+        if semaforo is None:
+            semaforo = _en_vuelo[clave[0]] = threading.BoundedSemaphore(FANOUT_EN_VUELO_NAMESPACE)
+    if not semaforo.acquire(blocking=False):
+        _descartar(clave, "saturado")
+        return None
+    return semaforo.release
+
+
+def _separar(futuros: Dict[Clave, concurrent.futures.Future], hechos: set) -> Dict[Clave, Any]:
+    resultados: Dict[Clave, Any] = {}
+    for clave, futuro in futuros.items():
+        if futuro not in hechos:
+            # La consulta sigue en su hilo hasta que la corta el timeout del upstream; se ignora
+            futuro.cancel()
+            _descartar(clave, "timeout")
+        elif futuro.exception() is not None:
+            _descartar(clave, "error", futuro.exception())
+        else:
+            resultados[clave] = futuro.result()
+    return resultados
+
+
+def recoger(futuros: Dict[Clave, concurrent.futures.Future], timeout: Optional[float] = None) -> Dict[Clave, Any]:
+    # Resultados de las consultas que terminaron bien dentro del plazo, por clave
+    plazo = FANOUT_TIMEOUT_SEGUNDOS if timeout is None else timeout
+    hechos, _ = concurrent.futures.wait(futuros.values(), timeout=plazo)
+    return _separar(futuros, hechos)
+
+
+async def recoger_async(futuros: Dict[Clave, concurrent.futures.Future], timeout: Optional[float] = None) -> Dict[Clave, Any]:
+    if not futuros:
+        return {}
+    plazo = FANOUT_TIMEOUT_SEGUNDOS if timeout is None else timeout
+    envolturas = {asyncio.wrap_future(f): f for f in futuros.values()}
+    hechos, pendientes = await asyncio.wait(envolturas, timeout=plazo)
+    for envoltura in pendientes:
+        # Si acaban fallando más tarde, que el error no se quede sin recoger
+        envoltura.add_done_callback(lambda f: f.cancelled() or f.exception())
+    return _separar(futuros, {envolturas[h] for h in hechos})
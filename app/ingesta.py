@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+# Registro en memoria de los trabajos de ingesta en segundo plano (por proceso)
+INGESTA_TRABAJOS_MAX = int(os.environ.get("INGESTA_TRABAJOS_MAX", "200"))
+# Archivos que se procesan a la vez; el resto espera como "pendiente"
+INGESTA_TRABAJOS_CONCURRENTES = int(os.environ.get("INGESTA_TRABAJOS_CONCURRENTES", "4"))
+
+ESTADOS_FINALES = ("completado", "error", "cancelado")
+
+
+class TrabajoIngesta:
+    def __init__(self, nombre: str):
+        self.id = uuid.uuid4().hex
+        self.nombre = nombre
+        self.estado = "pendiente"
+        self.mensaje = ""
+        self.extraidos = 0
+        self.embebidos = 0
+        self.subidos = 0
+        self.fallidos = 0
+        self.sin_cambios = 0
+        self.eliminados = 0
+        self.creado = time.time()
+        self.finalizado: Optional[float] = None
+        self.cancelado = False
+        self._tarea: Optional[asyncio.Task] = None
+
+    @property
+    def terminado(self) -> bool:
+        return self.estado in ESTADOS_FINALES
+
+    def actualizar(self, etapa: str, hechos: int, total: int) -> None:
+        # Compatible con el callback on_progreso de la ingesta
+        if etapa in ("extraidos", "embebidos", "subidos", "fallidos", "sin_cambios", "eliminados"):
+            setattr(self, etapa, hechos)
+
+    def cancelar(self) -> bool:
+        if self.terminado:
+            return False
+        self.cancelado = True
+        if self._tarea:
+            self._tarea.cancel()
+        return True
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "nombre": self.nombre,
+            "estado": self.estado,
+            "mensaje": self.mensaje,
+            "extraidos": self.extraidos,
+            "embebidos": self.embebidos,
+            "subidos": self.subidos,
+            "fallidos": self.fallidos,
+            "sin_cambios": self.sin_cambios,
+            "eliminados": self.eliminados,
+            "creado": self.creado,
+            "finalizado": self.finalizado,
+        }
+
+
+class LimiteJusto:
+    # Semáforo con una cola por clave (archivo) atendidas por turnos: con varios archivos en curso
+    # las peticiones a los proveedores se reparten entre ellos en vez de servirse por orden de llegada
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self.en_uso = 0
+        self._colas: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    async def adquirir(self, clave: str, timeout: Optional[float] = None) -> None:
+        if self.en_uso < self.capacidad and not self._colas:
+            self.en_uso += 1
+            return
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._colas.setdefault(clave, deque()).append(futuro)
+        # Sin asyncio.wait_for: en 3.11 puede tragarse una cancelación que coincide con el turno
+        plazo = None
+        if timeout is not None:
+            plazo = loop.call_later(timeout, lambda: futuro.done() or futuro.set_exception(asyncio.TimeoutError()))
+        try:
+            await futuro
+        except asyncio.CancelledError:
+            if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+                # El turno llegó a la vez que la cancelación: se devuelve
+                self.liberar()
+            else:
+                self._quitar(clave, futuro)
+            raise
+        except asyncio.TimeoutError:
+            self._quitar(clave, futuro)
+            raise
+        finally:
+            if plazo is not None:
+                plazo.cancel()
+
+    def _quitar(self, clave: str, futuro: asyncio.Future) -> None:
+        cola = self._colas.get(clave)
+        if cola is not None and futuro in cola:
+            cola.remove(futuro)
+            if not cola:
+                del self._colas[clave]
+
+    def liberar(self) -> None:
+        self.en_uso -= 1
+        while self.en_uso < self.capacidad and self._colas:
+            clave, cola = next(iter(self._colas.items()))
+            futuro = cola.popleft()
+            if cola:
+                self._colas.move_to_end(clave)
+            else:
+                del self._colas[clave]
+            if not futuro.done():
+                self.en_uso += 1
+                futuro.set_result(None)
+
+    @property
+    def esperando(self) -> int:
+        return sum(len(cola) for cola in self._colas.values())
+
+    def para(self, clave: str) -> "_Turno":
+        return _Turno(self, clave)
+
+
+class _Turno:
+    def __init__(self, limite: LimiteJusto, clave: str):
+        self.limite = limite
+        self.clave = clave
+
+    async def __aenter__(self) -> None:
+        await self.limite.adquirir(self.clave)
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.limite.liberar()
+
+
+# Las primitivas de asyncio pertenecen a un event loop: una instancia por loop
+_limites: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LimiteJusto]" = weakref.WeakKeyDictionary()
+_semaforos_trabajos: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def limite_compartido(capacidad: int) -> LimiteJusto:
+    loop = asyncio.get_running_loop()
+    limite = _limites.get(loop)
+    if limite is None:
+        limite = _limites[loop] = LimiteJusto(capacidad)
+    return limite
+
+
+def _semaforo_trabajos() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaforo = _semaforos_trabajos.get(loop)
+    if semaforo is None:
+        semaforo = _semaforos_trabajos[loop] = asyncio.Semaphore(INGESTA_TRABAJOS_CONCURRENTES)
+    return semaforo
+
+
+_trabajos: Dict[str, TrabajoIngesta] = {}
+
+
+def _purgar_terminados() -> None:
+    # Conserva como mucho INGESTA_TRABAJOS_MAX trabajos, descartando primero los terminados más antiguos
+    exceso = len(_trabajos) - INGESTA_TRABAJOS_MAX
+    if exceso <= 0:
+        return
+    terminados = sorted((t for t in _trabajos.values() if t.terminado), key=lambda t: t.creado)
+    for trabajo in terminados[:exceso]:
+        del _trabajos[trabajo.id]
+
+
+async def _ejecutar(
+    trabajo: TrabajoIngesta,
+    ejecutar: Callable[[TrabajoIngesta], Awaitable[None]],
+    al_terminar: Optional[Callable[[], None]] = None,
+) -> None:
+    try:
+        async with _semaforo_trabajos():
+            trabajo.estado = "procesando"
+            await ejecutar(trabajo)
+        trabajo.estado = "completado"
+    except asyncio.CancelledError:
+        trabajo.estado = "cancelado"
+        trabajo.mensaje = f"Procesamiento de '{trabajo.nombre}' cancelado."
+        print(f"🛑 Ingesta cancelada: {trabajo.nombre}")
+    except Exception as e:
+        trabajo.estado = "error"
+        trabajo.mensaje = f"Error al procesar el archivo: {e}"
+        print(f"❌ Error en la ingesta de {trabajo.nombre}:", e)
+    finally:
+        if al_terminar is not None:
+            try:
+                al_terminar()
+            except Exception as e:
+                print(f"⚠️ Error al limpiar la ingesta de {trabajo.nombre}:", e)
+        trabajo.finalizado = time.time()
+
+
+def lanzar(
+    nombre: str,
+    ejecutar: Callable[[TrabajoIngesta], Awaitable[None]],
+    al_terminar: Optional[Callable[[], None]] = None,
+) -> TrabajoIngesta:
+    # Debe llamarse desde el event loop: el trabajo sigue corriendo aunque termine el evento que lo lanzó.
+    # al_terminar se llama siempre al acabar (completado, error o cancelado), p. ej. para borrar el archivo
+    trabajo = TrabajoIngesta(nombre)
+    _trabajos[trabajo.id] = trabajo
+    _purgar_terminados()
+    trabajo._tarea = asyncio.get_running_loop().create_task(_ejecutar(trabajo, ejecutar, al_terminar))
+    return trabajo
+
+
+def obtener(job_id: str) -> Optional[TrabajoIngesta]:
+    return _trabajos.get(job_id)
+
+
+def listar() -> List[TrabajoIngesta]:
+    return sorted(_trabajos.values(), key=lambda t: t.creado)
@@ -0,0 +1,198 @@
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Índice aproximado IVF-PQ para el almacén local: k-means grueso para repartir los vectores en
+# listas y cuantización por producto del residuo (m bytes por vector en memoria). La búsqueda
+# recorre las nprobe listas más cercanas y reordena los mejores candidatos con los vectores exactos.
+LOCAL_ANN_MIN_VECTORES = int(os.environ.get("LOCAL_ANN_MIN_VECTORES", "20000"))
+LOCAL_ANN_LISTAS = int(os.environ.get("LOCAL_ANN_LISTAS", "0"))  # 0 = 4 * sqrt(n)
+LOCAL_ANN_SUBESPACIOS = int(os.environ.get("LOCAL_ANN_SUBESPACIOS", "0"))  # 0 = dimensión / 4
+LOCAL_ANN_NPROBE = int(os.environ.get("LOCAL_ANN_NPROBE", "8"))
+LOCAL_ANN_RERANK = int(os.environ.get("LOCAL_ANN_RERANK", "10"))  # candidatos exactos = top_k * RERANK
+LOCAL_ANN_MUESTRA_ENTRENAMIENTO = int(os.environ.get("LOCAL_ANN_MUESTRA_ENTRENAMIENTO", "50000"))
+LOCAL_ANN_ITERACIONES = int(os.environ.get("LOCAL_ANN_ITERACIONES", "10"))
+
+_BLOQUE = 65536
+
+
+def _asignar(datos: np.ndarray, centroides: np.ndarray) -> np.ndarray:
+    # Centroide más cercano en L2, por bloques para acotar la memoria de la matriz de distancias
+    normas = (centroides * centroides).sum(axis=1)
+    asignacion = np.empty(len(datos), dtype=np.int32)
+    for inicio in range(0, len(datos), _BLOQUE):
+        bloque = datos[inicio:inicio + _BLOQUE]
+        asignacion[inicio:inicio + _BLOQUE] = np.argmin(normas - 2 * (bloque @ centroides.T), axis=1)
+    return asignacion
+
+
+def kmeans(datos: np.ndarray, k: int, iteraciones: int, semilla: int = 0) -> np.ndarray:
+    generador = np.random.default_rng(semilla)
+    k = min(k, len(datos))
+    centroides = datos[generador.choice(len(datos), k, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = _asignar(datos, centroides)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, datos)
+        conteos = np.bincount(asignacion, minlength=k)
+        vacios = conteos == 0
+        centroides[~vacios] = sumas[~vacios] / conteos[~vacios, None]
+        # Los centroides vacíos se recolocan sobre puntos al azar
+        if vacios.any():
+            centroides[vacios] = datos[generador.choice(len(datos), int(vacios.sum()), replace=False)]
+    return centroides.astype(np.float32)
+
+
+def _subespacios(dimension: int, pedido: int) -> int:
+    if pedido and dimension % pedido == 0:
+        return pedido
+    m = max(1, dimension // 4)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+class IndiceIVF:
+    def __init__(self, directorio: Path, nprobe: int = LOCAL_ANN_NPROBE, rerank: int = LOCAL_ANN_RERANK):
+        self.path_modelo = directorio / "ivf_modelo.npz"
+        self.path_entradas = directorio / "ivf_entradas.bin"
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.centroides: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None  # (m, ks, dsub)
+        self._filas: List[List[np.ndarray]] = []
+        self._codigos: List[List[np.ndarray]] = []
+        # Entradas en total (incluidas las de filas borradas o reemplazadas) y las que aún no
+        # están en disco, en orden de alta
+        self.entradas = 0
+        self._sin_guardar: List[np.ndarray] = []
+        if self.path_modelo.exists():
+            self._cargar()
+
+    @property
+    def entrenado(self) -> bool:
+        return self.centroides is not None
+
+    @property
+    def _dtype(self) -> np.dtype:
+        return np.dtype([("fila", "<i8"), ("lista", "<i4"), ("codigos", "u1", (self.codebooks.shape[0],))])
+
+    def _cargar(self) -> None:
+        with np.load(self.path_modelo) as modelo:
+            self.centroides = modelo["centroides"]
+            self.codebooks = modelo["codebooks"]
+        self._vaciar_listas()
+        if self.path_entradas.exists():
+            entradas = np.fromfile(self.path_entradas, dtype=self._dtype)
+            self.entradas = len(entradas)
+            self._repartir(entradas)
+
+    def _vaciar_listas(self) -> None:
+        self._filas = [[] for _ in range(len(self.centroides))]
+        self._codigos = [[] for _ in range(len(self.centroides))]
+
+    def _repartir(self, entradas: np.ndarray) -> None:
+        orden = np.argsort(entradas["lista"], kind="stable")
+        entradas = entradas[orden]
+        listas, inicios = np.unique(entradas["lista"], return_index=True)
+        for lista, parte in zip(listas, np.split(entradas, inicios[1:])):
+            self._filas[lista].append(parte["fila"].copy())
+            self._codigos[lista].append(parte["codigos"].copy())
+
+    def entrenar(self, muestra: np.ndarray, listas: int = LOCAL_ANN_LISTAS, subespacios: int = LOCAL_ANN_SUBESPACIOS) -> None:
+        # Sólo en memoria: el modelo y las entradas se escriben con guardar()
+        listas = listas or max(1, int(4 * np.sqrt(len(muestra))))
+        self.centroides = kmeans(muestra, listas, LOCAL_ANN_ITERACIONES)
+        residuos = muestra - self.centroides[_asignar(muestra, self.centroides)]
+        m = _subespacios(muestra.shape[1], subespacios)
+        dsub = muestra.shape[1] // m
+        ks = min(256, len(muestra))
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(residuos[:, j * dsub:(j + 1) * dsub]), ks, LOCAL_ANN_ITERACIONES, semilla=j + 1)
+            for j in range(m)
+        ])
+        self.entradas = 0
+        self._sin_guardar = []
+        self._vaciar_listas()
+
+    def guardar(self) -> None:
+        # Primero las entradas y después el modelo, cada uno con un reemplazo atómico: si el proceso
+        # se corta a medias, al arrancar no hay un modelo con las entradas incompletas
+        temporal = self.path_entradas.with_suffix(".tmp")
+        with open(temporal, "wb") as f:
+            for entradas in self._sin_guardar:
+                entradas.tofile(f)
+        os.replace(temporal, self.path_entradas)
+        self._sin_guardar = []
+        temporal = self.path_modelo.with_name("ivf_modelo.tmp.npz")
+        np.savez(temporal, centroides=self.centroides, codebooks=self.codebooks)
+        os.replace(temporal, self.path_modelo)
+
+    def _codificar(self, residuos: np.ndarray) -> np.ndarray:
+        m, _, dsub = self.codebooks.shape
+        codigos = np.empty((len(residuos), m), dtype=np.uint8)
+        for j in range(m):
+            codigos[:, j] = _asignar(np.ascontiguousarray(residuos[:, j * dsub:(j + 1) * dsub]), self.codebooks[j])
+        return codigos
+
+    def agregar(self, filas: np.ndarray, datos: np.ndarray, persistir: bool = True) -> None:
+        # Alta incremental: se asigna lista, se codifica el residuo y se añade al fichero de entradas
+        listas = _asignar(datos, self.centroides)
+        entradas = np.empty(len(filas), dtype=self._dtype)
+        entradas["fila"] = filas
+        entradas["lista"] = listas
+        entradas["codigos"] = self._codificar(datos - self.centroides[listas])
+        if persistir:
+            with open(self.path_entradas, "ab") as f:
+                entradas.tofile(f)
+        else:
+            self._sin_guardar.append(entradas)
+        self.entradas += len(entradas)
+        self._repartir(entradas)
+
+    def compactar(self, vivos: np.ndarray) -> None:
+        # Deja una entrada por fila viva, la última dada de alta (las anteriores son de un vector
+        # reemplazado o de una fila reutilizada), y reescribe el fichero de entradas
+        entradas = np.fromfile(self.path_entradas, dtype=self._dtype) if self.path_entradas.exists() else np.empty(0, dtype=self._dtype)
+        _, ultimas = np.unique(entradas["fila"][::-1], return_index=True)
+        entradas = entradas[np.sort(len(entradas) - 1 - ultimas)]
+        entradas = entradas[vivos[entradas["fila"]]]
+        temporal = self.path_entradas.with_suffix(".tmp")
+        entradas.tofile(temporal)
+        os.replace(temporal, self.path_entradas)
+        self.entradas = len(entradas)
+        self._vaciar_listas()
+        self._repartir(entradas)
+
+    def _lista(self, lista: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Compacta los trozos añadidos incrementalmente la primera vez que se consulta la lista
+        if len(self._filas[lista]) > 1:
+            self._filas[lista] = [np.concatenate(self._filas[lista])]
+            self._codigos[lista] = [np.concatenate(self._codigos[lista])]
+        if not self._filas[lista]:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.codebooks.shape[0]), dtype=np.uint8)
+        return self._filas[lista][0], self._codigos[lista][0]
+
+    def candidatos(self, consulta: np.ndarray, cantidad: int, nprobe: Optional[int] = None) -> np.ndarray:
+        # Producto interno aproximado: q·centroide + suma de la tabla q_j·codebook_j para cada código
+        m, ks, dsub = self.codebooks.shape
+        puntos_centroides = self.centroides @ consulta
+        nprobe = min(nprobe or self.nprobe, len(self.centroides))
+        sondeadas = np.argpartition(-puntos_centroides, nprobe - 1)[:nprobe]
+        tabla = np.einsum("mkd,md->mk", self.codebooks, consulta.reshape(m, dsub))
+        filas, scores = [], []
+        for lista in sondeadas:
+            filas_lista, codigos = self._lista(int(lista))
+            if len(filas_lista):
+                filas.append(filas_lista)
+                scores.append(puntos_centroides[lista] + tabla[np.arange(m), codigos].sum(axis=1))
+        if not filas:
+            return np.empty(0, dtype=np.int64)
+        filas_todas = np.concatenate(filas)
+        scores_todos = np.concatenate(scores)
+        k = min(cantidad, len(filas_todas))
+        mejores = np.argpartition(-scores_todos, k - 1)[:k]
+        # Una fila re-subida puede aparecer en dos listas; el reordenado exacto usa el vector actual
+        return np.unique(filas_todas[mejores])
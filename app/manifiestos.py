@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.cache_embeddings import normalizar_texto
+
+# Manifiesto por documento: ids (hash de documento + contenido) de los chunks que hay en el índice.
+# Al volver a subir un documento sólo se procesan los chunks nuevos y se borran los que ya no están.
+# El documento es su identidad estable (p. ej. cliente + nombre); la fuente, el nombre que se muestra.
+# Se guarda en disco por defecto: sin él, tras reiniciar no se sabría qué chunks borrar al volver
+# a subir un documento. Con cada id se guarda su posición en el documento: si un chunk conservado
+# cambia de sitio hay que reescribir su metadato posicion. MANIFIESTO_PATH="" lo deja en memoria (pruebas).
+# Los datos persistentes van en DATOS_DIR (por defecto datos/ en la raíz del proyecto), no en el
+# directorio de trabajo de quien importe el módulo
+DATOS_DIR = os.environ.get("DATOS_DIR", str(Path(__file__).resolve().parent.parent / "datos"))
+MANIFIESTO_PATH = os.environ.get("MANIFIESTO_PATH", os.path.join(DATOS_DIR, "manifiestos.db"))
+# Segundos que se reutiliza el recuento de chunks por namespace (lo consulta cada búsqueda)
+MANIFIESTO_TOTAL_TTL = float(os.environ.get("MANIFIESTO_TOTAL_TTL", "5"))
+
+
+def id_chunk(documento: str, texto: str) -> str:
+    return hashlib.sha256(f"{documento}\0{normalizar_texto(texto)}".encode("utf-8")).hexdigest()[:32]
+
+
+class Manifiestos:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or None
+        self._lock = threading.Lock()
+        self._totales: Dict[str, Tuple[float, int]] = {}
+        self._db = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+        if self.path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (namespace TEXT NOT NULL, documento TEXT NOT NULL, fuente TEXT NOT NULL, "
+            "id TEXT NOT NULL, posicion INTEGER, PRIMARY KEY (namespace, documento, id))"
+        )
+        columnas = {fila[1] for fila in self._db.execute("PRAGMA table_info(chunks)")}
+        if "documento" not in columnas:
+            # Manifiesto anterior, indexado sólo por fuente: cada fuente pasa a ser su documento
+            self._db.execute("ALTER TABLE chunks ADD COLUMN documento TEXT NOT NULL DEFAULT ''")
+            self._db.execute("UPDATE chunks SET documento = fuente")
+        if "posicion" not in columnas:
+            # Sin posición conocida: la próxima subida reescribe la de todos sus chunks
+            self._db.execute("ALTER TABLE chunks ADD COLUMN posicion INTEGER")
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_documento ON chunks (namespace, documento)")
+        self._db.commit()
+
+    def obtener(self, namespace: str, documento: str) -> Set[str]:
+        with self._lock:
+            filas = self._db.execute(
+                "SELECT id FROM chunks WHERE namespace = ? AND documento = ?", (namespace, documento)
+            ).fetchall()
+        return {id_ for (id_,) in filas}
+
+    def posiciones(self, namespace: str, documento: str) -> Dict[str, Optional[int]]:
+        with self._lock:
+            filas = self._db.execute(
+                "SELECT id, posicion FROM chunks WHERE namespace = ? AND documento = ?", (namespace, documento)
+            ).fetchall()
+        return dict(filas)
+
+    def reemplazar(
+        self,
+        namespace: str,
+        documento: str,
+        ids: Iterable[str],
+        fuente: Optional[str] = None,
+        posiciones: Optional[Dict[str, Optional[int]]] = None,
+    ) -> None:
+        posiciones = posiciones or {}
+        filas = [(namespace, documento, fuente or documento, id_, posiciones.get(id_)) for id_ in ids]
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM chunks WHERE namespace = ? AND documento = ?", (namespace, documento))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO chunks (namespace, documento, fuente, id, posicion) VALUES (?, ?, ?, ?, ?)", filas
+                )
+            self._totales.pop(namespace, None)
+
+    def total(self, namespace: str) -> int:
+        # Con un manifiesto compartido otro worker puede haber añadido chunks: el recuento caduca
+        ahora = time.monotonic()
+        with self._lock:
+            guardado = self._totales.get(namespace)
+            if guardado is None or ahora - guardado[0] > MANIFIESTO_TOTAL_TTL:
+                (total,) = self._db.execute("SELECT COUNT(*) FROM chunks WHERE namespace = ?", (namespace,)).fetchone()
+                guardado = self._totales[namespace] = (ahora, total)
+            return guardado[1]
+
+    def fuentes(self, namespace: str) -> List[str]:
+        with self._lock:
+            filas = self._db.execute("SELECT DISTINCT fuente FROM chunks WHERE namespace = ? ORDER BY fuente", (namespace,)).fetchall()
+        return [fuente for (fuente,) in filas]
+
+
+def crear_desde_entorno() -> Manifiestos:
+    if MANIFIESTO_PATH:
+        Path(MANIFIESTO_PATH).parent.mkdir(parents=True, exist_ok=True)
+    return Manifiestos(MANIFIESTO_PATH)
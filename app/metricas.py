@@ -0,0 +1,179 @@
+import contextvars
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Métricas en proceso: latencias por etapa (percentiles sobre una ventana de muestras),
+# contadores etiquetados y colectores para exponer estado de otros módulos
+METRICAS_MUESTRAS_MAX = int(os.environ.get("METRICAS_MUESTRAS_MAX", "2048"))
+CUANTILES = (0.5, 0.95, 0.99)
+
+Etiquetas = Tuple[Tuple[str, str], ...]
+
+
+class Histograma:
+    def __init__(self, max_muestras: int):
+        self.muestras: deque = deque(maxlen=max_muestras)
+        self.cantidad = 0
+        self.suma = 0.0
+
+    def observar(self, valor: float) -> None:
+        self.muestras.append(valor)
+        self.cantidad += 1
+        self.suma += valor
+
+    def percentiles(self, cuantiles: Iterable[float] = CUANTILES) -> Dict[float, float]:
+        ordenadas = sorted(self.muestras)
+        if not ordenadas:
+            return {q: 0.0 for q in cuantiles}
+        return {q: ordenadas[min(len(ordenadas) - 1, max(0, math.ceil(q * len(ordenadas)) - 1))] for q in cuantiles}
+
+
+def _escapar(valor: Any) -> str:
+    # Formato de texto de Prometheus: una comilla o un salto de línea romperían la exposición
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registro:
+    def __init__(self, max_muestras: int = METRICAS_MUESTRAS_MAX):
+        self.max_muestras = max_muestras
+        self._lock = threading.Lock()
+        self._latencias: Dict[str, Histograma] = {}
+        self._contadores: Dict[str, Dict[Etiquetas, float]] = {}
+        self._colectores: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+
+    def observar(self, etapa: str, segundos: float) -> None:
+        with self._lock:
+            histograma = self._latencias.get(etapa)
+            if histograma is None:
+                histograma = self._latencias[etapa] = Histograma(self.max_muestras)
+            histograma.observar(segundos)
+
+    def incrementar(self, nombre: str, valor: float = 1, **etiquetas: str) -> None:
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            serie = self._contadores.setdefault(nombre, {})
+            serie[clave] = serie.get(clave, 0) + valor
+
+    def agregar_colector(self, colector: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]) -> None:
+        # El colector devuelve (nombre, etiquetas, valor); los nombres *_total se exponen como counter
+        self._colectores.append(colector)
+
+    def resumen(self) -> Dict[str, Any]:
+        with self._lock:
+            latencias = {
+                etapa: {
+                    "cantidad": h.cantidad,
+                    "suma": round(h.suma, 6),
+                    **{f"p{int(q * 100)}": round(v, 6) for q, v in h.percentiles().items()},
+                }
+                for etapa, h in self._latencias.items()
+            }
+            contadores = {
+                nombre: {",".join(f"{k}={v}" for k, v in clave): valor for clave, valor in serie.items()}
+                for nombre, serie in self._contadores.items()
+            }
+        return {"latencias": latencias, "contadores": contadores}
+
+    def prometheus(self) -> str:
+        lineas: List[str] = []
+        with self._lock:
+            if self._latencias:
+                lineas.append("# HELP rag_etapa_segundos Latencia por etapa del pipeline RAG.")
+                lineas.append("# TYPE rag_etapa_segundos summary")
+                for etapa, h in sorted(self._latencias.items()):
+                    for q, v in h.percentiles().items():
+                        lineas.append(f'rag_etapa_segundos{{etapa="{etapa}",quantile="{q}"}} {v:.6f}')
+                    lineas.append(f'rag_etapa_segundos_sum{{etapa="{etapa}"}} {h.suma:.6f}')
+                    lineas.append(f'rag_etapa_segundos_count{{etapa="{etapa}"}} {h.cantidad}')
+            series = {nombre: dict(serie) for nombre, serie in self._contadores.items()}
+        for colector in list(self._colectores):
+            try:
+                for nombre, etiquetas, valor in colector():
+                    series.setdefault(nombre, {})[tuple(sorted(etiquetas.items()))] = valor
+            except Exception as e:
+                print(f"Error en colector de métricas: {e}")
+        for nombre, serie in sorted(series.items()):
+            lineas.append(f"# TYPE {nombre} {'counter' if nombre.endswith('_total') else 'gauge'}")
+            for clave, valor in sorted(serie.items()):
+                etiquetas = ",".join(f'{k}="{_escapar(v)}"' for k, v in clave)
+                lineas.append(f"{nombre}{{{etiquetas}}} {valor}" if etiquetas else f"{nombre} {valor}")
+        return "\n".join(lineas) + "\n"
+
+    def reiniciar(self) -> None:
+        with self._lock:
+            self._latencias.clear()
+            self._contadores.clear()
+
+
+registro = Registro()
+
+# Tiempos de la petición en curso (ejecutar_rag los devuelve como campos estructurados)
+_tiempos_peticion: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("tiempos_peticion", default=None)
+
+
+@contextmanager
+def recolectar_tiempos() -> Iterator[Dict[str, float]]:
+    tiempos: Dict[str, float] = {}
+    token = _tiempos_peticion.set(tiempos)
+    try:
+        yield tiempos
+    finally:
+        _tiempos_peticion.reset(token)
+
+
+def registrar_tiempo(etapa: str, segundos: float) -> None:
+    registro.observar(etapa, segundos)
+    tiempos = _tiempos_peticion.get()
+    if tiempos is not None:
+        tiempos[etapa] = round(tiempos.get(etapa, 0.0) + segundos, 4)
+
+
+def contar_error(etapa: str) -> None:
+    registro.incrementar("rag_errores_total", etapa=etapa)
+
+
+def registrar_tokens(uso: Any, modelo: str) -> None:
+    # Acepta el objeto usage de OpenAI (o None si el proveedor no lo envía)
+    if uso is None:
+        return
+    for tipo, atributo in (("prompt", "prompt_tokens"), ("completion", "completion_tokens")):
+        valor = getattr(uso, atributo, None)
+        if valor:
+            registro.incrementar("rag_tokens_total", valor, tipo=tipo, modelo=modelo)
+
+
+@contextmanager
+def medir(etapa: str) -> Iterator[None]:
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        contar_error(etapa)
+        raise
+    finally:
+        registrar_tiempo(etapa, time.perf_counter() - inicio)
+
+
+def cronometrado(etapa: str) -> Callable:
+    # Decorador para funciones síncronas o corrutinas
+    def decorador(funcion: Callable) -> Callable:
+        if inspect.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura_async(*args: Any, **kwargs: Any) -> Any:
+                with medir(etapa):
+                    return await funcion(*args, **kwargs)
+            return envoltura_async
+
+        @functools.wraps(funcion)
+        def envoltura(*args: Any, **kwargs: Any) -> Any:
+            with medir(etapa):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
@@ -22,8 +22,7 @@ def chat() -> rx.Component:
                 class_name="bg-blue-600 text-white py-2 px-4 rounded hover:bg-blue-700 mb-4"
             ),
             rx.el.textarea(
-                default_value=RAGState.respuesta,
-                key=RAGState.respuesta,
+                value=RAGState.respuesta,
                 read_only=True,
                 class_name="w-full p-4 border rounded bg-gray-100 text-gray-800 min-h-[200px]",
                 placeholder="La respuesta aparecerá aquí...",
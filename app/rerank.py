@@ -0,0 +1,93 @@
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from app.bm25 import tokenizar
+from app.vectores import Match
+
+# Reordenación local antes de montar el contexto: se recuperan más candidatos (con sus vectores),
+# se puntúan por similitud con la pregunta más un extra por palabras compartidas y se eligen los
+# mejores con maximal marginal relevance, que penaliza los chunks parecidos a los ya elegidos.
+# Así llegan al LLM unos pocos chunks relevantes y distintos en vez de diez casi repetidos.
+RERANK = os.environ.get("RERANK", "true").lower() in ("1", "true", "yes")
+RERANK_CANDIDATOS = int(os.environ.get("RERANK_CANDIDATOS", "30"))
+RERANK_FINAL = int(os.environ.get("RERANK_FINAL", "4"))
+# 1 = sólo relevancia; 0 = sólo diversidad
+RERANK_LAMBDA = float(os.environ.get("RERANK_LAMBDA", "0.7"))
+RERANK_PESO_LEXICO = float(os.environ.get("RERANK_PESO_LEXICO", "0.15"))
+
+
+def _normalizar_filas(matriz: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return np.divide(matriz, normas, out=np.zeros_like(matriz), where=normas > 0)
+
+
+def _matriz(matches: Sequence[Match], dimension: int) -> np.ndarray:
+    # Los matches sin vector (p. ej. sólo léxicos) quedan a cero: no penalizan ni son penalizados
+    matriz = np.zeros((len(matches), dimension), dtype=np.float32)
+    for i, match in enumerate(matches):
+        if match.values is not None and len(match.values) == dimension:
+            matriz[i] = match.values
+    return matriz
+
+
+def solape_lexico(pregunta: str, matches: Sequence[Match]) -> np.ndarray:
+    # Fracción de los términos de la pregunta que aparecen en cada chunk
+    terminos = set(tokenizar(pregunta))
+    if not terminos:
+        return np.zeros(len(matches), dtype=np.float32)
+    return np.array([
+        len(terminos.intersection(tokenizar((m.metadata or {}).get("texto", "")))) / len(terminos)
+        for m in matches
+    ], dtype=np.float32)
+
+
+def mmr(relevancia: np.ndarray, similitudes: np.ndarray, k: int, lambda_: float) -> List[int]:
+    # Índices elegidos, en orden; el máximo parecido con lo ya elegido se actualiza por vector
+    elegidos: List[int] = []
+    disponibles = np.ones(len(relevancia), dtype=bool)
+    parecido = np.zeros(len(relevancia), dtype=np.float32)
+    for _ in range(min(k, len(relevancia))):
+        puntos = lambda_ * relevancia - (1 - lambda_) * parecido
+        puntos[~disponibles] = -np.inf
+        elegido = int(np.argmax(puntos))
+        elegidos.append(elegido)
+        disponibles[elegido] = False
+        if len(elegidos) == 1:
+            parecido = similitudes[elegido].astype(np.float32)
+        else:
+            np.maximum(parecido, similitudes[elegido], out=parecido)
+    return elegidos
+
+
+def reordenar(
+    pregunta: str,
+    embedding: Sequence[float],
+    matches: Sequence[Match],
+    k: Optional[int] = None,
+    lambda_: Optional[float] = None,
+    peso_lexico: Optional[float] = None,
+) -> List[Match]:
+    k = RERANK_FINAL if k is None else k
+    lambda_ = RERANK_LAMBDA if lambda_ is None else lambda_
+    peso_lexico = RERANK_PESO_LEXICO if peso_lexico is None else peso_lexico
+    if len(matches) <= 1:
+        return list(matches)
+    consulta = _normalizar_filas(np.asarray([embedding], dtype=np.float32))[0]
+    vectores = _normalizar_filas(_matriz(matches, len(consulta)))
+    con_vector = vectores.any(axis=1)
+    if not con_vector.any():
+        # El almacén no devolvió vectores: se conserva el orden de la búsqueda
+        return list(matches[:k])
+    densa = vectores @ consulta
+    if not con_vector.all():
+        # Sin vector no hay similitud que medir: se les da la más baja de los demás
+        densa[~con_vector] = densa[con_vector].min()
+    relevancia = densa + peso_lexico * solape_lexico(pregunta, matches)
+    elegidos = mmr(relevancia, vectores @ vectores.T, k, lambda_)
+    # El score pasa a ser la relevancia: el empaquetado del contexto ordena por él
+    return [
+        Match(matches[i].id, float(relevancia[i]), matches[i].metadata, matches[i].values)
+        for i in elegidos
+    ]
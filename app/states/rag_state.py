@@ -2,126 +2,1180 @@ import reflex as rx
 import os
 from dotenv import load_dotenv
 load_dotenv()
-print("🔍 OPENAI_API_KEY:", os.environ.get("OPENAI_API_KEY")) #para asegurarme de que realmente se estan cargando
-print("🔍 PINECONE_API_KEY:", os.environ.get("PINECONE_API_KEY"))
-print("🔍 PINECONE_INDEX_NAME:", os.environ.get("PINECONE_INDEX_NAME"))
 import time
-from pinecone import Pinecone
-from openai import OpenAI
-from typing import List, Dict, Optional
-import fitz
-import docx
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncContextManager, AsyncIterator, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 import uuid
 import json
+import random
 import re
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pathlib import Path
+from app import coalescencia, contexto, extraccion, fanout, ingesta, metricas, rerank, upstream
+from app.bm25 import crear_desde_entorno as crear_indice_lexico, fusion_rrf
+from app.cache_embeddings import crear_desde_entorno as crear_cache_embeddings
+from app.cache_respuestas import crear_desde_entorno as crear_cache_respuestas, huella_contexto
+from app.chunks import Chunk, crear_desde_entorno as crear_divisor
+from app.ingesta import TrabajoIngesta
+from app.manifiestos import Manifiestos, crear_desde_entorno as crear_manifiestos, id_chunk
+from app.metricas import cronometrado
+from app.validacion import validar_pregunta
+from app.vectores import LOCAL_VECTOR_DIR, VECTOR_BACKEND, LocalStore, PineconeStore, VectorStore
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME")
 PINECONE_NAMESPACE = os.environ.get("PINECONE_NAMESPACE", "Pruebas")
-openai_client_instance: Optional[OpenAI] = None
-pinecone_index_instance = None
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHAT_MODEL = "gpt-3.5-turbo"
+# Ingesta por lotes: la API de embeddings acepta listas y Pinecone admite upserts múltiples
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_BATCH_MAX_CHARS = int(os.environ.get("EMBEDDING_BATCH_MAX_CHARS", "100000"))
+UPSERT_BATCH_SIZE = int(os.environ.get("UPSERT_BATCH_SIZE", "100"))
+INGESTA_MAX_REINTENTOS = int(os.environ.get("INGESTA_MAX_REINTENTOS", "3"))
+INGESTA_BACKOFF_SEGUNDOS = float(os.environ.get("INGESTA_BACKOFF_SEGUNDOS", "1.0"))
+# Trabajadores concurrentes del pipeline de ingesta y límite de peticiones simultáneas
+INGESTA_EMBED_WORKERS = int(os.environ.get("INGESTA_EMBED_WORKERS", "4"))
+INGESTA_UPSERT_WORKERS = int(os.environ.get("INGESTA_UPSERT_WORKERS", "2"))
+INGESTA_MAX_EN_VUELO = int(os.environ.get("INGESTA_MAX_EN_VUELO", "6"))
+INGESTA_COLA_MAX = int(os.environ.get("INGESTA_COLA_MAX", "8"))
+INGESTA_POLL_SEGUNDOS = float(os.environ.get("INGESTA_POLL_SEGUNDOS", "0.5"))
+STREAM_UI_INTERVALO = float(os.environ.get("STREAM_UI_INTERVALO", "0.05"))
+# Vida de la cookie con la identidad de la UI (ver RAGState.usuario_id): un año por defecto
+USUARIO_COOKIE_MAX_AGE = int(os.environ.get("USUARIO_COOKIE_MAX_AGE", str(365 * 24 * 3600)))
+_ID_USUARIO = re.compile(r"[0-9a-f]{32}")
+SUBIDA_BLOQUE_BYTES = int(os.environ.get("SUBIDA_BLOQUE_BYTES", str(1024 * 1024)))
+# Archivos por subida (UI y /api/ingest/batch); cada ZIP cuenta como uno
+INGESTA_MAX_ARCHIVOS = int(os.environ.get("INGESTA_MAX_ARCHIVOS", "100"))
+# Endpoint por lotes: tamaño máximo, textos por llamada de embeddings y completions simultáneas
+# (RAG_LOTE_CONCURRENCIA es también el tope de la concurrencia que pida el cliente)
+RAG_LOTE_MAX_PREGUNTAS = int(os.environ.get("RAG_LOTE_MAX_PREGUNTAS", "100"))
+RAG_LOTE_EMBEDDING_MAX = int(os.environ.get("RAG_LOTE_EMBEDDING_MAX", "2048"))
+RAG_LOTE_CONCURRENCIA = int(os.environ.get("RAG_LOTE_CONCURRENCIA", "8"))
+# Hilos dedicados a las consultas al almacén vectorial desde el camino asíncrono
+PINECONE_QUERY_WORKERS = int(os.environ.get("PINECONE_QUERY_WORKERS", "32"))
+# Búsqueda híbrida: BM25 en paralelo con la vectorial y fusión RRF de ambas listas. Sólo se usa
+# en los namespaces que el índice léxico cubre entero (ver _usar_hibrida); desactivada por defecto
+# porque un corpus subido por otra vía no está en el manifiesto y la fusión favorecería lo reciente
+BUSQUEDA_HIBRIDA = os.environ.get("BUSQUEDA_HIBRIDA", "false").lower() in ("1", "true", "yes")
+# Clientes perezosos: se crean en la primera petición que los necesita, no al importar el módulo
+# (arrancar un worker o recoger los tests no paga imports pesados ni llamadas de red)
+openai_client_instance: Optional["OpenAI"] = None
+openai_async_client_instance: Optional["AsyncOpenAI"] = None
+vector_store_instance: Optional[VectorStore] = None
 initialization_error: Optional[str] = None
+_clientes_inicializados = False
+_clientes_lock = threading.Lock()
+cache_embeddings = crear_cache_embeddings()
+cache_respuestas = crear_cache_respuestas()
+indice_lexico = crear_indice_lexico()
+# El manifiesto es un SQLite en disco: también se abre en el primer uso (ver obtener_manifiestos)
+manifiestos_instance: Optional[Manifiestos] = None
+_manifiestos_lock = threading.Lock()
+_executor_pinecone = ThreadPoolExecutor(max_workers=PINECONE_QUERY_WORKERS, thread_name_prefix="pinecone-query")
+# Con el host del índice Pinecone no hace falta resolverlo por la red al crear el cliente
+PINECONE_HOST = os.environ.get("PINECONE_HOST", "")
+# La comprobación de salud (llamada de red al almacén) se cachea durante este tiempo
+SALUD_TTL_SEGUNDOS = float(os.environ.get("SALUD_TTL_SEGUNDOS", "30"))
+_salud: Optional[Dict[str, Any]] = None
+_salud_lock = threading.Lock()
 
-try:
-    if OPENAI_API_KEY:
-        openai_client_instance = OpenAI(api_key=OPENAI_API_KEY)
-    else:
-        initialization_error = "OpenAI API key not found. Please set OPENAI_API_KEY."
-
-    if PINECONE_API_KEY and PINECONE_INDEX_NAME:
-        pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
-        existing_indexes = [idx_spec.name for idx_spec in pinecone_client.list_indexes()]
-        if PINECONE_INDEX_NAME in existing_indexes:
-            pinecone_index_instance = pinecone_client.Index(PINECONE_INDEX_NAME)
-        else:
-            error_msg = f"Pinecone index '{PINECONE_INDEX_NAME}' does not exist. Available indexes: {existing_indexes}."
-            initialization_error = f"{initialization_error}\n{error_msg}" if initialization_error else error_msg
-            print(error_msg)
-    elif not PINECONE_API_KEY:
-        error_msg = "Pinecone API key not found. Please set PINECONE_API_KEY."
-        initialization_error = f"{initialization_error}\n{error_msg}" if initialization_error else error_msg
-    elif not PINECONE_INDEX_NAME:
-        error_msg = "Pinecone index name not found. Please set PINECONE_INDEX_NAME."
-        initialization_error = f"{initialization_error}\n{error_msg}" if initialization_error else error_msg
-except Exception as e:
-    error_msg = f"Error during client initialization: {e}"
+def _agregar_error(error_msg: str) -> None:
+    global initialization_error
     initialization_error = f"{initialization_error}\n{error_msg}" if initialization_error else error_msg
     print(error_msg)
 
+def inicializar_clientes() -> None:
+    # Una sola vez por proceso y segura entre hilos; sólo crea lo que no esté ya asignado
+    # (los tests y benchmarks instalan sus sustitutos directamente en las variables globales)
+    global openai_client_instance, openai_async_client_instance, vector_store_instance, _clientes_inicializados
+    if _clientes_inicializados:
+        return
+    with _clientes_lock:
+        if _clientes_inicializados:
+            return
+        try:
+            if openai_client_instance is None or openai_async_client_instance is None:
+                if OPENAI_API_KEY:
+                    # Pools keep-alive propios y sin reintentos del SDK: los gestiona app.upstream
+                    from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+                    opciones_http = {"limits": upstream.limites_http(), "timeout": upstream.timeout_http()}
+                    openai_client_instance = openai_client_instance or OpenAI(
+                        api_key=OPENAI_API_KEY, max_retries=0, http_client=DefaultHttpxClient(**opciones_http),
+                    )
+                    openai_async_client_instance = openai_async_client_instance or AsyncOpenAI(
+                        api_key=OPENAI_API_KEY, max_retries=0, http_client=DefaultAsyncHttpxClient(**opciones_http),
+                    )
+                else:
+                    _agregar_error("OpenAI API key not found. Please set OPENAI_API_KEY.")
+
+            if vector_store_instance is not None:
+                pass
+            elif VECTOR_BACKEND == "local":
+                # Almacén embebido: no hace falta Pinecone y las búsquedas no salen del proceso
+                vector_store_instance = LocalStore(LOCAL_VECTOR_DIR)
+                print(f"📦 Almacén vectorial local en {LOCAL_VECTOR_DIR}")
+            elif PINECONE_API_KEY and PINECONE_INDEX_NAME:
+                # Sin list_indexes(): si el índice no existe lo detecta la comprobación de salud
+                from pinecone import Pinecone
+                pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
+                opciones = {"connection_pool_maxsize": upstream.UPSTREAM_MAX_CONEXIONES}
+                if PINECONE_HOST:
+                    index = pinecone_client.Index(host=PINECONE_HOST, **opciones)
+                else:
+                    index = pinecone_client.Index(PINECONE_INDEX_NAME, **opciones)
+                vector_store_instance = PineconeStore(index)
+            elif not PINECONE_API_KEY:
+                _agregar_error("Pinecone API key not found. Please set PINECONE_API_KEY.")
+            elif not PINECONE_INDEX_NAME:
+                _agregar_error("Pinecone index name not found. Please set PINECONE_INDEX_NAME.")
+        except Exception as e:
+            _agregar_error(f"Error during client initialization: {e}")
+        _clientes_inicializados = True
+
+def obtener_openai() -> Optional["OpenAI"]:
+    if openai_client_instance is None:
+        inicializar_clientes()
+    return openai_client_instance
+
+def obtener_openai_async() -> Optional["AsyncOpenAI"]:
+    if openai_async_client_instance is None:
+        inicializar_clientes()
+    return openai_async_client_instance
+
+def obtener_vector_store() -> Optional[VectorStore]:
+    if vector_store_instance is None:
+        inicializar_clientes()
+    return vector_store_instance
+
+def obtener_manifiestos() -> Manifiestos:
+    global manifiestos_instance
+    if manifiestos_instance is None:
+        with _manifiestos_lock:
+            if manifiestos_instance is None:
+                manifiestos_instance = crear_manifiestos()
+    return manifiestos_instance
+
+def error_inicializacion() -> Optional[str]:
+    inicializar_clientes()
+    return initialization_error
+
+def _clientes_listos(asincrono: bool = False) -> Optional[str]:
+    # None si todo está listo; si no, el detalle del error
+    cliente = obtener_openai_async() if asincrono else obtener_openai()
+    error = error_inicializacion()
+    if error or not cliente or not obtener_vector_store():
+        return error or "OpenAI or Pinecone client not initialized."
+    return None
+
+def estado_salud(refrescar: bool = False) -> Dict[str, Any]:
+    # Estado de los clientes y del almacén; la llamada de red sólo se repite pasado el TTL
+    global _salud
+    with _salud_lock:
+        ahora = time.time()
+        if not refrescar and _salud is not None and ahora - _salud["comprobado"] < SALUD_TTL_SEGUNDOS:
+            return _salud
+        error = error_inicializacion()
+        store = obtener_vector_store()
+        almacen = "no inicializado"
+        if store is not None:
+            try:
+                store.comprobar()
+                almacen = "ok"
+            except Exception as e:
+                almacen = f"error: {e}"
+        _salud = {
+            "ok": not error and obtener_openai() is not None and almacen == "ok",
+            "openai": "ok" if obtener_openai() is not None else "no inicializado",
+            "vector_store": almacen,
+            "error": error,
+            "comprobado": ahora,
+        }
+        return _salud
+
+def _metricas_estado() -> Iterator[Tuple[str, Dict[str, str], float]]:
+    for nombre, cache in (("embeddings", cache_embeddings), ("respuestas", cache_respuestas)):
+        estadisticas = cache.estadisticas()
+        yield "rag_cache_hits_total", {"cache": nombre}, estadisticas["hits"]
+        yield "rag_cache_misses_total", {"cache": nombre}, estadisticas["misses"]
+    activos = sum(1 for t in ingesta.listar() if not t.terminado)
+    yield "rag_ingestas_activas", {}, activos
+    for camino, vuelo in (("sincrono", _vuelo_rag), ("stream", _difusion_rag),
+                          ("asincrono", _vuelo_rag_async), ("stream_async", _difusion_rag_async)):
+        yield "rag_coalescencia_en_vuelo", {"camino": camino}, vuelo.en_vuelo()
+
+metricas.registro.agregar_colector(_metricas_estado)
+
+@cronometrado("embedding")
 def get_embedding(pregunta: str) -> Optional[List[float]]:
-    if not openai_client_instance:
+    cliente = obtener_openai()
+    if not cliente:
         print("OpenAI client not initialized.")
         return None
+    embedding = cache_embeddings.obtener(EMBEDDING_MODEL, pregunta)
+    if embedding is not None:
+        return embedding
     try:
-        response = openai_client_instance.embeddings.create(
-            input=pregunta, model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        response = upstream.obtener("openai").llamar("embedding", lambda timeout: cliente.embeddings.create(
+            input=pregunta, model=EMBEDDING_MODEL, timeout=timeout
+        ))
+        metricas.registrar_tokens(getattr(response, "usage", None), EMBEDDING_MODEL)
+        embedding = response.data[0].embedding
+        cache_embeddings.guardar(EMBEDDING_MODEL, pregunta, embedding)
+        return embedding
     except Exception as e:
+        metricas.contar_error("embedding")
         print(f"Error getting embedding: {e}")
         return None
 
-def buscar_contexto(embedding: List[float], top_k: int = 10) -> str:
-    if not pinecone_index_instance:
-        print("Pinecone index not initialized.")
-        return "Error: Pinecone index not available."
+@cronometrado("embedding_lote")
+def get_embeddings(textos: List[str]) -> List[List[float]]:
+    # Una sola llamada para los textos que no están en caché; los errores se propagan para poder reintentar
+    cliente = obtener_openai()
+    if not cliente:
+        raise RuntimeError("OpenAI client not initialized.")
+    embeddings = cache_embeddings.obtener_varios(EMBEDDING_MODEL, textos)
+    faltantes = [i for i, e in enumerate(embeddings) if e is None]
+    if not faltantes:
+        return embeddings
+    pendientes = [textos[i] for i in faltantes]
+    response = upstream.obtener("openai").llamar("ingesta", lambda timeout: cliente.embeddings.create(
+        input=pendientes, model=EMBEDDING_MODEL, timeout=timeout
+    ))
+    metricas.registrar_tokens(getattr(response, "usage", None), EMBEDDING_MODEL)
+    datos = sorted(response.data, key=lambda d: d.index)
+    if len(datos) != len(pendientes):
+        raise RuntimeError(f"Se esperaban {len(pendientes)} embeddings y se recibieron {len(datos)}.")
+    nuevos = [d.embedding for d in datos]
+    cache_embeddings.guardar_varios(EMBEDDING_MODEL, pendientes, nuevos)
+    for i, embedding in zip(faltantes, nuevos):
+        embeddings[i] = embedding
+    return embeddings
+
+def _agrupar_en_lotes(
+    textos: Iterable[Any], max_items: int, max_chars: int, medida: Callable[[Any], int] = len
+) -> Iterator[List[Any]]:
+    # Agrupa incrementalmente respetando tanto el número de textos como el total de caracteres
+    lote: List[Any] = []
+    chars = 0
+    for texto in textos:
+        tamano = medida(texto)
+        if lote and (len(lote) >= max_items or chars + tamano > max_chars):
+            yield lote
+            lote = []
+            chars = 0
+        lote.append(texto)
+        chars += tamano
+    if lote:
+        yield lote
+
+async def _con_reintentos_async(
+    operacion: Callable[[], Any],
+    descripcion: str,
+    limite: AsyncContextManager[Any],
+    max_intentos: int = INGESTA_MAX_REINTENTOS,
+) -> Any:
+    # La llamada bloqueante corre en un hilo; el semáforo acota las peticiones en vuelo
+    for intento in range(1, max_intentos + 1):
+        try:
+            async with limite:
+                return await asyncio.to_thread(operacion)
+        except Exception as e:
+            print(f"[X] {descripcion} falló (intento {intento}/{max_intentos}): {e}")
+            if intento == max_intentos:
+                raise
+            # Se respeta lo que indique el proveedor (Retry-After o el circuito abierto); si no, jitter
+            if isinstance(e, upstream.CircuitoAbierto):
+                espera = e.segundos
+            else:
+                espera = upstream.retry_after(e)
+            if espera is None:
+                espera = random.uniform(0, INGESTA_BACKOFF_SEGUNDOS * 2 ** (intento - 1))
+            await asyncio.sleep(espera)
+
+@cronometrado("ingesta_upsert")
+def _upsert_vectores(vectores: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+    store = obtener_vector_store()
+    upstream.obtener("vector_store").llamar("ingesta", lambda timeout: store.upsert(vectores, PINECONE_NAMESPACE, timeout=timeout))
+    # El índice léxico se alimenta con lo que ya está en el almacén vectorial
+    indice_lexico.agregar(((id_, metadata["texto"], metadata) for id_, _, metadata in vectores), PINECONE_NAMESPACE)
+
+@cronometrado("ingesta_borrado")
+def _eliminar_vectores(ids: List[str]) -> None:
+    store = obtener_vector_store()
+    upstream.obtener("vector_store").llamar("ingesta", lambda timeout: store.delete(ids, PINECONE_NAMESPACE, timeout=timeout))
+    indice_lexico.eliminar(ids, PINECONE_NAMESPACE)
+
+@cronometrado("ingesta_metadatos")
+def _actualizar_metadatos(cambios: List[Tuple[str, Dict[str, Any]]]) -> None:
+    store = obtener_vector_store()
+    upstream.obtener("vector_store").llamar("ingesta", lambda timeout: store.actualizar_metadatos(cambios, PINECONE_NAMESPACE, timeout=timeout))
+    indice_lexico.actualizar_metadatos(cambios, PINECONE_NAMESPACE)
+
+def _como_chunks(fragmentos: Iterable[Any]) -> Iterator[Chunk]:
+    # Acepta textos sueltos, pares (texto, página) o chunks con offsets
+    for fragmento in fragmentos:
+        yield Chunk(fragmento) if isinstance(fragmento, str) else Chunk(*fragmento)
+
+def _metadata_chunk(id_: str, fuente: str, posicion: int, chunk: Chunk, documento: Optional[str] = None) -> Dict[str, Any]:
+    metadata = {
+        "id": id_,
+        "fuente": fuente,
+        "documento": documento or fuente,
+        "texto": chunk.texto,
+        "posicion": posicion
+    }
+    # Pinecone no admite metadatos nulos: página y offsets sólo se añaden si se conocen
+    if chunk.pagina is not None:
+        metadata["pagina"] = chunk.pagina
+    if chunk.inicio is not None:
+        metadata["inicio"] = chunk.inicio
+        metadata["fin"] = chunk.fin
+    return metadata
+
+async def ingestar_pipeline(
+    chunks: Iterable[Any],
+    fuente: str,
+    on_progreso: Optional[Callable[[str, int, int], None]] = None,
+    documento: Optional[str] = None,
+) -> Dict[str, int]:
+    # Pipeline productor/consumidor: el productor agrupa chunks en lotes acotados,
+    # N trabajadores piden embeddings y M trabajadores hacen upsert en Pinecone.
+    # Las colas acotadas dan contrapresión y el semáforo limita las peticiones
+    # simultáneas a los proveedores. Cada lote se reintenta por separado: si falla
+    # un upsert se reutilizan los vectores ya calculados.
+    # Los ids son hash de documento + contenido: los chunks que ya figuran en el manifiesto del
+    # documento no se vuelven a embeber ni subir, y al terminar se borran los que ya no están.
+    # documento es la identidad estable (por defecto la fuente): dos documentos distintos con el
+    # mismo nombre no se pisan si tienen documento distinto.
+    # Los chunks conservados que cambian de sitio (p. ej. se insertó un párrafo antes) reciben su
+    # posición nueva sólo en los metadatos: el contexto une chunks contiguos por posición.
+    if not obtener_vector_store():
+        raise RuntimeError("Vector store not initialized.")
+    documento = documento or fuente
+    manifiestos = await asyncio.to_thread(obtener_manifiestos)
+    previos = await asyncio.to_thread(manifiestos.posiciones, PINECONE_NAMESPACE, documento)
+    # id -> posición en esta versión del documento (la primera aparición)
+    vistos: Dict[str, Optional[int]] = {}
+    subidos_ids: set = set()
+    cola_embedding: asyncio.Queue = asyncio.Queue(maxsize=INGESTA_COLA_MAX)
+    cola_upsert: asyncio.Queue = asyncio.Queue(maxsize=INGESTA_COLA_MAX)
+    # Límite compartido por todas las ingestas del proceso, repartido por turnos entre documentos
+    limite = ingesta.limite_compartido(INGESTA_MAX_EN_VUELO).para(fuente)
+    pendientes: List[Tuple[str, List[float], Dict[str, Any]]] = []
+    resultado = {"extraidos": 0, "embebidos": 0, "subidos": 0, "fallidos": 0, "sin_cambios": 0, "eliminados": 0}
+
+    def progreso(etapa: str) -> None:
+        if on_progreso:
+            on_progreso(etapa, resultado[etapa], resultado["extraidos"])
+
+    async def productor() -> None:
+        # La extracción/división puede ser perezosa: cada lote se pide en un hilo
+        lotes = _agrupar_en_lotes(_como_chunks(chunks), EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_CHARS, lambda c: len(c.texto))
+        while True:
+            lote = await asyncio.to_thread(next, lotes, None)
+            if lote is None:
+                break
+            nuevos = []
+            sin_lexico = []
+            movidos = []
+            for posicion, chunk in enumerate(lote, start=resultado["extraidos"]):
+                id_ = id_chunk(documento, chunk.texto)
+                if id_ in vistos:
+                    continue
+                vistos[id_] = posicion
+                if id_ in previos:
+                    resultado["sin_cambios"] += 1
+                    # Tras un reinicio (o en otro worker) el índice léxico puede no tenerlo: se
+                    # reconstruye con el texto, sin volver a embeber ni subir
+                    if not indice_lexico.contiene(id_, PINECONE_NAMESPACE):
+                        metadata = _metadata_chunk(id_, fuente, posicion, chunk, documento)
+                        sin_lexico.append((id_, chunk.texto, metadata))
+                    if previos[id_] != posicion:
+                        movidos.append((id_, {"posicion": posicion, "documento": documento}))
+                else:
+                    nuevos.append((posicion, id_, chunk))
+            if sin_lexico:
+                await asyncio.to_thread(indice_lexico.agregar, sin_lexico, PINECONE_NAMESPACE)
+            if movidos:
+                try:
+                    await _con_reintentos_async(
+                        lambda: _actualizar_metadatos(movidos),
+                        f"Actualización de la posición de {len(movidos)} chunks",
+                        limite,
+                    )
+                except Exception:
+                    # El manifiesto conserva la posición anterior: se reintenta en la próxima subida
+                    for id_, _ in movidos:
+                        vistos[id_] = previos[id_]
+            resultado["extraidos"] += len(lote)
+            progreso("extraidos")
+            progreso("sin_cambios")
+            if nuevos:
+                await cola_embedding.put(nuevos)
+        for _ in range(INGESTA_EMBED_WORKERS):
+            await cola_embedding.put(None)
+
+    async def trabajador_embedding() -> None:
+        while True:
+            item = await cola_embedding.get()
+            if item is None:
+                return
+            textos = [chunk.texto for _, _, chunk in item]
+            try:
+                embeddings = await _con_reintentos_async(
+                    lambda: get_embeddings(textos),
+                    f"Embedding de chunks {item[0][0]}-{item[-1][0]}",
+                    limite,
+                )
+            except Exception:
+                resultado["fallidos"] += len(item)
+                progreso("fallidos")
+                continue
+            for (posicion, id_, chunk), embedding in zip(item, embeddings):
+                pendientes.append((id_, embedding, _metadata_chunk(id_, fuente, posicion, chunk, documento)))
+            resultado["embebidos"] += len(item)
+            progreso("embebidos")
+            while len(pendientes) >= UPSERT_BATCH_SIZE:
+                lote_upsert = pendientes[:UPSERT_BATCH_SIZE]
+                del pendientes[:UPSERT_BATCH_SIZE]
+                await cola_upsert.put(lote_upsert)
+
+    async def trabajador_upsert() -> None:
+        while True:
+            lote = await cola_upsert.get()
+            if lote is None:
+                return
+            try:
+                await _con_reintentos_async(
+                    lambda: _upsert_vectores(lote),
+                    f"Upsert de {len(lote)} vectores",
+                    limite,
+                )
+                subidos_ids.update(id_ for id_, _, _ in lote)
+                resultado["subidos"] += len(lote)
+                progreso("subidos")
+            except Exception:
+                resultado["fallidos"] += len(lote)
+                progreso("fallidos")
+
+    embedders = [asyncio.create_task(trabajador_embedding()) for _ in range(INGESTA_EMBED_WORKERS)]
+    uploaders = [asyncio.create_task(trabajador_upsert()) for _ in range(INGESTA_UPSERT_WORKERS)]
     try:
-        query_response = pinecone_index_instance.query(
-            vector=embedding,
-            top_k=top_k,
-            namespace=PINECONE_NAMESPACE,
-            include_metadata=True,
+        await productor()
+        await asyncio.gather(*embedders)
+        if pendientes:
+            await cola_upsert.put(list(pendientes))
+            pendientes.clear()
+        for _ in uploaders:
+            await cola_upsert.put(None)
+        await asyncio.gather(*uploaders)
+    finally:
+        for tarea in embedders + uploaders:
+            tarea.cancel()
+
+    # Sólo se llega aquí si el documento se recorrió entero: ya se sabe qué chunks sobran.
+    # Un documento sin texto no vacía el manifiesto (sería borrar la versión anterior).
+    if not resultado["extraidos"]:
+        return resultado
+    obsoletos = sorted(previos.keys() - vistos.keys())
+    no_borrados: set = set()
+    for inicio in range(0, len(obsoletos), UPSERT_BATCH_SIZE):
+        lote_borrado = obsoletos[inicio:inicio + UPSERT_BATCH_SIZE]
+        try:
+            await _con_reintentos_async(
+                lambda: _eliminar_vectores(lote_borrado),
+                f"Borrado de {len(lote_borrado)} vectores obsoletos",
+                limite,
+            )
+            resultado["eliminados"] += len(lote_borrado)
+        except Exception:
+            no_borrados.update(lote_borrado)
+    progreso("eliminados")
+    # Los chunks fallidos quedan fuera del manifiesto para reintentarlos en la próxima subida
+    # y los obsoletos que no se pudieron borrar se mantienen para volver a intentarlo
+    manifiesto = (vistos.keys() & (previos.keys() | subidos_ids)) | no_borrados
+    posiciones = {**{id_: previos[id_] for id_ in no_borrados}, **vistos}
+    await asyncio.to_thread(manifiestos.reemplazar, PINECONE_NAMESPACE, documento, manifiesto, fuente, posiciones)
+    return resultado
+
+def ingestar_chunks(
+    chunks: Iterable[str],
+    fuente: str,
+    on_progreso: Optional[Callable[[str, int, int], None]] = None,
+    documento: Optional[str] = None,
+) -> Dict[str, int]:
+    # Variante síncrona para scripts fuera del event loop
+    return asyncio.run(ingestar_pipeline(chunks, fuente, on_progreso, documento))
+
+def _cronometrar_extraccion(paginas: Iterator[Tuple[Optional[int], str]]) -> Iterator[Tuple[Optional[int], str]]:
+    # La extracción se solapa con los embeddings: sólo se mide el tiempo dentro de next()
+    total = 0.0
+    try:
+        while True:
+            inicio = time.perf_counter()
+            try:
+                pagina = next(paginas)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - inicio
+            yield pagina
+    finally:
+        metricas.registrar_tiempo("ingesta_extraccion", total)
+
+@functools.lru_cache(maxsize=1)
+def _divisor() -> Any:
+    # Con CHUNK_UNIDAD=tokens importa tiktoken: se crea al dividir el primer documento
+    return crear_divisor()
+
+def dividir_texto(texto: str) -> Iterator[str]:
+    yield from _divisor().dividir_texto(texto)
+
+def dividir_paginas(paginas: Iterable[Tuple[Optional[int], str]]) -> Iterator[Chunk]:
+    # Los chunks salen hacia los embeddings mientras se extraen las páginas siguientes
+    yield from _divisor().dividir(paginas)
+
+async def guardar_archivo_subido(file: Any, nombre_archivo: str) -> Path:
+    # Prefijo único para que subidas simultáneas con el mismo nombre no se pisen
+    path = rx.get_upload_dir() / f"{uuid.uuid4().hex[:8]}_{Path(nombre_archivo).name}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Copia por bloques: la subida nunca está entera en memoria
+    with open(path, "wb") as f:
+        while True:
+            bloque = await file.read(SUBIDA_BLOQUE_BYTES)
+            if not bloque:
+                break
+            await asyncio.to_thread(f.write, bloque)
+    print(f"📂 Guardado como: {path}")
+    return path
+
+async def ingestar_archivo(path: Path, nombre_archivo: str, trabajo: TrabajoIngesta, documento: Optional[str] = None) -> None:
+    nombre = nombre_archivo.lower()
+    with metricas.medir("ingesta_total"):
+        paginas = extraccion.paginas(str(path), nombre)
+        if paginas is None:
+            raise ValueError("Tipo de archivo no soportado.")
+        resultado = await ingestar_pipeline(
+            dividir_paginas(_cronometrar_extraccion(paginas)), nombre, on_progreso=trabajo.actualizar, documento=documento
         )
-        context_parts = []
-        for match in query_response.matches:
-            if match.metadata and "texto" in match.metadata:
-                context_parts.append(match.metadata["texto"])
-        return "\n---\n".join(context_parts)
+        if not resultado["extraidos"]:
+            raise ValueError("El archivo está vacío o no se pudo leer texto.")
+    metricas.registro.incrementar("rag_chunks_ingestados_total", resultado["subidos"])
+    if resultado["fallidos"]:
+        metricas.registro.incrementar("rag_chunks_fallidos_total", resultado["fallidos"])
+    trabajo.mensaje = f"Documento '{nombre_archivo}' procesado correctamente. Chunks: {resultado['subidos']}"
+    if resultado["sin_cambios"] or resultado["eliminados"]:
+        trabajo.mensaje += f" (sin cambios: {resultado['sin_cambios']}, eliminados: {resultado['eliminados']})"
+    if resultado["fallidos"]:
+        trabajo.mensaje += f" (fallidos: {resultado['fallidos']})"
+    print(f"✅ Procesamiento exitoso: {nombre_archivo}")
+
+def documento_de(nombre_archivo: str, ambito: str = "") -> str:
+    # Identidad estable del documento: el nombre dentro del ámbito de quien lo sube (cliente de la
+    # API o usuario_id de la UI). Volver a subirlo lo reemplaza; otro cliente con el mismo nombre no
+    return f"{ambito}/{nombre_archivo.lower()}" if ambito else nombre_archivo.lower()
+
+def lanzar_ingesta(path: Path, nombre_archivo: str, documento: Optional[str] = None) -> TrabajoIngesta:
+    # El archivo subido (o extraído de un ZIP) se borra al acabar el trabajo, salga bien o mal
+    return ingesta.lanzar(
+        nombre_archivo,
+        lambda trabajo: ingestar_archivo(path, nombre_archivo, trabajo, documento),
+        lambda: path.unlink(missing_ok=True),
+    )
+
+async def preparar_subidas(subidas: List[Tuple[Path, str]]) -> Tuple[List[Tuple[Path, str]], List[Dict[str, str]]]:
+    # Expande los ZIP y aparta los tipos no soportados; devuelve (documentos, rechazados)
+    documentos: List[Tuple[Path, str]] = []
+    rechazados: List[Dict[str, str]] = []
+    for path, nombre in subidas:
+        if nombre.lower().endswith(".zip"):
+            try:
+                extraidos, fuera = await asyncio.to_thread(extraccion.expandir_zip, path, path.parent)
+                documentos.extend(extraidos)
+                rechazados.extend({"nombre": f"{nombre}/{n}", "error": motivo} for n, motivo in fuera)
+            except Exception as e:
+                rechazados.append({"nombre": nombre, "error": f"No se pudo abrir el ZIP: {e}"})
+            finally:
+                path.unlink(missing_ok=True)
+        elif extraccion.soportado(nombre):
+            documentos.append((path, nombre))
+        else:
+            rechazados.append({"nombre": nombre, "error": "Tipo de archivo no soportado."})
+            path.unlink(missing_ok=True)
+    return documentos, rechazados
+
+def lanzar_ingesta_lote(documentos: List[Tuple[Path, str]], ambito: str = "") -> List[TrabajoIngesta]:
+    # Un trabajo por documento: progreso y errores por archivo. ingesta limita cuántos corren a
+    # la vez y el límite compartido de peticiones reparte los turnos entre ellos.
+    return [lanzar_ingesta(path, nombre, documento_de(nombre, ambito)) for path, nombre in documentos]
+
+@cronometrado("busqueda")
+def buscar_matches(embedding: List[float], top_k: int = 10, namespace: Optional[str] = None, hasta: Optional[float] = None) -> List[Any]:
+    # Los errores se propagan; buscar_contexto los convierte en mensaje.
+    # hasta (time.monotonic): plazo de quien espera el resultado, p. ej. el del fan-out
+    store = obtener_vector_store()
+    if not store:
+        raise RuntimeError("Vector store not available.")
+    if hasta is not None and hasta <= time.monotonic():
+        # Esperó en el pool más que el plazo: nadie va a usar el resultado
+        raise TimeoutError("Plazo de la búsqueda agotado.")
+    matches = upstream.obtener("vector_store").llamar("busqueda", lambda timeout: store.query(
+        embedding, top_k, namespace or PINECONE_NAMESPACE, include_metadata=True, include_values=rerank.RERANK, timeout=timeout
+    ), hasta)
+    return contexto.filtrar_por_score(matches)
+
+@cronometrado("busqueda_lexica")
+def buscar_lexico(pregunta: str, top_k: int = 10, namespace: Optional[str] = None) -> List[Any]:
+    return indice_lexico.buscar(pregunta, top_k, namespace or PINECONE_NAMESPACE)
+
+def _usar_hibrida(namespace: Optional[str] = None) -> bool:
+    # El índice léxico tiene que cubrir todos los chunks del manifiesto: con uno a medias (memoria
+    # tras reiniciar, otro worker) RRF sólo premiaría los documentos subidos por este proceso
+    if not BUSQUEDA_HIBRIDA:
+        return False
+    namespace = namespace or PINECONE_NAMESPACE
+    total = obtener_manifiestos().total(namespace)
+    return total > 0 and indice_lexico.documentos(namespace) >= total
+
+def _fusionar(densos: List[Any], lexicos: Optional[List[Any]], top_k: int) -> List[Any]:
+    return fusion_rrf([densos, lexicos], top_k) if lexicos else densos
+
+def buscar_hibrido(pregunta: str, embedding: List[float], top_k: int = 10, namespace: Optional[str] = None) -> List[Any]:
+    # La búsqueda léxica corre en el pool mientras este hilo consulta el almacén vectorial;
+    # si falla se sigue sólo con los resultados densos
+    if not _usar_hibrida(namespace):
+        return buscar_matches(embedding, top_k, namespace)
+    futuro = _executor_pinecone.submit(contextvars.copy_context().run, buscar_lexico, pregunta, top_k, namespace)
+    densos = buscar_matches(embedding, top_k, namespace)
+    try:
+        lexicos = futuro.result()
+    except Exception as e:
+        print(f"Error en la búsqueda léxica: {e}")
+        lexicos = None
+    return _fusionar(densos, lexicos, top_k)
+
+def _clave_namespaces(namespaces: Optional[List[str]]) -> str:
+    return ",".join(namespaces or [PINECONE_NAMESPACE])
+
+def _buscar_lexico_si_cubre(pregunta: str, top_k: int, namespace: str) -> List[Any]:
+    # Corre en el pool: _usar_hibrida consulta el manifiesto (SQLite). Una lista vacía no altera la fusión
+    return buscar_lexico(pregunta, top_k, namespace) if _usar_hibrida(namespace) else []
+
+def _lanzar_fanout(pregunta: str, embedding: List[float], top_k: int, namespaces: List[str]) -> Dict[fanout.Clave, Any]:
+    # Todas las consultas al pool a la vez: una densa por namespace y, con la búsqueda híbrida, una
+    # léxica que sólo busca si el índice léxico cubre el namespace.
+    # Las densas llevan el plazo del fan-out, así una consulta abandonada suelta el hilo al vencer
+    # y no al agotar el presupuesto de la etapa
+    hasta = time.monotonic() + fanout.FANOUT_TIMEOUT_SEGUNDOS
+    futuros: Dict[fanout.Clave, Any] = {}
+    for namespace in namespaces:
+        liberar = fanout.reservar((namespace, "densa"))
+        if liberar is not None:
+            futuro = _executor_pinecone.submit(
+                contextvars.copy_context().run, buscar_matches, embedding, top_k, namespace, hasta
+            )
+            # También si se cancela antes de empezar
+            futuro.add_done_callback(lambda _, liberar=liberar: liberar())
+            futuros[(namespace, "densa")] = futuro
+        if BUSQUEDA_HIBRIDA:
+            futuros[(namespace, "lexica")] = _executor_pinecone.submit(
+                contextvars.copy_context().run, _buscar_lexico_si_cubre, pregunta, top_k, namespace
+            )
+    return futuros
+
+def _fusionar_fanout(namespaces: List[str], resultados: Dict[fanout.Clave, List[Any]], top_k: int) -> List[Any]:
+    # Densos y léxicos se fusionan por separado (sus scores no son comparables) y después con RRF
+    densos = [resultados[(n, "densa")] for n in namespaces if (n, "densa") in resultados]
+    if not densos:
+        raise RuntimeError(f"Ningún namespace respondió a tiempo ({', '.join(namespaces)}).")
+    lexicos = [resultados[(n, "lexica")] for n in namespaces if (n, "lexica") in resultados]
+    return _fusionar(fanout.fusionar(densos, top_k), fanout.fusionar(lexicos, top_k) if lexicos else None, top_k)
+
+def buscar_namespaces(pregunta: str, embedding: List[float], namespaces: Optional[List[str]] = None, top_k: int = 10) -> List[Any]:
+    # Con un solo namespace, la búsqueda de siempre; con varios, en paralelo y con plazo
+    namespaces = namespaces or [PINECONE_NAMESPACE]
+    if len(namespaces) == 1:
+        return buscar_hibrido(pregunta, embedding, top_k, namespaces[0])
+    futuros = _lanzar_fanout(pregunta, embedding, top_k, namespaces)
+    return _fusionar_fanout(namespaces, fanout.recoger(futuros), top_k)
+
+def _top_k_busqueda() -> int:
+    # Con la reordenación se recuperan más candidatos de los que llegarán al contexto
+    return rerank.RERANK_CANDIDATOS if rerank.RERANK else 10
+
+@cronometrado("rerank")
+def reordenar_matches(pregunta: str, embedding: List[float], matches: List[Any]) -> List[Any]:
+    if not rerank.RERANK:
+        return matches
+    return rerank.reordenar(pregunta, embedding, matches)
+
+@cronometrado("contexto")
+def contexto_desde_matches(matches: List[Any]) -> str:
+    # Sin duplicados, con los chunks contiguos unidos y dentro de CONTEXTO_MAX_TOKENS
+    empaquetado = contexto.empaquetar(matches)
+    metricas.registro.incrementar("rag_contexto_tokens_total", empaquetado["tokens_contexto"])
+    metricas.registro.incrementar("rag_contexto_tokens_ahorrados_total", empaquetado["tokens_ahorrados"])
+    return empaquetado["texto"]
+
+def buscar_contexto(embedding: List[float], top_k: int = 10) -> str:
+    if not obtener_vector_store():
+        print("Vector store not initialized.")
+        return "Error: Vector store not available."
+    try:
+        return contexto_desde_matches(buscar_matches(embedding, top_k))
     except Exception as e:
         print(f"Error searching context: {e}")
         return f"Error searching context: {e}"
 
-def generar_respuesta_openai(pregunta: str, contexto: str) -> str:
-    if not openai_client_instance:
-        print("OpenAI client not initialized.")
-        return "Error: OpenAI client not available."
-    system_prompt = "Responde exclusivamente con la información proporcionada en el contexto. No agregues conocimientos previos ni información externa. Si no puedes responder con el contexto, di que no hay suficiente información."
+SYSTEM_PROMPT = "Responde exclusivamente con la información proporcionada en el contexto. No agregues conocimientos previos ni información externa. Si no puedes responder con el contexto, di que no hay suficiente información."
+
+def _mensajes_rag(pregunta: str, contexto: str) -> List[Dict[str, str]]:
     user_prompt = f"{contexto}\n\nPregunta: {pregunta}"
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": system_prompt},
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt},
     ]
+
+@cronometrado("generacion")
+def generar_respuesta_openai(pregunta: str, contexto: str) -> str:
+    cliente = obtener_openai()
+    if not cliente:
+        print("OpenAI client not initialized.")
+        return "Error: OpenAI client not available."
+    messages = _mensajes_rag(pregunta, contexto)
     try:
-        response = openai_client_instance.chat.completions.create(
-            model="gpt-3.5-turbo", messages=messages, temperature=0,
-        )
+        response = upstream.obtener("openai").llamar("chat", lambda timeout: cliente.chat.completions.create(
+            model=CHAT_MODEL, messages=messages, temperature=0, timeout=timeout,
+        ))
+        metricas.registrar_tokens(getattr(response, "usage", None), CHAT_MODEL)
         if response.choices and response.choices[0].message and response.choices[0].message.content:
             return response.choices[0].message.content
         else:
             return "No response content from AI."
     except Exception as e:
+        metricas.contar_error("generacion")
         print(f"Error generating answer with OpenAI: {e}")
         return f"Error generating answer with OpenAI: {e}"
 
-def responder_pregunta_rag(pregunta: str) -> str:
-    if initialization_error or not openai_client_instance or (not pinecone_index_instance):
-        error_detail = initialization_error or "OpenAI or Pinecone client not initialized."
-        return f"Error: Services not properly initialized. Please check configuration and logs. Detail: {error_detail}"
-    start_time = time.time()
+def generar_respuesta_openai_stream(pregunta: str, contexto: str, tiempos: Optional[Dict[str, float]] = None) -> Iterator[str]:
+    # Devuelve los fragmentos de texto a medida que llegan; los errores se propagan.
+    # Registra el tiempo hasta el primer fragmento y el total de la generación.
+    cliente = obtener_openai()
+    if not cliente:
+        raise RuntimeError("OpenAI client not available.")
+    inicio = time.perf_counter()
+    primero = True
+    try:
+        # Sólo se reintenta el establecimiento del stream: con fragmentos ya enviados no se repite
+        response = upstream.obtener("openai").llamar("chat", lambda timeout: cliente.chat.completions.create(
+            model=CHAT_MODEL, messages=_mensajes_rag(pregunta, contexto), temperature=0,
+            stream=True, stream_options={"include_usage": True}, timeout=timeout,
+        ))
+        for chunk in response:
+            metricas.registrar_tokens(getattr(chunk, "usage", None), CHAT_MODEL)
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                if primero:
+                    primero = False
+                    _registrar_etapa("primer_token", time.perf_counter() - inicio, tiempos)
+                yield chunk.choices[0].delta.content
+    except Exception:
+        metricas.contar_error("generacion")
+        raise
+    _registrar_etapa("generacion", time.perf_counter() - inicio, tiempos)
+
+def _registrar_etapa(etapa: str, segundos: float, tiempos: Optional[Dict[str, float]]) -> None:
+    metricas.registrar_tiempo(etapa, segundos)
+    if tiempos is not None:
+        tiempos[etapa] = round(segundos, 4)
+
+def _respuesta_cacheable(respuesta: str) -> bool:
+    return not respuesta.startswith("Error") and respuesta != "No response content from AI."
+
+def _recuperar(pregunta: str, namespaces: Optional[List[str]] = None) -> Tuple[Optional[str], Optional[List[float]], List[Any]]:
+    # Embedding + búsqueda; devuelve (error, embedding, matches)
+    error_detail = _clientes_listos()
+    if error_detail:
+        return f"Error: Services not properly initialized. Please check configuration and logs. Detail: {error_detail}", None, []
     embedding = get_embedding(pregunta)
     if embedding is None:
-        return "Error: No se pudo generar el embedding para la pregunta."
-    contexto = buscar_contexto(embedding)
-    if contexto.startswith("Error:"):
-        return contexto
-    respuesta_content = generar_respuesta_openai(pregunta, contexto)
-    end_time = time.time()
-    segundos = round(end_time - start_time, 2)
+        return "Error: No se pudo generar el embedding para la pregunta.", None, []
+    try:
+        matches = buscar_namespaces(pregunta, embedding, namespaces, _top_k_busqueda())
+    except Exception as e:
+        print(f"Error searching context: {e}")
+        return f"Error: No se pudo buscar el contexto: {e}", embedding, []
+    return None, embedding, reordenar_matches(pregunta, embedding, matches)
+
+def _resultado_rag(
+    start_time: float,
+    respuesta: str = "",
+    error: Optional[str] = None,
+    cache: bool = False,
+    tiempos: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    return {
+        "respuesta": respuesta,
+        "error": error,
+        "cache": cache,
+        "segundos": round(time.time() - start_time, 2),
+        "tiempos": dict(tiempos or {}),
+    }
+
+def _ejecutar_rag(pregunta: str, namespaces: Optional[List[str]] = None) -> Dict[str, Any]:
+    # Resultado estructurado: respuesta, error, si vino de la caché, tiempo total y por etapa
+    start_time = time.time()
+    with metricas.medir("rag_total"), metricas.recolectar_tiempos() as tiempos:
+        error, embedding, matches = _recuperar(pregunta, namespaces)
+        if error:
+            return _resultado_rag(start_time, error=error, tiempos=tiempos)
+        huella = huella_contexto(_clave_namespaces(namespaces), [m.id for m in matches])
+        cacheada = cache_respuestas.buscar(embedding, huella)
+        if cacheada is not None:
+            return _resultado_rag(start_time, cacheada[0], cache=True, tiempos=tiempos)
+        respuesta_content = generar_respuesta_openai(pregunta, contexto_desde_matches(matches))
+        if _respuesta_cacheable(respuesta_content):
+            cache_respuestas.guardar(embedding, huella, respuesta_content)
+        return _resultado_rag(start_time, respuesta_content, tiempos=tiempos)
+
+def _responder_pregunta_rag_stream(pregunta: str, namespaces: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    # Eventos {"tipo": "token", "texto": ...} y un último {"tipo": "fin", ...resultado de ejecutar_rag}
+    start_time = time.time()
+    # El contexto de tiempos no debe quedar abierto entre yields
+    with metricas.recolectar_tiempos() as tiempos:
+        error, embedding, matches = _recuperar(pregunta, namespaces)
+    if error:
+        yield {"tipo": "fin", **_resultado_rag(start_time, error=error, tiempos=tiempos)}
+        return
+    huella = huella_contexto(_clave_namespaces(namespaces), [m.id for m in matches])
+    cacheada = cache_respuestas.buscar(embedding, huella)
+    if cacheada is not None:
+        yield {"tipo": "token", "texto": cacheada[0]}
+        yield {"tipo": "fin", **_resultado_rag(start_time, cacheada[0], cache=True, tiempos=tiempos)}
+        return
+    partes: List[str] = []
+    try:
+        for texto in generar_respuesta_openai_stream(pregunta, contexto_desde_matches(matches), tiempos):
+            partes.append(texto)
+            yield {"tipo": "token", "texto": texto}
+    except Exception as e:
+        print(f"Error generating answer with OpenAI: {e}")
+        yield {"tipo": "fin", **_resultado_rag(start_time, "".join(partes), error=f"Error generating answer with OpenAI: {e}", tiempos=tiempos)}
+        return
+    respuesta_content = "".join(partes) or "No response content from AI."
+    if _respuesta_cacheable(respuesta_content):
+        cache_respuestas.guardar(embedding, huella, respuesta_content)
+    metricas.registrar_tiempo("rag_total", time.time() - start_time)
+    yield {"tipo": "fin", **_resultado_rag(start_time, respuesta_content, tiempos=tiempos)}
+
+# Coalescencia: las preguntas idénticas simultáneas comparten una única ejecución del pipeline
+_vuelo_rag = coalescencia.Vuelo("sincrono")
+_difusion_rag = coalescencia.Difusion("stream")
+_vuelo_rag_async = coalescencia.VueloAsync("asincrono")
+_difusion_rag_async = coalescencia.DifusionAsync("stream_async")
+
+def ejecutar_rag(pregunta: str, namespaces: Optional[List[str]] = None) -> Dict[str, Any]:
+    namespaces = fanout.normalizar(namespaces, PINECONE_NAMESPACE)
+    if not coalescencia.COALESCENCIA:
+        return _ejecutar_rag(pregunta, namespaces)
+    return _vuelo_rag.hacer(
+        coalescencia.clave(_clave_namespaces(namespaces), pregunta), lambda: _ejecutar_rag(pregunta, namespaces)
+    )
+
+def responder_pregunta_rag_stream(pregunta: str, namespaces: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    namespaces = fanout.normalizar(namespaces, PINECONE_NAMESPACE)
+    if not coalescencia.COALESCENCIA:
+        return _responder_pregunta_rag_stream(pregunta, namespaces)
+    return _difusion_rag.suscribir(
+        coalescencia.clave(_clave_namespaces(namespaces), pregunta), lambda: _responder_pregunta_rag_stream(pregunta, namespaces)
+    )
+
+# --- Camino asíncrono: OpenAI con AsyncOpenAI y Pinecone en un pool de hilos dedicado ---
+# Nada que toque disco o bloquee locks compartidos con los hilos corre en el bucle de eventos:
+# la caché de embeddings en SQLite, la de respuestas y el manifiesto van a un hilo
+
+async def _cache_embeddings_async(operacion: Callable[..., Any], *args: Any) -> Any:
+    # La caché sólo en memoria responde en microsegundos: el salto a un hilo costaría más
+    if cache_embeddings.persistente:
+        return await asyncio.to_thread(operacion, *args)
+    return operacion(*args)
+
+@cronometrado("embedding")
+async def get_embedding_async(pregunta: str) -> Optional[List[float]]:
+    cliente = obtener_openai_async()
+    if not cliente:
+        print("OpenAI client not initialized.")
+        return None
+    embedding = await _cache_embeddings_async(cache_embeddings.obtener, EMBEDDING_MODEL, pregunta)
+    if embedding is not None:
+        return embedding
+    try:
+        response = await upstream.obtener("openai").llamar_async("embedding", lambda timeout: cliente.embeddings.create(
+            input=pregunta, model=EMBEDDING_MODEL, timeout=timeout
+        ))
+        metricas.registrar_tokens(getattr(response, "usage", None), EMBEDDING_MODEL)
+        embedding = response.data[0].embedding
+        await _cache_embeddings_async(cache_embeddings.guardar, EMBEDDING_MODEL, pregunta, embedding)
+        return embedding
+    except Exception as e:
+        metricas.contar_error("embedding")
+        print(f"Error getting embedding: {e}")
+        return None
+
+@cronometrado("embedding_lote")
+async def get_embeddings_async(textos: List[str]) -> List[List[float]]:
+    # Igual que get_embeddings: una llamada para los textos que no están en caché
+    cliente = obtener_openai_async()
+    if not cliente:
+        raise RuntimeError("OpenAI client not initialized.")
+    embeddings = await _cache_embeddings_async(cache_embeddings.obtener_varios, EMBEDDING_MODEL, textos)
+    faltantes = [i for i, e in enumerate(embeddings) if e is None]
+    if not faltantes:
+        return embeddings
+    pendientes = [textos[i] for i in faltantes]
+    response = await upstream.obtener("openai").llamar_async("embedding", lambda timeout: cliente.embeddings.create(
+        input=pendientes, model=EMBEDDING_MODEL, timeout=timeout
+    ))
+    metricas.registrar_tokens(getattr(response, "usage", None), EMBEDDING_MODEL)
+    datos = sorted(response.data, key=lambda d: d.index)
+    if len(datos) != len(pendientes):
+        raise RuntimeError(f"Se esperaban {len(pendientes)} embeddings y se recibieron {len(datos)}.")
+    nuevos = [d.embedding for d in datos]
+    await _cache_embeddings_async(cache_embeddings.guardar_varios, EMBEDDING_MODEL, pendientes, nuevos)
+    for i, embedding in zip(faltantes, nuevos):
+        embeddings[i] = embedding
+    return embeddings
+
+async def buscar_matches_async(embedding: List[float], top_k: int = 10, namespace: Optional[str] = None) -> List[Any]:
+    # run_in_executor no propaga el contexto: se copia para que los tiempos lleguen a la petición
+    loop = asyncio.get_running_loop()
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(_executor_pinecone, contexto.run, buscar_matches, embedding, top_k, namespace)
+
+async def buscar_hibrido_async(pregunta: str, embedding: List[float], top_k: int = 10, namespace: Optional[str] = None) -> List[Any]:
+    if not BUSQUEDA_HIBRIDA or not await asyncio.to_thread(_usar_hibrida, namespace):
+        return await buscar_matches_async(embedding, top_k, namespace)
+    loop = asyncio.get_running_loop()
+    densos, lexicos = await asyncio.gather(
+        buscar_matches_async(embedding, top_k, namespace),
+        loop.run_in_executor(_executor_pinecone, contextvars.copy_context().run, buscar_lexico, pregunta, top_k, namespace),
+        return_exceptions=True,
+    )
+    if isinstance(densos, BaseException):
+        raise densos
+    if isinstance(lexicos, BaseException):
+        print(f"Error en la búsqueda léxica: {lexicos}")
+        lexicos = None
+    return _fusionar(densos, lexicos, top_k)
+
+async def buscar_namespaces_async(
+    pregunta: str, embedding: List[float], namespaces: Optional[List[str]] = None, top_k: int = 10
+) -> List[Any]:
+    namespaces = namespaces or [PINECONE_NAMESPACE]
+    if len(namespaces) == 1:
+        return await buscar_hibrido_async(pregunta, embedding, top_k, namespaces[0])
+    futuros = _lanzar_fanout(pregunta, embedding, top_k, namespaces)
+    return _fusionar_fanout(namespaces, await fanout.recoger_async(futuros), top_k)
+
+@cronometrado("generacion")
+async def generar_respuesta_openai_async(pregunta: str, contexto: str) -> str:
+    cliente = obtener_openai_async()
+    if not cliente:
+        print("OpenAI client not initialized.")
+        return "Error: OpenAI client not available."
+    try:
+        response = await upstream.obtener("openai").llamar_async("chat", lambda timeout: cliente.chat.completions.create(
+            model=CHAT_MODEL, messages=_mensajes_rag(pregunta, contexto), temperature=0, timeout=timeout,
+        ))
+        metricas.registrar_tokens(getattr(response, "usage", None), CHAT_MODEL)
+        if response.choices and response.choices[0].message and response.choices[0].message.content:
+            return response.choices[0].message.content
+        else:
+            return "No response content from AI."
+    except Exception as e:
+        metricas.contar_error("generacion")
+        print(f"Error generating answer with OpenAI: {e}")
+        return f"Error generating answer with OpenAI: {e}"
+
+async def generar_respuesta_openai_stream_async(
+    pregunta: str, contexto: str, tiempos: Optional[Dict[str, float]] = None
+) -> AsyncIterator[str]:
+    cliente = obtener_openai_async()
+    if not cliente:
+        raise RuntimeError("OpenAI client not available.")
+    inicio = time.perf_counter()
+    primero = True
+    try:
+        response = await upstream.obtener("openai").llamar_async("chat", lambda timeout: cliente.chat.completions.create(
+            model=CHAT_MODEL, messages=_mensajes_rag(pregunta, contexto), temperature=0,
+            stream=True, stream_options={"include_usage": True}, timeout=timeout,
+        ))
+        async for chunk in response:
+            metricas.registrar_tokens(getattr(chunk, "usage", None), CHAT_MODEL)
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                if primero:
+                    primero = False
+                    _registrar_etapa("primer_token", time.perf_counter() - inicio, tiempos)
+                yield chunk.choices[0].delta.content
+    except Exception:
+        metricas.contar_error("generacion")
+        raise
+    _registrar_etapa("generacion", time.perf_counter() - inicio, tiempos)
+
+async def _recuperar_async(pregunta: str, namespaces: Optional[List[str]] = None) -> Tuple[Optional[str], Optional[List[float]], List[Any]]:
+    error_detail = _clientes_listos(asincrono=True)
+    if error_detail:
+        return f"Error: Services not properly initialized. Please check configuration and logs. Detail: {error_detail}", None, []
+    embedding = await get_embedding_async(pregunta)
+    if embedding is None:
+        return "Error: No se pudo generar el embedding para la pregunta.", None, []
+    try:
+        matches = await buscar_namespaces_async(pregunta, embedding, namespaces, _top_k_busqueda())
+    except Exception as e:
+        print(f"Error searching context: {e}")
+        return f"Error: No se pudo buscar el contexto: {e}", embedding, []
+    return None, embedding, reordenar_matches(pregunta, embedding, matches)
+
+async def _ejecutar_rag_async(pregunta: str, namespaces: Optional[List[str]] = None) -> Dict[str, Any]:
+    start_time = time.time()
+    with metricas.medir("rag_total"), metricas.recolectar_tiempos() as tiempos:
+        error, embedding, matches = await _recuperar_async(pregunta, namespaces)
+        if error:
+            return _resultado_rag(start_time, error=error, tiempos=tiempos)
+        huella = huella_contexto(_clave_namespaces(namespaces), [m.id for m in matches])
+        cacheada = await asyncio.to_thread(cache_respuestas.buscar, embedding, huella)
+        if cacheada is not None:
+            return _resultado_rag(start_time, cacheada[0], cache=True, tiempos=tiempos)
+        respuesta_content = await generar_respuesta_openai_async(pregunta, contexto_desde_matches(matches))
+        if _respuesta_cacheable(respuesta_content):
+            await asyncio.to_thread(cache_respuestas.guardar, embedding, huella, respuesta_content)
+        return _resultado_rag(start_time, respuesta_content, tiempos=tiempos)
+
+async def ejecutar_rag_async(pregunta: str, namespaces: Optional[List[str]] = None) -> Dict[str, Any]:
+    namespaces = fanout.normalizar(namespaces, PINECONE_NAMESPACE)
+    if not coalescencia.COALESCENCIA:
+        return await _ejecutar_rag_async(pregunta, namespaces)
+    return await _vuelo_rag_async.hacer(
+        coalescencia.clave(_clave_namespaces(namespaces), pregunta), lambda: _ejecutar_rag_async(pregunta, namespaces)
+    )
+
+async def responder_pregunta_rag_async(pregunta: str) -> str:
+    return formatear_respuesta(await ejecutar_rag_async(pregunta))
+
+async def _responder_pregunta_rag_stream_async(pregunta: str, namespaces: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    # Mismo protocolo de eventos que responder_pregunta_rag_stream
+    start_time = time.time()
+    with metricas.recolectar_tiempos() as tiempos:
+        error, embedding, matches = await _recuperar_async(pregunta, namespaces)
+    if error:
+        yield {"tipo": "fin", **_resultado_rag(start_time, error=error, tiempos=tiempos)}
+        return
+    huella = huella_contexto(_clave_namespaces(namespaces), [m.id for m in matches])
+    cacheada = await asyncio.to_thread(cache_respuestas.buscar, embedding, huella)
+    if cacheada is not None:
+        yield {"tipo": "token", "texto": cacheada[0]}
+        yield {"tipo": "fin", **_resultado_rag(start_time, cacheada[0], cache=True, tiempos=tiempos)}
+        return
+    partes: List[str] = []
+    try:
+        async for texto in generar_respuesta_openai_stream_async(pregunta, contexto_desde_matches(matches), tiempos):
+            partes.append(texto)
+            yield {"tipo": "token", "texto": texto}
+    except Exception as e:
+        print(f"Error generating answer with OpenAI: {e}")
+        yield {"tipo": "fin", **_resultado_rag(start_time, "".join(partes), error=f"Error generating answer with OpenAI: {e}", tiempos=tiempos)}
+        return
+    respuesta_content = "".join(partes) or "No response content from AI."
+    if _respuesta_cacheable(respuesta_content):
+        await asyncio.to_thread(cache_respuestas.guardar, embedding, huella, respuesta_content)
+    metricas.registrar_tiempo("rag_total", time.time() - start_time)
+    yield {"tipo": "fin", **_resultado_rag(start_time, respuesta_content, tiempos=tiempos)}
+
+def responder_pregunta_rag_stream_async(pregunta: str, namespaces: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    namespaces = fanout.normalizar(namespaces, PINECONE_NAMESPACE)
+    if not coalescencia.COALESCENCIA:
+        return _responder_pregunta_rag_stream_async(pregunta, namespaces)
+    return _difusion_rag_async.suscribir(
+        coalescencia.clave(_clave_namespaces(namespaces), pregunta), lambda: _responder_pregunta_rag_stream_async(pregunta, namespaces)
+    )
+
+async def ejecutar_rag_lote_async(
+    preguntas: List[str], concurrencia: int = RAG_LOTE_CONCURRENCIA, namespaces: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    # Embeddings compartidos en el menor número de llamadas, búsquedas concurrentes y
+    # completions con un límite de concurrencia. Devuelve un resultado por pregunta, en orden.
+    start_time = time.time()
+    namespaces = fanout.normalizar(namespaces, PINECONE_NAMESPACE)
+    error_detail = _clientes_listos(asincrono=True)
+    if error_detail:
+        error = f"Error: Services not properly initialized. Please check configuration and logs. Detail: {error_detail}"
+        return [_resultado_rag(start_time, error=error) for _ in preguntas]
+
+    embeddings: List[Optional[List[float]]] = [None] * len(preguntas)
+    errores: List[Optional[str]] = [None] * len(preguntas)
+
+    async def embeber(inicio: int, lote: List[str]) -> None:
+        try:
+            for i, embedding in enumerate(await get_embeddings_async(lote), start=inicio):
+                embeddings[i] = embedding
+        except Exception as e:
+            print(f"Error getting embeddings: {e}")
+            for i in range(inicio, inicio + len(lote)):
+                errores[i] = f"Error: No se pudo generar el embedding para la pregunta: {e}"
+
+    tareas = []
+    inicio = 0
+    for lote in _agrupar_en_lotes(preguntas, RAG_LOTE_EMBEDDING_MAX, EMBEDDING_BATCH_MAX_CHARS):
+        tareas.append(embeber(inicio, lote))
+        inicio += len(lote)
+    await asyncio.gather(*tareas)
+    segundos_embedding = round(time.time() - start_time, 4)
+
+    semaforo = asyncio.Semaphore(max(1, concurrencia))
+
+    async def responder(i: int) -> Dict[str, Any]:
+        # Cada pregunta corre en su propia tarea, con su propio contexto de tiempos
+        with metricas.recolectar_tiempos() as tiempos:
+            tiempos["embedding"] = segundos_embedding
+            if errores[i]:
+                return _resultado_rag(start_time, error=errores[i], tiempos=tiempos)
+            try:
+                matches = await buscar_namespaces_async(preguntas[i], embeddings[i], namespaces, _top_k_busqueda())
+            except Exception as e:
+                print(f"Error searching context: {e}")
+                return _resultado_rag(start_time, error=f"Error: No se pudo buscar el contexto: {e}", tiempos=tiempos)
+            matches = reordenar_matches(preguntas[i], embeddings[i], matches)
+            huella = huella_contexto(_clave_namespaces(namespaces), [m.id for m in matches])
+            cacheada = await asyncio.to_thread(cache_respuestas.buscar, embeddings[i], huella)
+            if cacheada is not None:
+                return _resultado_rag(start_time, cacheada[0], cache=True, tiempos=tiempos)
+            async with semaforo:
+                respuesta_content = await generar_respuesta_openai_async(preguntas[i], contexto_desde_matches(matches))
+            if _respuesta_cacheable(respuesta_content):
+                await asyncio.to_thread(cache_respuestas.guardar, embeddings[i], huella, respuesta_content)
+            return _resultado_rag(start_time, respuesta_content, tiempos=tiempos)
+
+    return list(await asyncio.gather(*(responder(i) for i in range(len(preguntas)))))
+
+def formatear_respuesta(resultado: Dict[str, Any]) -> str:
+    if resultado["error"]:
+        return resultado["error"]
+    segundos = resultado["segundos"]
     minutos = round(segundos / 60, 2)
-    return f"Respuesta:\n{respuesta_content}\n\nTiempo de respuesta: {segundos} segundos ({minutos} minutos)"
+    texto = f"Respuesta:\n{resultado['respuesta']}\n\nTiempo de respuesta: {segundos} segundos ({minutos} minutos)"
+    if resultado["cache"]:
+        texto += "\n(Respuesta servida desde caché)"
+    return texto
+
+def responder_pregunta_rag(pregunta: str) -> str:
+    return formatear_respuesta(ejecutar_rag(pregunta))
 
 class RAGState(rx.State):
     pregunta: str = ""
@@ -130,14 +1184,23 @@ class RAGState(rx.State):
     error_message: str = ""
     archivo_subido: str = ""
     mensaje_procesamiento: str = ""
+    trabajos_ingesta: list[dict[str, str]] = []
+    _lote_actual: str = ""
+    # Identidad de quien sube documentos desde la UI (no hay usuarios): un id aleatorio que genera
+    # el servidor y guarda una cookie persistente. Sobrevive a recargas, pestañas y cambios de IP y
+    # distingue navegadores detrás de la misma NAT; no se puede adivinar el de otro
+    usuario_id: str = rx.Cookie("", name="rag_usuario", max_age=USUARIO_COOKIE_MAX_AGE, same_site="strict")
+    _subidas_pendientes: list[list[str]] = []
+    _sondeo_activo: bool = False
 
     def _check_clients_initialized_internal(self) -> str:
-        if initialization_error:
-            return f"Error de inicialización: {initialization_error}. Por favor, verifica las variables de entorno (OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_INDEX_NAME) y la configuración del índice en Pinecone."
-        if not openai_client_instance:
+        error = error_inicializacion()
+        if error:
+            return f"Error de inicialización: {error}. Por favor, verifica las variables de entorno (OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_INDEX_NAME) y la configuración del índice en Pinecone."
+        if not obtener_openai():
             return "El cliente de OpenAI no está inicializado. Verifica OPENAI_API_KEY."
-        if not pinecone_index_instance:
-            return "El índice de Pinecone no está inicializado. Verifica PINECONE_API_KEY, PINECONE_INDEX_NAME y que el índice exista."
+        if not obtener_vector_store():
+            return "El almacén vectorial no está inicializado. Verifica PINECONE_API_KEY y PINECONE_INDEX_NAME (o usa VECTOR_BACKEND=local)."
         return ""
 
     @rx.event(background=True)        
@@ -147,50 +1210,11 @@ class RAGState(rx.State):
             self.respuesta = ""
             self.error_message = ""
             texto = self.pregunta.strip()
-            #Validación: campo vacío
-            if not texto:
-                mensaje= "Por favor,escribe una pregunta."
-                self.respuesta = mensaje
-                self.error_message = mensaje
-                self.is_loading = False
-                yield
-                return
-            # Validación: emojis
-            emoji_pattern = re.compile("[\U0001F600-\U0001F64F"
-                           "\U0001F300-\U0001F5FF"
-                           "\U0001F680-\U0001F6FF"
-                           "\U0001F1E0-\U0001F1FF"
-                           "\U00002700-\U000027BF"
-                           "\U0001F900-\U0001F9FF"
-                           "\U00002600-\U000026FF]+", flags=re.UNICODE)
-            if emoji_pattern.search(texto):
-                mensaje = "No se permiten emojis en la pregunta."
-                self.respuesta = mensaje
-                self.error_message = mensaje
-                self.is_loading = False
-                yield
-                return
-            #Validación: solo caracteres latinos
-            if re.search(r"[^\u0000-\u007FáéíóúÁÉÍÓÚñÑüÜçÇ\s.,;:?!¿¡()\"'-]", texto):
-                mensaje = "Solo se permite ingresar texto en alfabeto latino."
-                self.respuesta = mensaje
-                self.error_message = mensaje
-                self.is_loading = False
-                yield
-                return
-            #Validación: debe contener al menos una letra
-            if not re.search(r"[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]", texto):
-                mensaje = "La pregunta debe contener letras."
-                self.respuesta = mensaje
-                self.error_message = mensaje
-                self.is_loading = False
-                yield
-                return
-            # Validación: al menos 3 palabras
-            if len(texto.split()) < 3:
-                mensaje = "La pregunta debe contener al menos 3 palabras."
-                self.respuesta = mensaje
-                self.error_message = mensaje
+            # Validación antes de cualquier llamada a los proveedores
+            error = validar_pregunta(texto)
+            if error:
+                self.respuesta = error.mensaje
+                self.error_message = error.mensaje
                 self.is_loading = False
                 yield
                 return
@@ -204,16 +1228,30 @@ class RAGState(rx.State):
                 yield
             return
 
-        generated_response = responder_pregunta_rag(self.pregunta)
-        async with self:
-            self.respuesta = generated_response
-            if generated_response.startswith("Error:"):
-                self.error_message = generated_response
-            self.is_loading = False
-            yield
+        # Los fragmentos se vuelcan a la UI como mucho cada STREAM_UI_INTERVALO
+        parcial = ""
+        ultimo_envio = 0.0
+        async for evento in responder_pregunta_rag_stream_async(texto):
+            if evento["tipo"] == "token":
+                parcial += evento["texto"]
+                if time.time() - ultimo_envio >= STREAM_UI_INTERVALO:
+                    ultimo_envio = time.time()
+                    async with self:
+                        self.respuesta = f"Respuesta:\n{parcial}"
+                        yield
+                continue
+            generated_response = formatear_respuesta(evento)
+            async with self:
+                self.respuesta = generated_response
+                if evento["error"]:
+                    self.error_message = generated_response
+                self.is_loading = False
+                yield
 
     @rx.event
     async def procesar_archivo(self, files: list[rx.UploadFile]):
+        # Sólo guarda los archivos; expandir los ZIP y lanzar los trabajos va en segundo plano
+        # para no retener el estado de la sesión (y con él el chat) mientras tanto
         print("➡️ Evento 'procesar_archivo' disparado.")
 
         if not files:            
@@ -221,68 +1259,100 @@ class RAGState(rx.State):
             print("⚠️ No se recibió ningún archivo.")                
             return
 
-        file = files[0]
-        print(f"📁 Archivo recibido: {file.name}")
+        subidas = []
+        for file in files:
+            print(f"📁 Archivo recibido: {file.name}")
+            subidas.append([str(await guardar_archivo_subido(file, file.name)), file.name])
+        # Las rutas se quedan en una variable de backend: el evento encadenado no lleva argumentos
+        # que pasen por el navegador y un cliente pueda falsear
+        self._subidas_pendientes = self._subidas_pendientes + subidas
+        self.mensaje_procesamiento = "Procesando documento..."
+        return RAGState.lanzar_subidas
 
-        content = await file.read()
-        path = rx.get_upload_dir() / file.name
-        with open(path, "wb") as f:
-            f.write(content)
-        print(f"📂 Guardado como: {path}")
+    @rx.event(background=True)
+    async def lanzar_subidas(self):
+        async with self:
+            subidas, self._subidas_pendientes = self._subidas_pendientes, []
+            if not _ID_USUARIO.fullmatch(self.usuario_id):
+                self.usuario_id = uuid.uuid4().hex
+            ambito = "ui:" + self.usuario_id
+        # Sólo se aceptan archivos del directorio de subidas: ni se ingesta ni se borra nada de fuera
+        propias = [(Path(path), nombre) for path, nombre in subidas if _en_subidas(Path(path))]
+        documentos, rechazados = await preparar_subidas(propias)
+        rechazados += [
+            {"nombre": nombre, "error": "Ruta de subida no válida."} for path, nombre in subidas if not _en_subidas(Path(path))
+        ]
+        trabajos = lanzar_ingesta_lote(documentos, ambito)
+        lote = uuid.uuid4().hex[:8]
+        async with self:
+            # Los rechazados aparecen en la lista como trabajos con error, sin seguimiento
+            nuevos = [{**_resumen_trabajo(t), "lote": lote} for t in trabajos] + [
+                {"id": "", "nombre": r["nombre"], "estado": "error", "progreso": "", "mensaje": r["error"], "lote": lote}
+                for r in rechazados
+            ]
+            self.trabajos_ingesta = _podar_trabajos(self.trabajos_ingesta + nuevos, ingesta.INGESTA_TRABAJOS_MAX)
+            self._lote_actual = lote
+            self.mensaje_procesamiento = "Procesando documento..." if trabajos else "Ningún archivo admitido."
+            # Un único sondeo por sesión refresca todos los trabajos activos, sean del lote que sean
+            sondear = bool(trabajos) and not self._sondeo_activo
+            if sondear:
+                self._sondeo_activo = True
+        try:
+            while sondear:
+                async with self:
+                    self.trabajos_ingesta = [_refrescar_trabajo(t) for t in self.trabajos_ingesta]
+                    actuales = [t for t in self.trabajos_ingesta if t["lote"] == self._lote_actual]
+                    # El mensaje final es del último lote y espera a que terminen todos sus archivos
+                    if self.mensaje_procesamiento == "Procesando documento..." and all(
+                        t["estado"] in ingesta.ESTADOS_FINALES for t in actuales
+                    ):
+                        self.mensaje_procesamiento = actuales[0]["mensaje"] if len(actuales) == 1 else _resumen_lote(actuales)
+                    sondear = any(t["estado"] not in ingesta.ESTADOS_FINALES for t in self.trabajos_ingesta)
+                    self._sondeo_activo = sondear
+                if sondear:
+                    await asyncio.sleep(INGESTA_POLL_SEGUNDOS)
+        finally:
+            if sondear:
+                # Error o cancelación (p. ej. al desconectarse): la próxima subida vuelve a sondear
+                async with self:
+                    self._sondeo_activo = False
 
-        nombre = file.name.lower()
+    @rx.event
+    def cancelar_ingesta(self, job_id: str):
+        trabajo = ingesta.obtener(job_id)
+        if trabajo is not None:
+            trabajo.cancelar()
 
-        texto = ""
 
-        # Procesamiento de texto
-        try:
-            if nombre.endswith(".pdf"):                
-                doc = fitz.open(str(path))
-                texto = "".join(p.get_text() for p in doc)
-            elif nombre.endswith(".txt"):
-                with open(path, "r", encoding="utf-8") as f:
-                    texto = f.read()
-            elif nombre.endswith(".docx"):                
-                doc = docx.Document(str(path))
-                texto = "\n".join(p.text for p in doc.paragraphs)
-            else:            
-                self.mensaje_procesamiento = "Tipo de archivo no soportado."                
-                return
-        except Exception as e:   
-            self.mensaje_procesamiento = f"Error al procesar el archivo: {e}"
-            print("❌ Error procesando archivo:", e)
-            return 
-        
-        # Validación: texto vacío
-        if not texto.strip():
-            self.mensaje_procesamiento = "El archivo está vacío o no se pudo leer texto."
-            print("⚠️ Archivo sin texto útil.")
-            return
+def _en_subidas(path: Path) -> bool:
+    return path.resolve().is_relative_to(rx.get_upload_dir().resolve())
 
-        
-        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        chunks = splitter.split_text(texto)
-        metadatos = []
+def _resumen_lote(trabajos: List[Dict[str, str]]) -> str:
+    completados = sum(1 for t in trabajos if t["estado"] == "completado")
+    return f"Documentos procesados: {completados} de {len(trabajos)}."
 
-        for i, chunk in enumerate(chunks):
-            try:
-                embedding = get_embedding(chunk)
-                metadata = {
-                    "id": str(uuid.uuid4()),
-                    "fuente": nombre,
-                    "texto": chunk,
-                    "posicion": i
-                }
-                pinecone_index_instance.upsert([(metadata["id"], embedding, metadata)], namespace=PINECONE_NAMESPACE)
-                metadatos.append(metadata)
-            except Exception as e:
-                print(f"[X] Error en chunk {i}: {e}")
+def _refrescar_trabajo(resumen: Dict[str, str]) -> Dict[str, str]:
+    if not resumen["id"] or resumen["estado"] in ingesta.ESTADOS_FINALES:
+        return resumen
+    trabajo = ingesta.obtener(resumen["id"])
+    if trabajo is None:
+        # El registro sólo purga trabajos terminados, pero ya no se sabe cómo acabó
+        return {**resumen, "estado": "error", "mensaje": "Trabajo no encontrado."}
+    return {**_resumen_trabajo(trabajo), "lote": resumen["lote"]}
 
+def _podar_trabajos(trabajos: List[Dict[str, str]], maximo: int) -> List[Dict[str, str]]:
+    # Descarta los terminados más antiguos; los activos se conservan para seguir su progreso
+    exceso = len(trabajos) - maximo
+    if exceso <= 0:
+        return trabajos
+    fuera = set([i for i, t in enumerate(trabajos) if t["estado"] in ingesta.ESTADOS_FINALES][:exceso])
+    return [t for i, t in enumerate(trabajos) if i not in fuera]
 
-        self.mensaje_procesamiento = (
-        f"Documento '{file.name}' procesado correctamente. Chunks: {len(metadatos)}"
-        )
-        print("✅ Procesamiento exitoso.")
-        
-        
-            
+def _resumen_trabajo(trabajo: TrabajoIngesta) -> Dict[str, str]:
+    return {
+        "id": trabajo.id,
+        "nombre": trabajo.nombre,
+        "estado": trabajo.estado,
+        "progreso": f"{trabajo.extraidos} extraídos · {trabajo.sin_cambios} sin cambios · {trabajo.embebidos} embebidos · {trabajo.subidos} subidos",
+        "mensaje": trabajo.mensaje,
+    }
@@ -0,0 +1,325 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, NamedTuple, Optional, Tuple, TypeVar
+
+from app import metricas
+
+# Capa común para las llamadas a proveedores (OpenAI, Pinecone): pools de conexiones
+# persistentes, timeout y presupuesto total por etapa, reintentos con backoff exponencial
+# con jitter que respeta Retry-After, y un circuito por proveedor que falla rápido
+# cuando está caído en lugar de acumular peticiones esperando timeouts.
+UPSTREAM_MAX_CONEXIONES = int(os.environ.get("UPSTREAM_MAX_CONEXIONES", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_SEGUNDOS = float(os.environ.get("UPSTREAM_KEEPALIVE_SEGUNDOS", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "0.25"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "8"))
+# Fallos seguidos que abren el circuito y segundos hasta dejar pasar una petición de prueba
+CIRCUITO_UMBRAL_FALLOS = int(os.environ.get("CIRCUITO_UMBRAL_FALLOS", "5"))
+CIRCUITO_ENFRIAMIENTO_SEGUNDOS = float(os.environ.get("CIRCUITO_ENFRIAMIENTO_SEGUNDOS", "30"))
+
+
+class Politica(NamedTuple):
+    timeout: float       # segundos por intento
+    reintentos: int      # intentos adicionales tras el primero
+    presupuesto: float   # segundos en total, contando esperas entre intentos
+
+
+def _politica(etapa: str, timeout: str, reintentos: str, presupuesto: str) -> Politica:
+    prefijo = f"UPSTREAM_{etapa.upper()}"
+    return Politica(
+        float(os.environ.get(f"{prefijo}_TIMEOUT", timeout)),
+        int(os.environ.get(f"{prefijo}_REINTENTOS", reintentos)),
+        float(os.environ.get(f"{prefijo}_PRESUPUESTO", presupuesto)),
+    )
+
+
+# En la ingesta los lotes ya se reintentan uno a uno (_con_reintentos_async): aquí no se repiten
+POLITICAS: Dict[str, Politica] = {
+    "embedding": _politica("embedding", "10", "2", "20"),
+    "busqueda": _politica("busqueda", "5", "2", "10"),
+    "chat": _politica("chat", "60", "1", "90"),
+    "ingesta": _politica("ingesta", "60", "0", "60"),
+}
+
+T = TypeVar("T")
+
+
+class CircuitoAbierto(RuntimeError):
+    def __init__(self, nombre: str, segundos: float):
+        super().__init__(f"Circuito abierto para {nombre}: se reintentará en {segundos:.1f}s.")
+        self.nombre = nombre
+        self.segundos = segundos
+
+
+def estado_http(error: BaseException) -> Optional[int]:
+    # openai/httpx usan status_code; pinecone, status; a veces sólo lo tiene la respuesta
+    for estado in (getattr(error, "status_code", None), getattr(error, "status", None),
+                   getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(estado, int):
+            return estado
+    return None
+
+
+def es_reintentable(error: BaseException) -> bool:
+    if isinstance(error, CircuitoAbierto):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    estado = estado_http(error)
+    if estado is not None:
+        return estado in (408, 409, 429) or estado >= 500
+    # Timeouts y errores de conexión de los SDK sin importarlos (APITimeoutError, ReadTimeoutError...)
+    nombre = type(error).__name__
+    return "Timeout" in nombre or "Connection" in nombre
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    # Segundos indicados por el proveedor (retry-after-ms de OpenAI o Retry-After estándar)
+    cabeceras = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not cabeceras:
+        return None
+    try:
+        milisegundos = cabeceras.get("retry-after-ms")
+        if milisegundos:
+            return max(0.0, float(milisegundos) / 1000)
+        valor = cabeceras.get("retry-after")
+        if not valor:
+            return None
+        try:
+            return max(0.0, float(valor))
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def espera_reintento(error: BaseException, intento: int) -> float:
+    # intento empieza en 0; full jitter: espera aleatoria entre 0 y el tope exponencial
+    indicada = retry_after(error)
+    if indicada is not None:
+        return indicada
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** intento))
+
+
+class Circuito:
+    # cerrado -> abierto tras N fallos seguidos; pasado el enfriamiento queda semiabierto y deja
+    # pasar una única petición de prueba: si va bien se cierra, si falla vuelve a abrirse
+    def __init__(self, nombre: str, umbral: int = CIRCUITO_UMBRAL_FALLOS, enfriamiento: float = CIRCUITO_ENFRIAMIENTO_SEGUNDOS):
+        self.nombre = nombre
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.estado = "cerrado"
+        self.fallos_seguidos = 0
+        self.aperturas = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        # True si la llamada es la petición de prueba del semiabierto
+        with self._lock:
+            if self.estado == "cerrado" or self.umbral <= 0:
+                return False
+            restante = self._abierto_desde + self.enfriamiento - time.monotonic()
+            if self.estado == "abierto" and restante <= 0:
+                self.estado = "semiabierto"
+            if self.estado == "semiabierto" and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            if restante <= 0:
+                # Con la prueba en curso no se sabe cuánto falta: se sugiere una espera acotada
+                restante = min(self.enfriamiento, UPSTREAM_BACKOFF_MAX)
+            raise CircuitoAbierto(self.nombre, restante)
+
+    def exito(self) -> None:
+        with self._lock:
+            self.estado = "cerrado"
+            self.fallos_seguidos = 0
+            self._prueba_en_curso = False
+
+    def fallo(self) -> None:
+        with self._lock:
+            self.fallos_seguidos += 1
+            self._prueba_en_curso = False
+            if self.umbral > 0 and (self.estado == "semiabierto" or self.fallos_seguidos >= self.umbral):
+                if self.estado != "abierto":
+                    self.aperturas += 1
+                self.estado = "abierto"
+                self._abierto_desde = time.monotonic()
+
+
+class Upstream:
+    def __init__(self, nombre: str, umbral: int = CIRCUITO_UMBRAL_FALLOS, enfriamiento: float = CIRCUITO_ENFRIAMIENTO_SEGUNDOS):
+        self.nombre = nombre
+        self.circuito = Circuito(nombre, umbral, enfriamiento)
+        self._lock = threading.Lock()
+        self._latencias = metricas.Histograma(metricas.METRICAS_MUESTRAS_MAX)
+        self._contadores = {"llamadas": 0, "exitos": 0, "errores": 0, "reintentos": 0, "timeouts": 0, "rechazadas": 0, "canceladas": 0}
+
+    def _contar(self, clave: str, resultado: Optional[str] = None) -> None:
+        with self._lock:
+            self._contadores[clave] += 1
+        if resultado:
+            metricas.registro.incrementar("rag_upstream_llamadas_total", upstream=self.nombre, resultado=resultado)
+
+    def _antes(self) -> bool:
+        try:
+            prueba = self.circuito.permitir()
+        except CircuitoAbierto:
+            self._contar("rechazadas", "circuito_abierto")
+            raise
+        self._contar("llamadas")
+        return prueba
+
+    def _despues(self, inicio: float, error: Optional[BaseException]) -> None:
+        segundos = time.perf_counter() - inicio
+        with self._lock:
+            self._latencias.observar(segundos)
+        if error is None:
+            self.circuito.exito()
+            self._contar("exitos", "ok")
+            return
+        es_timeout = isinstance(error, TimeoutError) or "Timeout" in type(error).__name__
+        if es_timeout:
+            self._contar("timeouts")
+        self._contar("errores", "timeout" if es_timeout else "error")
+        # Un 4xx (petición inválida) no dice nada de la salud del proveedor
+        if es_reintentable(error):
+            self.circuito.fallo()
+        else:
+            self.circuito.exito()
+
+    def _cancelada(self, prueba: bool) -> None:
+        # Cliente desconectado, wait_for externo, fan-out abandonado...: no dice nada del proveedor,
+        # salvo si era la prueba del semiabierto, que hay que liberar y cuenta como fallo
+        self._contar("canceladas", "cancelada")
+        if prueba:
+            self.circuito.fallo()
+
+    def _siguiente_espera(self, error: BaseException, intento: int, politica: Politica, limite: float) -> Optional[float]:
+        # None si no hay que reintentar: error definitivo, sin intentos, circuito abierto o sin presupuesto
+        if intento >= politica.reintentos or not es_reintentable(error) or self.circuito.estado == "abierto":
+            return None
+        espera = espera_reintento(error, intento)
+        if time.monotonic() + espera >= limite:
+            return None
+        self._contar("reintentos")
+        metricas.registro.incrementar("rag_upstream_reintentos_total", upstream=self.nombre)
+        print(f"🔁 {self.nombre}: reintento {intento + 1}/{politica.reintentos} en {espera:.2f}s ({error})")
+        return espera
+
+    def llamar(self, etapa: str, operacion: Callable[[float], T], hasta: Optional[float] = None) -> T:
+        # operacion recibe el timeout del intento (lo que quede del presupuesto como máximo);
+        # hasta (time.monotonic) acorta el presupuesto si quien llama tiene un plazo propio
+        politica = POLITICAS[etapa]
+        limite = time.monotonic() + politica.presupuesto
+        if hasta is not None:
+            limite = min(limite, hasta)
+        intento = 0
+        while True:
+            prueba = self._antes()
+            inicio = time.perf_counter()
+            try:
+                resultado = operacion(max(0.001, min(politica.timeout, limite - time.monotonic())))
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._cancelada(prueba)
+                    raise
+                self._despues(inicio, e)
+                espera = self._siguiente_espera(e, intento, politica, limite)
+                if espera is None:
+                    raise
+                time.sleep(espera)
+                intento += 1
+                continue
+            self._despues(inicio, None)
+            return resultado
+
+    async def llamar_async(self, etapa: str, operacion: Callable[[float], Awaitable[T]]) -> T:
+        # Igual que llamar; además el timeout se impone con wait_for aunque el SDK no lo respete
+        politica = POLITICAS[etapa]
+        limite = time.monotonic() + politica.presupuesto
+        intento = 0
+        while True:
+            prueba = self._antes()
+            inicio = time.perf_counter()
+            timeout = max(0.001, min(politica.timeout, limite - time.monotonic()))
+            try:
+                resultado = await asyncio.wait_for(operacion(timeout), timeout)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._cancelada(prueba)
+                    raise
+                self._despues(inicio, e)
+                espera = self._siguiente_espera(e, intento, politica, limite)
+                if espera is None:
+                    raise
+                await asyncio.sleep(espera)
+                intento += 1
+                continue
+            self._despues(inicio, None)
+            return resultado
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            percentiles = self._latencias.percentiles()
+            contadores = dict(self._contadores)
+        return {
+            **contadores,
+            "circuito": self.circuito.estado,
+            "aperturas": self.circuito.aperturas,
+            "fallos_seguidos": self.circuito.fallos_seguidos,
+            **{f"p{int(q * 100)}_ms": round(v * 1000, 3) for q, v in percentiles.items()},
+        }
+
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def obtener(nombre: str) -> Upstream:
+    with _upstreams_lock:
+        upstream = _upstreams.get(nombre)
+        if upstream is None:
+            upstream = _upstreams[nombre] = Upstream(nombre)
+        return upstream
+
+
+def estadisticas() -> Dict[str, Dict[str, Any]]:
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    return {u.nombre: u.estadisticas() for u in upstreams}
+
+
+def reiniciar() -> None:
+    with _upstreams_lock:
+        _upstreams.clear()
+
+
+def _metricas_circuitos() -> Iterator[Tuple[str, Dict[str, str], float]]:
+    for nombre, datos in estadisticas().items():
+        yield "rag_upstream_circuito_abierto", {"upstream": nombre}, 0 if datos["circuito"] == "cerrado" else 1
+
+
+metricas.registro.agregar_colector(_metricas_circuitos)
+
+
+def limites_http() -> Any:
+    # Pool de conexiones keep-alive compartido por todas las peticiones del cliente
+    import httpx
+    return httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONEXIONES,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_SEGUNDOS,
+    )
+
+
+def timeout_http() -> Any:
+    # Valor por defecto del cliente; cada llamada pasa el de su etapa
+    import httpx
+    return httpx.Timeout(max(p.timeout for p in POLITICAS.values()), connect=UPSTREAM_CONNECT_TIMEOUT)
@@ -0,0 +1,71 @@
+import os
+import re
+from typing import NamedTuple, Optional
+
+from app.contexto import contar_tokens
+
+# Validación de preguntas compartida por la UI y la API: se rechaza la entrada inválida antes
+# de cualquier llamada de red (embeddings, búsqueda, LLM). Los patrones se compilan una vez y
+# una pregunta válida se recorre una sola vez buscando caracteres no permitidos.
+PREGUNTA_MAX_CARACTERES = int(os.environ.get("PREGUNTA_MAX_CARACTERES", "2000"))
+PREGUNTA_MAX_TOKENS = int(os.environ.get("PREGUNTA_MAX_TOKENS", "500"))
+PREGUNTA_MIN_PALABRAS = int(os.environ.get("PREGUNTA_MIN_PALABRAS", "3"))
+
+_EMOJIS = (
+    "\U0001F600-\U0001F64F"
+    "\U0001F300-\U0001F5FF"
+    "\U0001F680-\U0001F6FF"
+    "\U0001F1E0-\U0001F1FF"
+    "\U00002700-\U000027BF"
+    "\U0001F900-\U0001F9FF"
+    "\U00002600-\U000026FF"
+)
+_LETRAS = "a-zA-ZáéíóúÁÉÍÓÚñÑüÜ"
+# Cualquier carácter fuera del alfabeto latino permitido; los emojis se distinguen al encontrarlos
+_NO_PERMITIDO = re.compile(r"[^\u0000-\u007FáéíóúÁÉÍÓÚñÑüÜçÇ\s.,;:?!¿¡()\"'-]")
+_EMOJI = re.compile(f"[{_EMOJIS}]")
+_LETRA = re.compile(f"[{_LETRAS}]")
+
+MENSAJES = {
+    "vacia": "Por favor,escribe una pregunta.",
+    "demasiado_larga": f"La pregunta no puede superar {PREGUNTA_MAX_CARACTERES} caracteres.",
+    "demasiados_tokens": f"La pregunta no puede superar {PREGUNTA_MAX_TOKENS} tokens.",
+    "emoji": "No se permiten emojis en la pregunta.",
+    "alfabeto": "Solo se permite ingresar texto en alfabeto latino.",
+    "sin_letras": "La pregunta debe contener letras.",
+    "pocas_palabras": f"La pregunta debe contener al menos {PREGUNTA_MIN_PALABRAS} palabras.",
+}
+
+
+class ErrorValidacion(NamedTuple):
+    codigo: str
+    mensaje: str
+
+    def a_dict(self) -> dict:
+        return {"codigo": self.codigo, "mensaje": self.mensaje}
+
+
+def _error(codigo: str) -> ErrorValidacion:
+    return ErrorValidacion(codigo, MENSAJES[codigo])
+
+
+def validar_pregunta(texto: str) -> Optional[ErrorValidacion]:
+    # None si la pregunta es válida. Primero lo que cuesta O(1) (vacía, longitud), después el
+    # recorrido del texto; un emoji tiene prioridad sobre otro carácter no latino.
+    texto = texto.strip()
+    if not texto:
+        return _error("vacia")
+    if len(texto) > PREGUNTA_MAX_CARACTERES:
+        return _error("demasiado_larga")
+    if contar_tokens(texto) > PREGUNTA_MAX_TOKENS:
+        return _error("demasiados_tokens")
+    prohibido = _NO_PERMITIDO.search(texto)
+    if prohibido:
+        # Todo emoji es también un carácter no permitido: basta buscar desde el primero
+        return _error("emoji" if _EMOJI.search(texto, prohibido.start()) else "alfabeto")
+    # Casi siempre la primera letra está al principio: la búsqueda termina enseguida
+    if not _LETRA.search(texto):
+        return _error("sin_letras")
+    if len(texto.split(None, PREGUNTA_MIN_PALABRAS)) < PREGUNTA_MIN_PALABRAS:
+        return _error("pocas_palabras")
+    return None
@@ -0,0 +1,402 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.ivf import LOCAL_ANN_MIN_VECTORES, LOCAL_ANN_MUESTRA_ENTRENAMIENTO, IndiceIVF
+
+# Backends de almacenamiento vectorial: Pinecone (remoto) o local con NumPy sobre un fichero mapeado
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pinecone").lower()
+LOCAL_VECTOR_DIR = os.environ.get("LOCAL_VECTOR_DIR", "vectores_locales")
+LOCAL_VECTOR_CAPACIDAD_INICIAL = int(os.environ.get("LOCAL_VECTOR_CAPACIDAD_INICIAL", "1024"))
+# El log de metadatos y las entradas IVF se reescriben cuando pasan del doble de los vectores vivos
+# (y de este mínimo); las filas de los vectores borrados se reutilizan en las altas siguientes
+LOCAL_VECTOR_COMPACTAR_MIN = int(os.environ.get("LOCAL_VECTOR_COMPACTAR_MIN", "1000"))
+
+Vector = Tuple[str, Sequence[float], Dict[str, Any]]
+
+
+class Match:
+    __slots__ = ("id", "score", "metadata", "values")
+
+    def __init__(self, id: str, score: float, metadata: Optional[Dict[str, Any]] = None, values: Optional[List[float]] = None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata
+        self.values = values or []
+
+    def __repr__(self) -> str:
+        return f"Match(id={self.id!r}, score={self.score:.4f})"
+
+
+class VectorStore:
+    # Interfaz común; las implementaciones deben ser seguras entre hilos
+    # timeout: segundos por petición para los almacenes remotos (None: el del cliente)
+    def upsert(self, vectores: List[Vector], namespace: str, timeout: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str,
+              include_metadata: bool = True, include_values: bool = False, timeout: Optional[float] = None) -> List[Match]:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str], namespace: str, timeout: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def actualizar_metadatos(self, cambios: List[Tuple[str, Dict[str, Any]]], namespace: str, timeout: Optional[float] = None) -> None:
+        # Fusiona los campos dados en los metadatos de cada id, sin tocar su vector; los ids que
+        # no estén se ignoran
+        raise NotImplementedError
+
+    def comprobar(self) -> None:
+        # Comprobación de salud: lanza una excepción si el almacén no responde
+        pass
+
+
+class PineconeStore(VectorStore):
+    def __init__(self, index: Any):
+        self.index = index
+
+    @staticmethod
+    def _opciones(timeout: Optional[float]) -> Dict[str, Any]:
+        return {"_request_timeout": timeout} if timeout else {}
+
+    def upsert(self, vectores: List[Vector], namespace: str, timeout: Optional[float] = None) -> None:
+        self.index.upsert(vectors=vectores, namespace=namespace, **self._opciones(timeout))
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str,
+              include_metadata: bool = True, include_values: bool = False, timeout: Optional[float] = None) -> List[Match]:
+        respuesta = self.index.query(
+            vector=list(vector),
+            top_k=top_k,
+            namespace=namespace,
+            include_metadata=include_metadata,
+            include_values=include_values,
+            **self._opciones(timeout),
+        )
+        return [
+            Match(m.id, m.score, getattr(m, "metadata", None), list(getattr(m, "values", None) or []))
+            for m in respuesta.matches
+        ]
+
+    def delete(self, ids: List[str], namespace: str, timeout: Optional[float] = None) -> None:
+        if ids:
+            self.index.delete(ids=ids, namespace=namespace, **self._opciones(timeout))
+
+    def actualizar_metadatos(self, cambios: List[Tuple[str, Dict[str, Any]]], namespace: str, timeout: Optional[float] = None) -> None:
+        # Pinecone sólo actualiza de uno en uno (set_metadata fusiona con los existentes)
+        for id_, metadata in cambios:
+            self.index.update(id=id_, set_metadata=metadata, namespace=namespace, **self._opciones(timeout))
+
+    def comprobar(self) -> None:
+        # Falla si el índice no existe o no es accesible
+        self.index.describe_index_stats()
+
+
+def _normalizar(vector: Sequence[float]) -> np.ndarray:
+    consulta = np.asarray(vector, dtype=np.float32)
+    norma = np.linalg.norm(consulta)
+    return consulta / norma if norma else consulta
+
+
+class _EspacioLocal:
+    # Un namespace: vectores float32 normalizados en vectores.f32 (memmap) y un log JSONL de metadatos.
+    # Al superar LOCAL_ANN_MIN_VECTORES se entrena un índice IVF-PQ (0 lo desactiva) en un hilo aparte;
+    # mientras tanto se sigue buscando por fuerza bruta.
+    def __init__(self, directorio: Path, min_vectores_ann: int = LOCAL_ANN_MIN_VECTORES):
+        self.directorio = directorio
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.path_vectores = directorio / "vectores.f32"
+        self.path_metadatos = directorio / "metadatos.jsonl"
+        self.path_config = directorio / "config.json"
+        self.lock = threading.RLock()
+        self.dimension: Optional[int] = None
+        self.capacidad = 0
+        self.n = 0
+        self.ids: List[Optional[str]] = []
+        self.metadatos: List[Optional[Dict[str, Any]]] = []
+        self.fila_de: Dict[str, int] = {}
+        self.vivos = np.zeros(0, dtype=bool)
+        self.libres: List[int] = []
+        # Líneas del log de metadatos, vivas o no
+        self.registros = 0
+        self.matriz: Optional[np.memmap] = None
+        self.min_vectores_ann = min_vectores_ann
+        self.ann = IndiceIVF(directorio)
+        self._entrenamiento: Optional[threading.Thread] = None
+        # Filas escritas durante el entrenamiento: se añaden al índice nuevo antes de usarlo
+        self._filas_durante_entrenamiento: Optional[List[np.ndarray]] = None
+        self._cargar()
+
+    def _cargar(self) -> None:
+        if not self.path_config.exists():
+            return
+        config = json.loads(self.path_config.read_text(encoding="utf-8"))
+        self.dimension = config["dimension"]
+        self.capacidad = config["capacidad"]
+        self.matriz = np.memmap(self.path_vectores, dtype=np.float32, mode="r+", shape=(self.capacidad, self.dimension))
+        self.vivos = np.zeros(self.capacidad, dtype=bool)
+        if self.path_metadatos.exists():
+            with open(self.path_metadatos, "r", encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        self.registros += 1
+                        self._aplicar(json.loads(linea))
+        self.libres = np.flatnonzero(~self.vivos[: self.n]).tolist()
+
+    def _aplicar(self, registro: Dict[str, Any]) -> None:
+        id_ = registro["id"]
+        if registro.get("borrado"):
+            fila = self.fila_de.pop(id_, None)
+            if fila is not None:
+                self.vivos[fila] = False
+                self.ids[fila] = None
+                self.metadatos[fila] = None
+            return
+        fila = registro["fila"]
+        while len(self.ids) <= fila:
+            self.ids.append(None)
+            self.metadatos.append(None)
+        self.ids[fila] = id_
+        self.metadatos[fila] = registro.get("metadata")
+        self.fila_de[id_] = fila
+        self.vivos[fila] = True
+        self.n = max(self.n, fila + 1)
+
+    def _asegurar_capacidad(self, dimension: int, necesarias: int) -> None:
+        if self.dimension is None:
+            self.dimension = dimension
+        elif dimension != self.dimension:
+            raise ValueError(f"Dimensión {dimension} distinta de la del namespace ({self.dimension}).")
+        if necesarias <= self.capacidad:
+            return
+        nueva = max(LOCAL_VECTOR_CAPACIDAD_INICIAL, self.capacidad)
+        while nueva < necesarias:
+            nueva *= 2
+        if self.matriz is not None:
+            self.matriz.flush()
+            del self.matriz
+        # Ampliar el fichero conserva los datos existentes; la zona nueva queda a cero
+        with open(self.path_vectores, "ab") as f:
+            f.truncate(nueva * self.dimension * 4)
+        self.matriz = np.memmap(self.path_vectores, dtype=np.float32, mode="r+", shape=(nueva, self.dimension))
+        vivos = np.zeros(nueva, dtype=bool)
+        vivos[: len(self.vivos)] = self.vivos
+        self.vivos = vivos
+        self.capacidad = nueva
+        self.path_config.write_text(json.dumps({"dimension": self.dimension, "capacidad": nueva}), encoding="utf-8")
+
+    def upsert(self, vectores: List[Vector]) -> List[int]:
+        if not vectores:
+            return []
+        datos = np.asarray([v for _, v, _ in vectores], dtype=np.float32)
+        normas = np.linalg.norm(datos, axis=1, keepdims=True)
+        datos /= np.where(normas == 0, 1, normas)
+        with self.lock:
+            filas = []
+            asignadas: Dict[str, int] = {}
+            siguiente = self.n
+            for id_, _, _ in vectores:
+                fila = self.fila_de.get(id_, asignadas.get(id_))
+                if fila is None:
+                    # Primero las filas que dejaron libres los borrados
+                    if self.libres:
+                        fila = self.libres.pop()
+                    else:
+                        fila = siguiente
+                        siguiente += 1
+                    asignadas[id_] = fila
+                filas.append(fila)
+            self._asegurar_capacidad(datos.shape[1], siguiente)
+            self.matriz[filas] = datos
+            self.matriz.flush()
+            registros = [
+                {"id": id_, "fila": fila, "metadata": metadata}
+                for (id_, _, metadata), fila in zip(vectores, filas)
+            ]
+            with open(self.path_metadatos, "a", encoding="utf-8") as f:
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self.registros += len(registros)
+            for registro in registros:
+                self._aplicar(registro)
+            if self.ann.entrenado:
+                self.ann.agregar(np.asarray(filas, dtype=np.int64), datos)
+            elif self._filas_durante_entrenamiento is not None:
+                self._filas_durante_entrenamiento.append(np.asarray(filas, dtype=np.int64))
+            elif self._entrenamiento is None and self.min_vectores_ann > 0 and len(self.fila_de) >= self.min_vectores_ann:
+                self._entrenamiento = threading.Thread(target=self.entrenar_ann, name=f"ivf-{self.directorio.name}", daemon=True)
+                self._entrenamiento.start()
+            self._compactar()
+            return filas
+
+    def entrenar_ann(self) -> None:
+        # Entrena con una muestra de los vectores vivos y da de alta todos los existentes. El lock
+        # sólo se toma para copiar filas: el k-means y la codificación no bloquean consultas ni altas
+        inicio = time.perf_counter()
+        try:
+            with self.lock:
+                vivas = np.flatnonzero(self.vivos[: self.n])
+                if vivas.size == 0:
+                    return
+                generador = np.random.default_rng(0)
+                muestra = np.sort(generador.choice(vivas, min(vivas.size, LOCAL_ANN_MUESTRA_ENTRENAMIENTO), replace=False))
+                datos_muestra = np.asarray(self.matriz[muestra])
+                self._filas_durante_entrenamiento = []
+            nuevo = IndiceIVF(self.directorio, self.ann.nprobe, self.ann.rerank)
+            nuevo.entrenar(datos_muestra)
+            for desde in range(0, vivas.size, 8192):
+                bloque = vivas[desde:desde + 8192]
+                with self.lock:
+                    datos = np.asarray(self.matriz[bloque])
+                nuevo.agregar(bloque, datos, persistir=False)
+            with self.lock:
+                # Las filas escritas mientras tanto van después: en las repetidas vale la última entrada
+                for filas in self._filas_durante_entrenamiento:
+                    nuevo.agregar(filas, np.asarray(self.matriz[filas]), persistir=False)
+                nuevo.guardar()
+                self.ann = nuevo
+            print(f"🧭 Índice IVF-PQ entrenado en {self.directorio.name}: {vivas.size} vectores, {time.perf_counter() - inicio:.1f}s")
+        except Exception as e:
+            print(f"❌ Error entrenando el índice IVF-PQ de {self.directorio.name}: {e}")
+        finally:
+            with self.lock:
+                self._filas_durante_entrenamiento = None
+                self._entrenamiento = None
+
+    def esperar_entrenamiento(self, timeout: Optional[float] = None) -> bool:
+        hilo = self._entrenamiento
+        if hilo is not None:
+            hilo.join(timeout)
+        return self.ann.entrenado
+
+    def _compactar(self) -> None:
+        # Llamar con el lock tomado
+        limite = max(LOCAL_VECTOR_COMPACTAR_MIN, 2 * len(self.fila_de))
+        if self.registros > limite:
+            temporal = self.path_metadatos.with_suffix(".tmp")
+            with open(temporal, "w", encoding="utf-8") as f:
+                for id_, fila in self.fila_de.items():
+                    f.write(json.dumps({"id": id_, "fila": fila, "metadata": self.metadatos[fila]}, ensure_ascii=False) + "\n")
+            os.replace(temporal, self.path_metadatos)
+            self.registros = len(self.fila_de)
+        if self.ann.entrenado and self.ann.entradas > limite:
+            self.ann.compactar(self.vivos)
+
+    def delete(self, ids: List[str]) -> None:
+        with self.lock:
+            presentes = [id_ for id_ in ids if id_ in self.fila_de]
+            if not presentes:
+                return
+            with open(self.path_metadatos, "a", encoding="utf-8") as f:
+                for id_ in presentes:
+                    f.write(json.dumps({"id": id_, "borrado": True}) + "\n")
+            self.registros += len(presentes)
+            for id_ in presentes:
+                self.libres.append(self.fila_de[id_])
+                self._aplicar({"id": id_, "borrado": True})
+            self._compactar()
+
+    def actualizar_metadatos(self, cambios: List[Tuple[str, Dict[str, Any]]]) -> None:
+        with self.lock:
+            registros = []
+            for id_, metadata in cambios:
+                fila = self.fila_de.get(id_)
+                if fila is not None:
+                    registros.append({"id": id_, "fila": fila, "metadata": {**(self.metadatos[fila] or {}), **metadata}})
+            if not registros:
+                return
+            with open(self.path_metadatos, "a", encoding="utf-8") as f:
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self.registros += len(registros)
+            for registro in registros:
+                self._aplicar(registro)
+            self._compactar()
+
+    def buscar_filas(self, vector: Sequence[float], top_k: int, filas: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        # Producto matricial sobre todas las filas (o un subconjunto) y argpartition para el top-k
+        with self.lock:
+            if self.matriz is None or self.n == 0:
+                return []
+            consulta = _normalizar(vector)
+            if filas is None:
+                candidatas = np.flatnonzero(self.vivos[: self.n])
+            else:
+                candidatas = filas[self.vivos[filas]]
+            if candidatas.size == 0:
+                return []
+            if candidatas.size == self.n:
+                scores = np.asarray(self.matriz[: self.n]) @ consulta
+            else:
+                scores = np.asarray(self.matriz[candidatas]) @ consulta
+            k = min(top_k, candidatas.size)
+            mejores = np.argpartition(-scores, k - 1)[:k]
+            mejores = mejores[np.argsort(-scores[mejores])]
+            return [(int(candidatas[i]), float(scores[i])) for i in mejores]
+
+    def buscar(self, vector: Sequence[float], top_k: int, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        # Con índice entrenado sólo se puntúan exactamente los candidatos de las nprobe listas
+        with self.lock:
+            if not self.ann.entrenado:
+                return self.buscar_filas(vector, top_k)
+            candidatos = self.ann.candidatos(_normalizar(vector), top_k * max(1, self.ann.rerank), nprobe)
+            return self.buscar_filas(vector, top_k, filas=candidatos)
+
+    def match(self, fila: int, score: float, include_metadata: bool, include_values: bool) -> Match:
+        return Match(
+            self.ids[fila],
+            score,
+            self.metadatos[fila] if include_metadata else None,
+            np.asarray(self.matriz[fila]).tolist() if include_values else None,
+        )
+
+
+class LocalStore(VectorStore):
+    def __init__(self, directorio: str, min_vectores_ann: int = LOCAL_ANN_MIN_VECTORES, nprobe: Optional[int] = None):
+        self.directorio = Path(directorio)
+        self.min_vectores_ann = min_vectores_ann
+        self.nprobe = nprobe
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self._espacios: Dict[str, _EspacioLocal] = {}
+        self._lock = threading.Lock()
+
+    def espacio(self, namespace: str, crear: bool = True) -> Optional[_EspacioLocal]:
+        # Las lecturas no crean namespaces: un nombre inventado no deja directorios ni espacios en caché
+        with self._lock:
+            espacio = self._espacios.get(namespace)
+            if espacio is None:
+                seguro = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace) or "_"
+                if not crear and not (self.directorio / seguro).exists():
+                    return None
+                espacio = self._espacios[namespace] = _EspacioLocal(self.directorio / seguro, self.min_vectores_ann)
+            return espacio
+
+    # El almacén local no sale del proceso: el timeout no aplica
+    def upsert(self, vectores: List[Vector], namespace: str, timeout: Optional[float] = None) -> None:
+        self.espacio(namespace).upsert(vectores)
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str,
+              include_metadata: bool = True, include_values: bool = False, timeout: Optional[float] = None) -> List[Match]:
+        espacio = self.espacio(namespace, crear=False)
+        if espacio is None:
+            return []
+        with espacio.lock:
+            return [
+                espacio.match(fila, score, include_metadata, include_values)
+                for fila, score in espacio.buscar(vector, top_k, self.nprobe)
+            ]
+
+    def delete(self, ids: List[str], namespace: str, timeout: Optional[float] = None) -> None:
+        espacio = self.espacio(namespace, crear=False)
+        if espacio is not None:
+            espacio.delete(ids)
+
+    def actualizar_metadatos(self, cambios: List[Tuple[str, Dict[str, Any]]], namespace: str, timeout: Optional[float] = None) -> None:
+        espacio = self.espacio(namespace, crear=False)
+        if espacio is not None:
+            espacio.actualizar_metadatos(cambios)
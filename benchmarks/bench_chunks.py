@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.chunks import Divisor, contador
+from benchmarks import documentos
+from benchmarks.bench_rag import _commit_actual, medir_memoria
+
+# Benchmark del divisor de chunks frente al RecursiveCharacterTextSplitter de langchain (si está
+# instalado) sobre documentos sintéticos grandes: throughput, chunks generados y pico de memoria.
+# Uso: python -m benchmarks.bench_chunks --mb 5,20 --repeticiones 3 --salida chunks.json
+
+
+def generar_texto(megas: float, semilla: int = 0) -> str:
+    # Párrafos de longitud variable: unos caben en un chunk y otros hay que partirlos por palabras
+    generador = random.Random(semilla)
+    partes: List[str] = []
+    total = 0
+    while total < megas * 1024 * 1024:
+        parrafo = documentos.parrafo(generador, generador.randint(5, 200))
+        partes.append(parrafo)
+        total += len(parrafo) + 2
+    return "\n\n".join(partes)
+
+
+def _bloques(texto: str, tamano: int) -> Iterable[Tuple[Optional[int], str]]:
+    # Como extraccion.paginas_txt: bloques consecutivos de la misma "página"
+    for inicio in range(0, len(texto), tamano):
+        yield None, texto[inicio:inicio + tamano]
+
+
+def _divisores(args: argparse.Namespace) -> Dict[str, Callable[[str], int]]:
+    divisor = Divisor(args.tamano, args.solape, contador(args.unidad))
+    divisores: Dict[str, Callable[[str], int]] = {
+        "divisor": lambda texto: len(divisor.dividir_texto(texto)),
+        "divisor_stream": lambda texto: sum(1 for _ in divisor.dividir(_bloques(texto, args.bloque))),
+    }
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        print("langchain no está instalado: se omite la comparación", file=sys.stderr)
+        return divisores
+    if args.unidad == "caracteres":
+        splitter = RecursiveCharacterTextSplitter(chunk_size=args.tamano, chunk_overlap=args.solape)
+        divisores["langchain"] = lambda texto: len(splitter.split_text(texto))
+    return divisores
+
+
+def _medir(funcion: Callable[[str], int], texto: str, repeticiones: int) -> Dict[str, Any]:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        chunks = funcion(texto)
+        tiempos.append(time.perf_counter() - inicio)
+    # La memoria se mide en una pasada aparte: tracemalloc ralentiza la ejecución
+    with medir_memoria(True) as memoria:
+        funcion(texto)
+    mejor = min(tiempos)
+    return {
+        "chunks": chunks,
+        "segundos": round(mejor, 4),
+        "mb_s": round(len(texto) / (1024 * 1024) / mejor, 2) if mejor else None,
+        "memoria_pico_mb": memoria["pico_mb"],
+    }
+
+
+def ejecutar(args: argparse.Namespace) -> Dict[str, Any]:
+    divisores = _divisores(args)
+    resultados: Dict[str, Any] = {}
+    for megas in [float(m) for m in args.mb.split(",") if m.strip()]:
+        texto = generar_texto(megas)
+        resultados[f"{megas:g}mb"] = {
+            nombre: _medir(funcion, texto, args.repeticiones) for nombre, funcion in divisores.items()
+        }
+    return {
+        "commit": _commit_actual(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "config": vars(args),
+        "documentos": resultados,
+    }
+
+
+def construir_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark del divisor de chunks")
+    parser.add_argument("--mb", default="5,20", help="Tamaños de documento en MB, separados por comas")
+    parser.add_argument("--tamano", type=int, default=500)
+    parser.add_argument("--solape", type=int, default=50)
+    parser.add_argument("--unidad", choices=("caracteres", "tokens"), default="caracteres")
+    parser.add_argument("--bloque", type=int, default=64 * 1024, help="Tamaño de bloque del modo stream")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--salida", default="", help="Fichero JSON de salida (por defecto stdout)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = construir_parser().parse_args(argv)
+    informe = ejecutar(args)
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto, encoding="utf-8")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
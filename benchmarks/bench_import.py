@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.bench_rag import _commit_actual, percentiles_ms
+
+# Tiempo de arranque: importa el módulo en un proceso nuevo (sin cachés de import en memoria)
+# con -X importtime y resume el tiempo total y los módulos más caros.
+# Uso: python -m benchmarks.bench_import --repeticiones 5 --salida arranque.json
+
+RAIZ = Path(__file__).resolve().parent.parent
+PESADOS = ("openai", "pinecone", "langchain", "fitz", "docx")
+
+
+def _importar(modulo: str) -> Tuple[float, List[Tuple[str, int]], List[str]]:
+    # Devuelve (segundos de pared, [(módulo, µs acumulados)], módulos pesados cargados)
+    codigo = (
+        f"import sys; import {modulo}; "
+        f"print('PESADOS=' + ','.join(m for m in {PESADOS!r} if m in sys.modules))"
+    )
+    inicio = time.perf_counter()
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True, text=True, check=True, cwd=str(RAIZ),
+    )
+    segundos = time.perf_counter() - inicio
+    modulos = []
+    for linea in proceso.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not linea.startswith("import time:") or "cumulative" in linea:
+            continue
+        _, acumulado, nombre = linea[len("import time:"):].split("|")
+        modulos.append((nombre.strip(), int(acumulado)))
+    # La aplicación puede escribir avisos en stdout: se busca la línea marcada
+    lineas = [l for l in proceso.stdout.splitlines() if l.startswith("PESADOS=")]
+    cargados = [m for m in lineas[-1][len("PESADOS="):].split(",") if m] if lineas else []
+    return segundos, modulos, cargados
+
+
+def ejecutar(args: argparse.Namespace) -> Dict[str, Any]:
+    tiempos: List[float] = []
+    acumulados: Dict[str, int] = {}
+    cargados: List[str] = []
+    for _ in range(args.repeticiones):
+        segundos, modulos, cargados = _importar(args.modulo)
+        tiempos.append(segundos)
+        for nombre, us in modulos:
+            # Sólo módulos de primer nivel para que el resumen sea legible
+            if "." not in nombre:
+                acumulados[nombre] = acumulados.get(nombre, 0) + us
+    top = sorted(acumulados.items(), key=lambda x: x[1], reverse=True)[:args.top]
+    return {
+        "commit": _commit_actual(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "config": vars(args),
+        "arranque_ms": percentiles_ms(tiempos),
+        "modulos_ms": {nombre: round(us / args.repeticiones / 1000, 3) for nombre, us in top},
+        "pesados_cargados": cargados,
+    }
+
+
+def construir_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de import de la aplicación")
+    parser.add_argument("--modulo", default="app.states.rag_state")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Módulos más caros a listar")
+    parser.add_argument("--salida", default="", help="Fichero JSON de salida (por defecto stdout)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = construir_parser().parse_args(argv)
+    informe = ejecutar(args)
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto, encoding="utf-8")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
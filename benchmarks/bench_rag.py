@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import documentos, fakes
+
+# Benchmark offline del pipeline RAG con sustitutos locales de OpenAI y Pinecone.
+# Uso: python -m benchmarks.bench_rag --escenarios consulta,api,ingesta --salida resultado.json
+# El JSON va a stdout (o a --salida); los logs de la aplicación se desvían a stderr.
+
+ESCENARIOS = ("consulta", "consulta_async", "api", "ingesta")
+
+
+def percentiles_ms(latencias: List[float]) -> Dict[str, float]:
+    if not latencias:
+        return {}
+    ordenadas = sorted(latencias)
+
+    def q(p: float) -> float:
+        return round(ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))] * 1000, 3)
+
+    return {
+        "p50": q(0.5),
+        "p95": q(0.95),
+        "p99": q(0.99),
+        "max": round(ordenadas[-1] * 1000, 3),
+        "media": round(sum(ordenadas) / len(ordenadas) * 1000, 3),
+    }
+
+
+@contextlib.contextmanager
+def medir_memoria(activa: bool) -> Iterator[Dict[str, Optional[float]]]:
+    resultado: Dict[str, Optional[float]] = {"pico_mb": None}
+    if not activa:
+        yield resultado
+        return
+    tracemalloc.start()
+    try:
+        yield resultado
+    finally:
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resultado["pico_mb"] = round(pico / (1024 * 1024), 3)
+
+
+def resumen(operaciones: int, errores: int, segundos: float, latencias: List[float], memoria: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+    return {
+        "operaciones": operaciones,
+        "errores": errores,
+        "segundos": round(segundos, 4),
+        "throughput_ops_s": round(operaciones / segundos, 3) if segundos else None,
+        "latencia_ms": percentiles_ms(latencias),
+        "memoria_pico_mb": memoria["pico_mb"],
+        **extra,
+    }
+
+
+def generar_preguntas(cantidad: int, repetidas: float, semilla: int) -> List[str]:
+    generador = random.Random(semilla)
+    preguntas: List[str] = []
+    for i in range(cantidad):
+        if preguntas and generador.random() < repetidas:
+            preguntas.append(generador.choice(preguntas))
+        else:
+            preguntas.append(f"¿Qué indica la sección {i} del manual sobre el parámetro {i * 7}?")
+    return preguntas
+
+
+def _medir_llamadas(llamada: Callable[[str], Tuple[float, bool]], preguntas: List[str], concurrencia: int) -> Tuple[List[float], int, float]:
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        resultados = list(executor.map(llamada, preguntas))
+    segundos = time.perf_counter() - inicio
+    return [r[0] for r in resultados], sum(1 for r in resultados if not r[1]), segundos
+
+
+def escenario_consulta(rag_state: Any, preguntas: List[str], concurrencia: int, memoria: bool) -> Dict[str, Any]:
+    def una(pregunta: str) -> Tuple[float, bool]:
+        t0 = time.perf_counter()
+        resultado = rag_state.ejecutar_rag(pregunta)
+        return time.perf_counter() - t0, resultado["error"] is None
+
+    with medir_memoria(memoria) as mem:
+        latencias, errores, segundos = _medir_llamadas(una, preguntas, concurrencia)
+    return resumen(len(preguntas), errores, segundos, latencias, mem)
+
+
+def escenario_consulta_async(rag_state: Any, preguntas: List[str], concurrencia: int, memoria: bool) -> Dict[str, Any]:
+    async def correr() -> List[Tuple[float, bool]]:
+        semaforo = asyncio.Semaphore(concurrencia)
+
+        async def una(pregunta: str) -> Tuple[float, bool]:
+            async with semaforo:
+                t0 = time.perf_counter()
+                resultado = await rag_state.ejecutar_rag_async(pregunta)
+                return time.perf_counter() - t0, resultado["error"] is None
+
+        return await asyncio.gather(*(una(p) for p in preguntas))
+
+    with medir_memoria(memoria) as mem:
+        inicio = time.perf_counter()
+        resultados = asyncio.run(correr())
+        segundos = time.perf_counter() - inicio
+    return resumen(len(preguntas), sum(1 for r in resultados if not r[1]), segundos, [r[0] for r in resultados], mem)
+
+
+def escenario_api(preguntas: List[str], concurrencia: int, memoria: bool) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+    from app import admision
+    from app.api import api
+
+    # Todas las peticiones llegan del mismo cliente: se mide el pipeline, no el límite por cliente
+    tasa, admision.ADMISION_TASA = admision.ADMISION_TASA, 0
+    try:
+        with TestClient(api) as client:
+            def una(pregunta: str) -> Tuple[float, bool]:
+                t0 = time.perf_counter()
+                respuesta = client.post("/api/rag", json={"pregunta": pregunta})
+                ok = respuesta.status_code == 200 and respuesta.json().get("error") is None
+                return time.perf_counter() - t0, ok
+
+            with medir_memoria(memoria) as mem:
+                latencias, errores, segundos = _medir_llamadas(una, preguntas, concurrencia)
+    finally:
+        admision.ADMISION_TASA = tasa
+    return resumen(len(preguntas), errores, segundos, latencias, mem)
+
+
+def escenario_ingesta(rag_state: Any, directorio: Path, formato: str, tamano: int, memoria: bool) -> Dict[str, Any]:
+    from app.ingesta import TrabajoIngesta
+    nombre = f"sintetico_{tamano}.{formato}"
+    path = directorio / nombre
+    if formato == "pdf":
+        documentos.generar_pdf(path, paginas=tamano)
+    elif formato == "docx":
+        documentos.generar_docx(path, parrafos=tamano * 6)
+    else:
+        documentos.generar_txt(path, parrafos=tamano * 6)
+    trabajo = TrabajoIngesta(nombre)
+    with medir_memoria(memoria) as mem:
+        inicio = time.perf_counter()
+        asyncio.run(rag_state.ingestar_archivo(path, nombre, trabajo))
+        segundos = time.perf_counter() - inicio
+    return resumen(
+        trabajo.subidos, trabajo.fallidos, segundos, [segundos], mem,
+        paginas=tamano, bytes_documento=path.stat().st_size, unidad="chunks",
+    )
+
+
+def _commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def ejecutar(args: argparse.Namespace) -> Dict[str, Any]:
+    escenarios = [e.strip() for e in args.escenarios.split(",") if e.strip()]
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        raise ValueError(f"Escenarios desconocidos: {sorted(desconocidos)}")
+
+    import app.states.rag_state as rag_state
+    cliente = fakes.FakeOpenAI(
+        perfil_embeddings=fakes.Perfil(args.latencia_embedding, args.jitter, args.tasa_fallos, args.semilla),
+        perfil_chat=fakes.Perfil(args.latencia_chat, args.jitter, args.tasa_fallos, args.semilla + 1),
+        dimension=args.dimension,
+    )
+    index = fakes.FakeIndex(fakes.Perfil(args.latencia_index, args.jitter, args.tasa_fallos, args.semilla + 2))
+    fakes.instalar(rag_state, cliente, index)
+    # El índice léxico y los manifiestos acompañan al índice falso: se crean vacíos
+    from app.bm25 import IndiceBM25
+    from app.manifiestos import Manifiestos
+    rag_state.indice_lexico = IndiceBM25()
+    rag_state.manifiestos_instance = Manifiestos()
+
+    generador = random.Random(args.semilla)
+    corpus = [documentos.parrafo(generador) for _ in range(args.corpus)]
+    if corpus:
+        rag_state.ingestar_chunks(corpus, "corpus.txt")
+    preguntas = generar_preguntas(args.preguntas, args.repetidas, args.semilla)
+
+    resultados: Dict[str, Any] = {}
+    for escenario in escenarios:
+        if escenario == "ingesta":
+            with tempfile.TemporaryDirectory() as directorio:
+                for formato in args.formatos.split(","):
+                    for tamano in (int(p) for p in args.paginas.split(",")):
+                        clave = f"ingesta_{formato}_{tamano}"
+                        resultados[clave] = escenario_ingesta(rag_state, Path(directorio), formato, tamano, not args.sin_memoria)
+            continue
+        # Cachés vacías en cada escenario para que sean comparables entre sí
+        fakes.instalar(rag_state, cliente, index)
+        if escenario == "consulta":
+            resultados[escenario] = escenario_consulta(rag_state, preguntas, args.concurrencia, not args.sin_memoria)
+        elif escenario == "consulta_async":
+            resultados[escenario] = escenario_consulta_async(rag_state, preguntas, args.concurrencia, not args.sin_memoria)
+        elif escenario == "api":
+            resultados[escenario] = escenario_api(preguntas, args.concurrencia, not args.sin_memoria)
+
+    return {
+        "commit": _commit_actual(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "config": vars(args),
+        "escenarios": resultados,
+    }
+
+
+def construir_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline RAG")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--preguntas", type=int, default=200)
+    parser.add_argument("--repetidas", type=float, default=0.0, help="Fracción de preguntas repetidas (para medir cachés)")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--corpus", type=int, default=1000, help="Chunks precargados en el índice falso")
+    parser.add_argument("--formatos", default="pdf,docx")
+    parser.add_argument("--paginas", default="10,100", help="Tamaños de documento para la ingesta")
+    parser.add_argument("--dimension", type=int, default=64)
+    parser.add_argument("--latencia-embedding", type=float, default=0.02)
+    parser.add_argument("--latencia-chat", type=float, default=0.2)
+    parser.add_argument("--latencia-index", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--sin-memoria", action="store_true", help="No medir memoria con tracemalloc")
+    parser.add_argument("--salida", default="", help="Fichero JSON de salida (por defecto stdout)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = construir_parser().parse_args(argv)
+    with contextlib.redirect_stdout(sys.stderr):
+        informe = ejecutar(args)
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto, encoding="utf-8")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
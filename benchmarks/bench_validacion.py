@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.validacion import validar_pregunta
+from benchmarks.bench_rag import _commit_actual
+
+# Micro-benchmark del validador de preguntas frente a la validación anterior de RAGState.generar
+# (patrón de emojis compilado en cada llamada y cinco pasadas por el texto).
+# Uso: python -m benchmarks.bench_validacion --repeticiones 5 --salida validacion.json
+
+CASOS = {
+    "valida": "¿Cómo se instala el equipo en la pared del salón?",
+    "valida_larga": "¿Qué indica la sección del manual sobre el mantenimiento preventivo? " * 25,
+    "emoji": "¿Cómo se instala el equipo? 😀",
+    "no_latino": "Как установить оборудование?",
+    "sin_letras": "123 456 789 ???",
+    "pocas_palabras": "¿Instalación?",
+    "enorme": "palabra " * 200_000,
+}
+
+
+def validar_legado(texto: str) -> Optional[str]:
+    texto = texto.strip()
+    if not texto:
+        return "vacia"
+    emoji_pattern = re.compile("[\U0001F600-\U0001F64F"
+                               "\U0001F300-\U0001F5FF"
+                               "\U0001F680-\U0001F6FF"
+                               "\U0001F1E0-\U0001F1FF"
+                               "\U00002700-\U000027BF"
+                               "\U0001F900-\U0001F9FF"
+                               "\U00002600-\U000026FF]+", flags=re.UNICODE)
+    if emoji_pattern.search(texto):
+        return "emoji"
+    if re.search(r"[^\u0000-\u007FáéíóúÁÉÍÓÚñÑüÜçÇ\s.,;:?!¿¡()\"'-]", texto):
+        return "alfabeto"
+    if not re.search(r"[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]", texto):
+        return "sin_letras"
+    if len(texto.split()) < 3:
+        return "pocas_palabras"
+    return None
+
+
+def _microsegundos(funcion: Callable[[str], Any], texto: str, repeticiones: int) -> float:
+    # Mejor de varias rondas; cada ronda dura ~0.2 s
+    temporizador = timeit.Timer(lambda: funcion(texto))
+    numero, _ = temporizador.autorange()
+    return round(min(temporizador.repeat(repeticiones, numero)) / numero * 1e6, 3)
+
+
+def ejecutar(args: argparse.Namespace) -> Dict[str, Any]:
+    casos = [c.strip() for c in args.casos.split(",") if c.strip()]
+    desconocidos = set(casos) - set(CASOS)
+    if desconocidos:
+        raise ValueError(f"Casos desconocidos: {sorted(desconocidos)}")
+    resultados: Dict[str, Any] = {}
+    for caso in casos:
+        texto = CASOS[caso]
+        error = validar_pregunta(texto)
+        resultados[caso] = {
+            "caracteres": len(texto),
+            "codigo": error.codigo if error else None,
+            "validador_us": _microsegundos(validar_pregunta, texto, args.repeticiones),
+            "legado_us": _microsegundos(validar_legado, texto, args.repeticiones),
+        }
+        resultados[caso]["aceleracion"] = round(resultados[caso]["legado_us"] / max(resultados[caso]["validador_us"], 1e-9), 2)
+    return {
+        "commit": _commit_actual(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "config": vars(args),
+        "casos": resultados,
+    }
+
+
+def construir_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Micro-benchmark del validador de preguntas")
+    parser.add_argument("--casos", default=",".join(CASOS))
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--salida", default="", help="Fichero JSON de salida (por defecto stdout)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = construir_parser().parse_args(argv)
+    informe = ejecutar(args)
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto, encoding="utf-8")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import random
+from pathlib import Path
+
+# Documentos sintéticos para medir la ingesta
+
+_PALABRAS = (
+    "manual equipo instalación parámetro sensor válvula presión temperatura mantenimiento "
+    "procedimiento seguridad operario revisión tabla código referencia calibración módulo "
+    "alarma circuito conexión fusible potencia registro norma artículo sección capítulo"
+).split()
+
+
+def parrafo(generador: random.Random, palabras: int = 60) -> str:
+    texto = " ".join(generador.choice(_PALABRAS) for _ in range(palabras))
+    return f"{texto.capitalize()} (ref. {generador.randint(1000, 9999)}-{generador.choice('ABCDEF')})."
+
+
+def generar_pdf(path: Path, paginas: int, parrafos_por_pagina: int = 6, semilla: int = 0) -> Path:
+    import fitz
+    generador = random.Random(semilla)
+    doc = fitz.open()
+    for numero in range(paginas):
+        pagina = doc.new_page()
+        texto = "\n\n".join(parrafo(generador) for _ in range(parrafos_por_pagina))
+        pagina.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Página {numero + 1}\n\n{texto}", fontsize=8)
+    doc.save(str(path))
+    doc.close()
+    return path
+
+
+def generar_docx(path: Path, parrafos: int, semilla: int = 0) -> Path:
+    import docx
+    generador = random.Random(semilla)
+    documento = docx.Document()
+    for _ in range(parrafos):
+        documento.add_paragraph(parrafo(generador))
+    documento.save(str(path))
+    return path
+
+
+def generar_txt(path: Path, parrafos: int, semilla: int = 0) -> Path:
+    generador = random.Random(semilla)
+    path.write_text("\n\n".join(parrafo(generador) for _ in range(parrafos)), encoding="utf-8")
+    return path
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# Sustitutos locales de OpenAI y Pinecone con latencia y fallos configurables
+
+
+class Perfil:
+    # latencia fija + jitter uniforme (segundos) y probabilidad de fallo por llamada
+    def __init__(self, latencia: float = 0.0, jitter: float = 0.0, tasa_fallos: float = 0.0, semilla: int = 0):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.tasa_fallos = tasa_fallos
+        self._random = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+        self.fallos = 0
+
+    def _sortear(self) -> float:
+        with self._lock:
+            self.llamadas += 1
+            demora = self.latencia + self._random.uniform(0, self.jitter)
+            falla = self._random.random() < self.tasa_fallos
+            if falla:
+                self.fallos += 1
+        if falla:
+            raise RuntimeError("fallo inyectado")
+        return demora
+
+    def esperar(self) -> None:
+        demora = self._sortear()
+        if demora:
+            time.sleep(demora)
+
+    async def esperar_async(self) -> None:
+        demora = self._sortear()
+        if demora:
+            await asyncio.sleep(demora)
+
+
+def embedding_determinista(texto: str, dimension: int) -> List[float]:
+    # Vector pseudoaleatorio normalizado derivado del texto: textos iguales dan vectores iguales
+    semilla = int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "little")
+    generador = random.Random(semilla)
+    vector = [generador.gauss(0, 1) for _ in range(dimension)]
+    norma = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norma for x in vector]
+
+
+def _respuesta_embeddings(textos: List[str], dimension: int) -> Any:
+    return SimpleNamespace(
+        data=[SimpleNamespace(index=i, embedding=embedding_determinista(t, dimension)) for i, t in enumerate(textos)],
+        usage=SimpleNamespace(prompt_tokens=sum(len(t) // 4 for t in textos), completion_tokens=0),
+    )
+
+
+def _texto_respuesta(messages: List[Dict[str, str]]) -> str:
+    pregunta = messages[-1]["content"].rsplit("Pregunta:", 1)[-1].strip()
+    return f"Según el contexto, la respuesta a '{pregunta}' está en la documentación."
+
+
+def _fragmentos(texto: str, usage: Any) -> List[Any]:
+    palabras = texto.split(" ")
+    fragmentos = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p if i == 0 else " " + p))], usage=None)
+        for i, p in enumerate(palabras)
+    ]
+    fragmentos.append(SimpleNamespace(choices=[], usage=usage))
+    return fragmentos
+
+
+def _usage_chat(messages: List[Dict[str, str]], texto: str) -> Any:
+    return SimpleNamespace(
+        prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+        completion_tokens=len(texto) // 4,
+    )
+
+
+class _Embeddings:
+    def __init__(self, perfil: Perfil, dimension: int):
+        self.perfil = perfil
+        self.dimension = dimension
+
+    def create(self, input: Any, model: str, **kwargs: Any) -> Any:
+        self.perfil.esperar()
+        return _respuesta_embeddings([input] if isinstance(input, str) else list(input), self.dimension)
+
+
+class _Completions:
+    def __init__(self, perfil: Perfil):
+        self.perfil = perfil
+
+    def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs: Any) -> Any:
+        self.perfil.esperar()
+        texto = _texto_respuesta(messages)
+        usage = _usage_chat(messages, texto)
+        if stream:
+            return iter(_fragmentos(texto, usage))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=texto))], usage=usage)
+
+
+class FakeOpenAI:
+    def __init__(self, perfil_embeddings: Optional[Perfil] = None, perfil_chat: Optional[Perfil] = None, dimension: int = 64):
+        self.embeddings = _Embeddings(perfil_embeddings or Perfil(), dimension)
+        self.chat = SimpleNamespace(completions=_Completions(perfil_chat or Perfil()))
+
+
+class _EmbeddingsAsync(_Embeddings):
+    async def create(self, input: Any, model: str, **kwargs: Any) -> Any:
+        await self.perfil.esperar_async()
+        return _respuesta_embeddings([input] if isinstance(input, str) else list(input), self.dimension)
+
+
+class _CompletionsAsync(_Completions):
+    async def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs: Any) -> Any:
+        await self.perfil.esperar_async()
+        texto = _texto_respuesta(messages)
+        usage = _usage_chat(messages, texto)
+        if stream:
+            async def fragmentos():
+                for fragmento in _fragmentos(texto, usage):
+                    yield fragmento
+            return fragmentos()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=texto))], usage=usage)
+
+
+class FakeAsyncOpenAI:
+    # Comparte perfiles con FakeOpenAI para que los contadores sean comunes
+    def __init__(self, sincrono: FakeOpenAI):
+        self.embeddings = _EmbeddingsAsync(sincrono.embeddings.perfil, sincrono.embeddings.dimension)
+        self.chat = SimpleNamespace(completions=_CompletionsAsync(sincrono.chat.completions.perfil))
+
+
+class FakeIndex:
+    # Índice en memoria con la interfaz de pinecone.Index que usa la aplicación
+    def __init__(self, perfil: Optional[Perfil] = None):
+        self.perfil = perfil or Perfil()
+        self._lock = threading.Lock()
+        self._namespaces: Dict[str, Dict[str, Any]] = {}
+
+    def upsert(self, vectors: List[Any], namespace: str = "", **kwargs: Any) -> Any:
+        self.perfil.esperar()
+        with self._lock:
+            espacio = self._namespaces.setdefault(namespace, {})
+            for id_, valores, metadata in vectors:
+                espacio[id_] = (list(valores), dict(metadata or {}))
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def delete(self, ids: Optional[List[str]] = None, namespace: str = "", delete_all: bool = False, **kwargs: Any) -> Any:
+        self.perfil.esperar()
+        with self._lock:
+            espacio = self._namespaces.setdefault(namespace, {})
+            if delete_all:
+                espacio.clear()
+            for id_ in ids or []:
+                espacio.pop(id_, None)
+        return {}
+
+    def query(self, vector: List[float], top_k: int, namespace: str = "", include_metadata: bool = False,
+              include_values: bool = False, **kwargs: Any) -> Any:
+        self.perfil.esperar()
+        with self._lock:
+            elementos = list(self._namespaces.get(namespace, {}).items())
+        puntuados = sorted(
+            ((sum(a * b for a, b in zip(vector, valores)), id_, valores, metadata) for id_, (valores, metadata) in elementos),
+            key=lambda x: x[0],
+            reverse=True,
+        )[:top_k]
+        return SimpleNamespace(matches=[
+            SimpleNamespace(
+                id=id_,
+                score=score,
+                metadata=metadata if include_metadata else None,
+                values=valores if include_values else [],
+            )
+            for score, id_, valores, metadata in puntuados
+        ])
+
+    def total_vectores(self) -> int:
+        with self._lock:
+            return sum(len(espacio) for espacio in self._namespaces.values())
+
+
+def instalar(rag_state: Any, cliente: FakeOpenAI, index: FakeIndex) -> None:
+    # Sustituye los clientes del módulo y vacía las cachés para partir de un estado limpio
+    from app.cache_embeddings import CacheEmbeddings
+    from app.cache_respuestas import crear_desde_entorno
+    from app.vectores import PineconeStore
+    rag_state.openai_client_instance = cliente
+    rag_state.openai_async_client_instance = FakeAsyncOpenAI(cliente)
+    rag_state.vector_store_instance = PineconeStore(index)
+    rag_state.initialization_error = None
+    rag_state.cache_embeddings = CacheEmbeddings(rag_state.cache_embeddings.max_bytes)
+    rag_state.cache_respuestas = crear_desde_entorno()
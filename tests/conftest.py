@@ -0,0 +1,132 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Antes de importar la app: los tests no deben crear el manifiesto en disco
+os.environ["MANIFIESTO_PATH"] = ""
+from types import SimpleNamespace
+import pytest
+import app.states.rag_state as rag_state
+from app import admision
+from app.cache_embeddings import CacheEmbeddings
+from app.cache_respuestas import CacheRespuestas
+from app.bm25 import IndiceBM25
+from app.manifiestos import Manifiestos
+from app.vectores import PineconeStore
+
+
+class FakeEmbeddings:
+    def __init__(self, fallos=0):
+        self.llamadas = []
+        self.fallos = fallos
+
+    def create(self, input, model, **kwargs):
+        textos = [input] if isinstance(input, str) else list(input)
+        self.llamadas.append(textos)
+        if self.fallos:
+            self.fallos -= 1
+            raise RuntimeError("fallo simulado")
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=[float(len(t)), 1.0]) for i, t in enumerate(textos)
+        ])
+
+
+class FakeIndex:
+    def __init__(self, fallos=0):
+        self.upserts = []
+        self.consultas = []
+        self.borrados = []
+        self.actualizados = []
+        self.comprobaciones = 0
+        self.fallos = fallos
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        if self.fallos:
+            self.fallos -= 1
+            raise RuntimeError("fallo simulado")
+        self.upserts.append(list(vectors))
+
+    def delete(self, ids, namespace=None, **kwargs):
+        self.borrados.extend(ids)
+        self.upserts = [[v for v in lote if v[0] not in ids] for lote in self.upserts]
+
+    def update(self, id, set_metadata=None, namespace=None, **kwargs):
+        self.actualizados.append(id)
+        self.upserts = [
+            [(i, valores, {**meta, **set_metadata}) if i == id else (i, valores, meta) for i, valores, meta in lote]
+            for lote in self.upserts
+        ]
+
+    def describe_index_stats(self):
+        self.comprobaciones += 1
+        return {"namespaces": {}}
+
+    def query(self, vector, top_k, namespace=None, include_metadata=False, include_values=False, **kwargs):
+        self.consultas.append(vector)
+        # Como en Pinecone, un upsert con un id existente reemplaza al anterior
+        vectores = list({v[0]: v for lote in self.upserts for v in lote}.values())
+        puntuados = sorted(
+            (sum(a * b for a, b in zip(vector, valores)), id_, meta, valores) for id_, valores, meta in vectores
+        )[::-1][:top_k]
+        return SimpleNamespace(matches=[
+            SimpleNamespace(id=id_, score=score, metadata=meta, values=list(valores) if include_values else [])
+            for score, id_, meta, valores in puntuados
+        ])
+
+
+class FakeChat:
+    def __init__(self, respuesta="Respuesta simulada."):
+        self.llamadas = []
+        self.respuesta = respuesta
+        self.completions = self
+
+    def create(self, model, messages, stream=False, **kwargs):
+        self.llamadas.append(messages)
+        if stream:
+            palabras = (self.respuesta or "").split(" ")
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p if i == 0 else " " + p))])
+                for i, p in enumerate(palabras)
+            ])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.respuesta))])
+
+
+class FakeAsync:
+    # Adapta un fake síncrono a la interfaz de AsyncOpenAI compartiendo sus contadores
+    def __init__(self, sincrono):
+        self.sincrono = sincrono
+
+    async def create(self, *args, **kwargs):
+        respuesta = self.sincrono.create(*args, **kwargs)
+        if kwargs.get("stream"):
+            async def fragmentos():
+                for fragmento in respuesta:
+                    yield fragmento
+            return fragmentos()
+        return respuesta
+
+
+@pytest.fixture
+def clientes(monkeypatch):
+    embeddings = FakeEmbeddings()
+    index = FakeIndex()
+    chat = FakeChat()
+    monkeypatch.setattr(rag_state, "openai_client_instance", SimpleNamespace(embeddings=embeddings, chat=chat))
+    monkeypatch.setattr(rag_state, "openai_async_client_instance", SimpleNamespace(
+        embeddings=FakeAsync(embeddings), chat=SimpleNamespace(completions=FakeAsync(chat))
+    ))
+    monkeypatch.setattr(rag_state, "vector_store_instance", PineconeStore(index))
+    monkeypatch.setattr(rag_state, "initialization_error", None)
+    monkeypatch.setattr(rag_state, "INGESTA_BACKOFF_SEGUNDOS", 0)
+    monkeypatch.setattr(rag_state, "cache_embeddings", CacheEmbeddings(1024 * 1024))
+    monkeypatch.setattr(rag_state, "cache_respuestas", CacheRespuestas(0.95, 3600, 100))
+    monkeypatch.setattr(rag_state, "indice_lexico", IndiceBM25())
+    monkeypatch.setattr(rag_state, "manifiestos_instance", Manifiestos())
+    monkeypatch.setattr(rag_state, "EMBEDDING_BATCH_SIZE", 4)
+    monkeypatch.setattr(rag_state, "UPSERT_BATCH_SIZE", 3)
+    admision.reiniciar()
+    return embeddings, index
+
+
+@pytest.fixture
+def chat(clientes):
+    return rag_state.openai_client_instance.chat
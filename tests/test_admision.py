@@ -0,0 +1,132 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app import admision, metricas
+from app.admision import CuboTokens
+from app.api import api
+
+
+def test_cubo_se_rellena_con_el_tiempo():
+    cubo = CuboTokens(tasa=2, rafaga=2)
+    ahora = cubo.actualizado
+    assert cubo.tomar(ahora) == 0
+    assert cubo.tomar(ahora) == 0
+    assert cubo.tomar(ahora) == pytest.approx(0.5)
+    assert cubo.tomar(ahora + 0.5) == 0
+
+
+def test_limite_por_cliente_devuelve_429(clientes, monkeypatch):
+    monkeypatch.setattr(admision, "ADMISION_TASA", 0.1)
+    monkeypatch.setattr(admision, "ADMISION_RAFAGA", 2)
+    monkeypatch.setattr(admision, "ADMISION_CLAVES", ("a", "b"))
+    metricas.registro.reiniciar()
+    client = TestClient(api)
+    pregunta = {"pregunta": "¿Cómo se instala el equipo?"}
+    for _ in range(2):
+        assert client.post("/api/rag", json=pregunta, headers={"X-API-Key": "a"}).status_code == 200
+    respuesta = client.post("/api/rag", json=pregunta, headers={"X-API-Key": "a"})
+    assert respuesta.status_code == 429
+    assert int(respuesta.headers["Retry-After"]) >= 5
+    assert respuesta.json()["detail"]["codigo"] == "limite_cliente"
+    # Otro cliente no se ve afectado, ni las rutas fuera de /api/rag
+    assert client.post("/api/rag", json=pregunta, headers={"Authorization": "Bearer b"}).status_code == 200
+    assert client.get("/api/upstreams").status_code == 200
+    assert 'rag_admision_rechazos_total{motivo="limite_cliente"} 1' in client.get("/metrics").text
+
+
+def test_lote_cuesta_un_token_por_pregunta_y_acota_la_concurrencia(clientes, chat, monkeypatch):
+    from app.states import rag_state
+    monkeypatch.setattr(admision, "ADMISION_TASA", 0.1)
+    monkeypatch.setattr(admision, "ADMISION_RAFAGA", 5)
+    concurrencias = []
+    original = rag_state.ejecutar_rag_lote_async
+
+    async def lote(preguntas, concurrencia, namespaces=None):
+        concurrencias.append(concurrencia)
+        return await original(preguntas, concurrencia, namespaces)
+
+    monkeypatch.setattr(rag_state, "ejecutar_rag_lote_async", lote)
+    client = TestClient(api)
+    preguntas = ["¿Cómo se instala el equipo?"] * 4
+    r = client.post("/api/rag/batch", json={"preguntas": preguntas, "concurrencia": 10000})
+    assert r.status_code == 200
+    assert concurrencias == [rag_state.RAG_LOTE_CONCURRENCIA]
+    # Quedó un token: el siguiente lote no cabe aunque sea una sola petición
+    r = client.post("/api/rag/batch", json={"preguntas": preguntas})
+    assert r.status_code == 429
+    assert r.json()["detail"]["codigo"] == "limite_cliente" and int(r.headers["Retry-After"]) >= 1
+    # Un lote mayor que la ráfaga se admite con el cubo lleno y deja al cliente en deuda
+    cubo = admision.CuboTokens(tasa=1, rafaga=5)
+    assert cubo.tomar(cubo.actualizado, 20) == 0
+    assert cubo.tomar(cubo.actualizado) == pytest.approx(16)
+
+
+def test_identificar_cliente_no_guarda_la_clave(monkeypatch):
+    monkeypatch.setattr(admision, "ADMISION_CLAVES", ("secreto",))
+    cliente = admision.identificar_cliente({"headers": [(b"x-api-key", b"secreto")], "client": ("1.2.3.4", 1)})
+    assert cliente.startswith("key:") and "secreto" not in cliente
+    assert admision.identificar_cliente({"headers": [], "client": ("1.2.3.4", 1)}) == "ip:1.2.3.4"
+
+
+def test_claves_no_reconocidas_comparten_el_cubo_de_la_ip(monkeypatch):
+    monkeypatch.setattr(admision, "ADMISION_CLAVES", ("buena",))
+    limitador = admision.LimitadorClientes(tasa=0.1, rafaga=1)
+    esperas = []
+    for i in range(3):
+        scope = {"headers": [(b"x-api-key", f"inventada-{i}".encode())], "client": ("1.2.3.4", 1)}
+        esperas.append(limitador.tomar(admision.identificar_cliente(scope)))
+    assert esperas[0] == 0 and all(e > 0 for e in esperas[1:])
+    assert len(limitador) == 1
+
+
+def _scope(cliente: str) -> dict:
+    return {"type": "http", "method": "POST", "path": "/api/rag", "headers": [], "client": (cliente, 1)}
+
+
+def test_saturacion_devuelve_503(monkeypatch):
+    monkeypatch.setattr(admision, "ADMISION_TASA", 0)
+    monkeypatch.setattr(admision, "ADMISION_CONCURRENCIA", 1)
+    monkeypatch.setattr(admision, "ADMISION_COLA_MAX", 1)
+    monkeypatch.setattr(admision, "ADMISION_ESPERA_MAX_SEGUNDOS", 0.2)
+    admision.reiniciar()
+    metricas.registro.reiniciar()
+
+    async def main():
+        soltar = asyncio.Event()
+
+        async def app_lenta(scope, receive, send):
+            await soltar.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        middleware = admision.Admision(app_lenta)
+        respuestas = {}
+
+        def recoger(nombre):
+            async def send(mensaje):
+                if mensaje["type"] == "http.response.start":
+                    respuestas[nombre] = (mensaje["status"], dict(mensaje["headers"]))
+            return send
+
+        en_curso = asyncio.ensure_future(middleware(_scope("a"), None, recoger("en_curso")))
+        en_cola = asyncio.ensure_future(middleware(_scope("b"), None, recoger("en_cola")))
+        await asyncio.sleep(0.05)
+        assert dict((n, v) for n, _, v in admision._metricas_admision())["rag_admision_en_cola"] == 1
+        # Cola llena: rechazo inmediato
+        await middleware(_scope("c"), None, recoger("cola_llena"))
+        # La petición en cola agota su espera
+        await en_cola
+        soltar.set()
+        await en_curso
+        return respuestas
+
+    respuestas = asyncio.run(main())
+    assert respuestas["en_curso"][0] == 200
+    assert respuestas["cola_llena"][0] == 503 and respuestas["cola_llena"][1][b"retry-after"] == b"1"
+    assert respuestas["en_cola"][0] == 503
+    texto = metricas.registro.prometheus()
+    assert 'rag_admision_rechazos_total{motivo="cola_llena"} 1' in texto
+    assert 'rag_admision_rechazos_total{motivo="espera_agotada"} 1' in texto
@@ -0,0 +1,42 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import app.states.rag_state as rag_state
+from benchmarks import bench_rag, fakes
+
+
+def test_fakes_inyectan_fallos_de_forma_reproducible():
+    perfil = fakes.Perfil(tasa_fallos=0.5, semilla=3)
+    fallos = 0
+    for _ in range(100):
+        try:
+            perfil.esperar()
+        except RuntimeError:
+            fallos += 1
+    assert fallos == perfil.fallos
+    assert 30 < fallos < 70
+    assert fakes.embedding_determinista("a", 8) == fakes.embedding_determinista("a", 8)
+
+
+def test_benchmark_produce_informe_comparable(monkeypatch):
+    # El benchmark sustituye los clientes del módulo: se restauran al terminar
+    for nombre in ("openai_client_instance", "openai_async_client_instance", "vector_store_instance",
+                   "initialization_error", "cache_embeddings", "cache_respuestas", "indice_lexico",
+                   "manifiestos_instance"):
+        monkeypatch.setattr(rag_state, nombre, getattr(rag_state, nombre))
+    monkeypatch.setattr(rag_state, "INGESTA_BACKOFF_SEGUNDOS", 0)
+    args = bench_rag.construir_parser().parse_args([
+        "--preguntas", "6", "--corpus", "20", "--paginas", "2", "--formatos", "pdf,docx",
+        "--latencia-embedding", "0", "--latencia-chat", "0", "--latencia-index", "0",
+    ])
+
+    informe = bench_rag.ejecutar(args)
+
+    escenarios = informe["escenarios"]
+    assert set(escenarios) == {"consulta", "consulta_async", "api", "ingesta_pdf_2", "ingesta_docx_2"}
+    for nombre in ("consulta", "consulta_async", "api"):
+        assert escenarios[nombre]["operaciones"] == 6
+        assert escenarios[nombre]["errores"] == 0
+        assert set(escenarios[nombre]["latencia_ms"]) >= {"p50", "p95", "p99"}
+        assert escenarios[nombre]["memoria_pico_mb"] is not None
+    assert escenarios["ingesta_pdf_2"]["operaciones"] > 0
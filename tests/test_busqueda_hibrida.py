@@ -0,0 +1,112 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import app.states.rag_state as rag_state
+from app import rerank
+from app.bm25 import IndiceBM25, fusion_rrf, tokenizar
+from app.vectores import Match
+
+
+def test_tokenizar_codigos_y_acentos():
+    assert tokenizar("Pieza AB-1234, versión v2.1") == ["pieza", "ab-1234", "ab", "1234", "version", "v2.1", "v2", "1"]
+
+
+def test_bm25_prioriza_termino_exacto_y_borra(tmp_path):
+    path = tmp_path / "bm25.jsonl"
+    indice = IndiceBM25(str(path))
+    indice.agregar([
+        ("a", "manual de instalación del equipo", {"texto": "a"}),
+        ("b", "la referencia AB-1234 sustituye a la anterior", {"texto": "b"}),
+        ("c", "instalación y mantenimiento del equipo de bombeo", {"texto": "c"}),
+    ], "ns")
+    assert [m.id for m in indice.buscar("AB-1234", 5, "ns")] == ["b"]
+    assert [m.id for m in indice.buscar("instalación equipo", 5, "ns")][:2] == ["a", "c"]
+    assert indice.buscar("AB-1234", 5, "otro") == []
+    indice.eliminar(["b"], "ns")
+    assert indice.buscar("AB-1234", 5, "ns") == []
+    # El log se reproduce al reabrir, incluidas las bajas
+    reabierto = IndiceBM25(str(path))
+    assert reabierto.documentos("ns") == 2
+    assert reabierto.buscar("AB-1234", 5, "ns") == []
+
+
+def test_bm25_compacta_al_volver_a_subir_un_documento(tmp_path, monkeypatch):
+    from app import bm25
+    monkeypatch.setattr(bm25, "BM25_COMPACTAR_MIN", 10)
+    path = tmp_path / "bm25.jsonl"
+    indice = IndiceBM25(str(path))
+    indice.agregar([("otro", "garantía del equipo de bombeo", {"texto": "otro"})], "ns")
+    indice.agregar([("manual-0", "manual del equipo versión 0", {"texto": "manual"})], "ns")
+    indice.actualizar_metadatos([("otro", {"posicion": 3})], "ns")
+    inicial = {m.id: m.score for m in indice.buscar("equipo bombeo", 5, "ns")}
+    # Cada subida del manual da de alta la versión nueva y borra la anterior, como la ingesta
+    for version in range(1, 50):
+        indice.agregar([(f"manual-{version}", f"manual del equipo versión {version}", {"texto": "manual"})], "ns")
+        indice.eliminar([f"manual-{version - 1}"], "ns")
+        espacio = indice._espacios["ns"]
+        assert len(espacio.ids) <= 10 and indice.registros <= 10
+    assert {m.id: m.score for m in indice.buscar("equipo bombeo", 5, "ns")} == {
+        "otro": inicial["otro"], "manual-49": inicial["manual-0"]
+    }
+    # El log reescrito conserva el texto y los metadatos actualizados
+    reabierto = IndiceBM25(str(path))
+    assert reabierto.documentos("ns") == 2 and len(path.read_text(encoding="utf-8").splitlines()) <= 10
+    assert {m.id: m.score for m in reabierto.buscar("equipo bombeo", 5, "ns")} == {
+        "otro": inicial["otro"], "manual-49": inicial["manual-0"]
+    }
+    assert reabierto.buscar("garantía", 1, "ns")[0].metadata == {"texto": "otro", "posicion": 3}
+
+
+def test_fusion_rrf_premia_coincidencias():
+    densos = [Match("x", 0.9, {"texto": "x"}), Match("y", 0.8, {"texto": "y"})]
+    lexicos = [Match("y", 7.0, {"texto": "y"}), Match("z", 3.0, {"texto": "z"})]
+    fusion = fusion_rrf([densos, lexicos], 3)
+    assert [m.id for m in fusion] == ["y", "x", "z"]
+    assert fusion[0].metadata == {"texto": "y"}
+
+
+def _corpus():
+    largos = [f"párrafo genérico número {i} " + "relleno " * (20 + i) for i in range(15)]
+    return largos + ["Código AB-1234."]
+
+
+def test_rag_hibrido_recupera_codigo_exacto(clientes, chat, monkeypatch):
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", True)
+    asyncio.run(rag_state.ingestar_pipeline(_corpus(), "doc.txt"))
+    assert rag_state.indice_lexico.documentos(rag_state.PINECONE_NAMESPACE) == 16
+    resultado = rag_state.ejecutar_rag("AB-1234")
+    assert resultado["error"] is None
+    assert "Código AB-1234." in chat.llamadas[-1][-1]["content"]
+    assert "busqueda_lexica" in resultado["tiempos"]
+
+
+def test_rag_solo_vectorial_no_lo_encuentra(clientes, chat, monkeypatch):
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", False)
+    # Sólo la búsqueda: la reordenación (con su extra léxico sobre más candidatos) sí lo rescataría
+    monkeypatch.setattr(rerank, "RERANK", False)
+    asyncio.run(rag_state.ingestar_pipeline(_corpus(), "doc.txt"))
+    rag_state.ejecutar_rag("AB-1234")
+    assert "Código AB-1234." not in chat.llamadas[-1][-1]["content"]
+
+
+def test_rag_hibrido_async(clientes, chat, monkeypatch):
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", True)
+    asyncio.run(rag_state.ingestar_pipeline(_corpus(), "doc.txt"))
+    resultado = asyncio.run(rag_state.ejecutar_rag_async("AB-1234"))
+    assert resultado["error"] is None
+    assert "Código AB-1234." in chat.llamadas[-1][-1]["content"]
+
+
+def test_hibrida_solo_si_el_indice_lexico_cubre_el_namespace(clientes, monkeypatch):
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", True)
+    asyncio.run(rag_state.ingestar_pipeline(_corpus(), "doc.txt"))
+    assert rag_state._usar_hibrida()
+    # Reinicio con el manifiesto persistido pero el índice léxico en memoria: no cubre nada
+    monkeypatch.setattr(rag_state, "indice_lexico", IndiceBM25())
+    assert not rag_state._usar_hibrida()
+    # Volver a subir el documento no reembebe nada, pero reconstruye el índice léxico
+    resultado = asyncio.run(rag_state.ingestar_pipeline(_corpus(), "doc.txt"))
+    assert resultado["sin_cambios"] == 16 and resultado["embebidos"] == 0
+    assert rag_state.indice_lexico.documentos(rag_state.PINECONE_NAMESPACE) == 16
+    assert rag_state._usar_hibrida()
@@ -0,0 +1,57 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.cache_embeddings import CacheEmbeddings, clave_embedding
+
+
+def test_clave_normaliza_espacios_y_distingue_modelo():
+    assert clave_embedding("m", "hola  mundo \n") == clave_embedding("m", "hola mundo")
+    assert clave_embedding("m", "hola mundo") != clave_embedding("otro", "hola mundo")
+
+
+def test_lru_cuenta_hits_y_desaloja_por_tamano():
+    # Cada vector de 4 floats ocupa 16 bytes: caben dos
+    cache = CacheEmbeddings(max_bytes=32)
+    cache.guardar("m", "a", [1.0, 2.0, 3.0, 4.0])
+    cache.guardar("m", "b", [0.0] * 4)
+    assert cache.obtener("m", "a") == [1.0, 2.0, 3.0, 4.0]
+    cache.guardar("m", "c", [0.5] * 4)
+
+    assert cache.obtener("m", "b") is None  # el menos usado recientemente
+    assert cache.obtener("m", "a") is not None
+    stats = cache.estadisticas()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["desalojos"] == 1
+
+
+def test_nivel_persistente_sobrevive_reinicio(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    CacheEmbeddings(max_bytes=1024, path=path).guardar_varios("m", ["x", "y"], [[1.0], [2.0]])
+
+    nueva = CacheEmbeddings(max_bytes=1024, path=path)
+    assert nueva.obtener_varios("m", ["y", "z", "x"]) == [[2.0], None, [1.0]]
+    assert nueva.estadisticas()["hits_disco"] == 2
+
+
+def test_cache_semantica_umbral_ttl_y_capacidad(monkeypatch):
+    from app import cache_respuestas as modulo
+    cache = modulo.CacheRespuestas(umbral=0.99, ttl_segundos=10, max_entradas=2)
+    huella = modulo.huella_contexto("ns", ["b", "a"])
+    assert huella == modulo.huella_contexto("ns", ["a", "b"])
+    assert huella != modulo.huella_contexto("otro", ["a", "b"])
+
+    cache.guardar([1.0, 0.0], huella, "uno")
+    assert cache.buscar([0.999, 0.01], huella)[0] == "uno"
+    assert cache.buscar([0.0, 1.0], huella) is None
+    assert cache.buscar([1.0, 0.0], "otra-huella") is None
+
+    cache.guardar([0.0, 1.0], huella, "dos")
+    cache.guardar([1.0, 1.0], huella, "tres")
+    assert cache.estadisticas()["entradas"] == 2
+    assert cache.estadisticas()["desalojos"] == 1
+
+    ahora = modulo.time.monotonic()
+    monkeypatch.setattr(modulo.time, "monotonic", lambda: ahora + 11)
+    assert cache.buscar([0.0, 1.0], huella) is None
+    assert cache.estadisticas()["expiradas"] == 2
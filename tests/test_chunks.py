@@ -0,0 +1,83 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import random
+import pytest
+import app.states.rag_state as rag_state
+from app.chunks import Chunk, Divisor
+from benchmarks import bench_chunks, documentos
+
+
+def _texto(semilla=0, parrafos=40):
+    generador = random.Random(semilla)
+    return "\n\n".join(documentos.parrafo(generador, generador.randint(3, 120)) for _ in range(parrafos))
+
+
+def test_offsets_reproducen_el_texto_y_respetan_tamano_y_solape():
+    texto = _texto()
+    chunks = list(Divisor(200, 30).dividir([(None, texto)]))
+    assert len(chunks) > 10
+    for chunk in chunks:
+        assert texto[chunk.inicio:chunk.fin] == chunk.texto
+        assert len(chunk.texto) <= 200
+    for anterior, siguiente in zip(chunks, chunks[1:]):
+        assert siguiente.inicio > anterior.inicio
+        assert anterior.fin - siguiente.inicio <= 30
+    # Sin huecos: todo el texto (salvo espacios) queda cubierto
+    cubierto = set()
+    for chunk in chunks:
+        cubierto.update(range(chunk.inicio, chunk.fin))
+    assert all(texto[i].isspace() for i in range(len(texto)) if i not in cubierto)
+
+
+def test_palabras_mas_largas_que_el_chunk_se_parten():
+    chunks = Divisor(10, 2).dividir_texto("a" * 25 + " fin")
+    assert chunks == ["a" * 10, "a" * 10, "a" * 5 + " fin"]
+    with pytest.raises(ValueError):
+        Divisor(10, 10)
+
+
+def test_bloques_de_la_misma_pagina_se_unen_y_el_cambio_de_pagina_corta():
+    texto = _texto(1)
+    bloques = [(None, texto[i:i + 300]) for i in range(0, len(texto), 300)]
+    divisor = Divisor(200, 30)
+    assert list(divisor.dividir(bloques)) == list(divisor.dividir([(None, texto)]))
+
+    chunks = list(divisor.dividir([(1, "uno dos tres"), (2, "cuatro cinco")]))
+    assert chunks == [Chunk("uno dos tres", 1, 0, 12), Chunk("cuatro cinco", 2, 12, 24)]
+
+
+def test_texto_sin_parrafos_no_se_acumula_entero():
+    texto = _texto(2).replace("\n", " ")
+    divisor = Divisor(200, 30)
+    divisor.cola_max = 1000
+    bloques = [(None, texto[i:i + 300]) for i in range(0, len(texto), 300)]
+    chunks = list(divisor.dividir(bloques))
+    for chunk in chunks:
+        assert texto[chunk.inicio:chunk.fin] == chunk.texto
+        assert len(chunk.texto) <= 200
+    assert chunks[-1].fin == len(texto.rstrip())
+
+
+def test_medida_en_tokens():
+    # Cada palabra cuenta como un token
+    divisor = Divisor(4, 1, medir=lambda t: len(t.split()))
+    chunks = divisor.dividir_texto("uno dos tres cuatro cinco seis siete")
+    assert chunks == ["uno dos tres cuatro", "cuatro cinco seis siete"]
+
+
+def test_ingesta_guarda_pagina_y_offsets(clientes):
+    embeddings, index = clientes
+    chunks = rag_state.dividir_paginas([(3, "texto de la página tres")])
+    rag_state.ingestar_chunks(chunks, "doc.pdf")
+    metadatos = [meta for lote in index.upserts for (_, _, meta) in lote]
+    assert metadatos[0]["pagina"] == 3
+    assert (metadatos[0]["inicio"], metadatos[0]["fin"]) == (0, 23)
+
+
+def test_benchmark_de_chunks():
+    args = bench_chunks.construir_parser().parse_args(["--mb", "0.05", "--repeticiones", "1"])
+    informe = bench_chunks.ejecutar(args)
+    resultados = informe["documentos"]["0.05mb"]
+    assert resultados["divisor"]["chunks"] == resultados["divisor_stream"]["chunks"] > 0
+    assert resultados["divisor"]["memoria_pico_mb"] is not None
@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+import app.states.rag_state as rag_state
+from app.vectores import LocalStore
+from benchmarks import bench_import
+
+
+def test_importar_no_carga_clientes_ni_parsers():
+    _, modulos, cargados = bench_import._importar("app.states.rag_state")
+    assert cargados == []
+    assert any(nombre == "app.states.rag_state" for nombre, _ in modulos)
+
+
+def test_inicializacion_perezosa_y_una_sola_vez(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_state, "_clientes_inicializados", False)
+    monkeypatch.setattr(rag_state, "openai_client_instance", None)
+    monkeypatch.setattr(rag_state, "openai_async_client_instance", None)
+    monkeypatch.setattr(rag_state, "vector_store_instance", None)
+    monkeypatch.setattr(rag_state, "initialization_error", None)
+    monkeypatch.setattr(rag_state, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(rag_state, "VECTOR_BACKEND", "local")
+    monkeypatch.setattr(rag_state, "LOCAL_VECTOR_DIR", str(tmp_path))
+
+    stores = []
+    hilos = [threading.Thread(target=lambda: stores.append(rag_state.obtener_vector_store())) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert isinstance(stores[0], LocalStore)
+    assert all(store is stores[0] for store in stores)
+    assert rag_state.obtener_openai() is None
+    assert rag_state.error_inicializacion() == "OpenAI API key not found. Please set OPENAI_API_KEY."
+    assert "OPENAI_API_KEY" in rag_state.RAGState._check_clients_initialized_internal(None)
+
+
+def test_salud_cacheada_y_expuesta_en_la_api(clientes, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    _, index = clientes
+    monkeypatch.setattr(rag_state, "_salud", None)
+
+    assert rag_state.estado_salud()["ok"]
+    assert rag_state.estado_salud()["ok"]
+    assert index.comprobaciones == 1
+    rag_state.estado_salud(refrescar=True)
+    assert index.comprobaciones == 2
+
+    def caido():
+        raise RuntimeError("índice no encontrado")
+
+    monkeypatch.setattr(index, "describe_index_stats", caido)
+    with TestClient(api) as client:
+        assert client.get("/api/health").status_code == 200
+        r = client.get("/api/health", params={"refrescar": True})
+    assert r.status_code == 503
+    assert r.json()["vector_store"] == "error: índice no encontrado"
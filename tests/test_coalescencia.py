@@ -0,0 +1,166 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import threading
+import time
+import app.states.rag_state as rag_state
+from app import coalescencia, metricas
+
+
+def _coalescidas(camino):
+    return metricas.registro.resumen()["contadores"].get("rag_coalescidas_total", {}).get(f"camino={camino}", 0)
+
+
+def _esperar(condicion, segundos=5):
+    limite = time.time() + segundos
+    while not condicion():
+        assert time.time() < limite
+        time.sleep(0.005)
+
+
+def test_clave_normaliza_la_pregunta():
+    assert coalescencia.clave("ns", "¿Cómo  se instala?\n") == coalescencia.clave("ns", "¿CÓMO se instala?")
+    assert coalescencia.clave("ns", "a") != coalescencia.clave("otro", "a")
+
+
+def test_vuelo_propaga_errores_a_todos():
+    vuelo = coalescencia.Vuelo("prueba")
+    entrar, salir = threading.Event(), threading.Event()
+    errores = []
+
+    def fallar():
+        entrar.set()
+        salir.wait()
+        raise ValueError("caído")
+
+    def llamar():
+        try:
+            vuelo.hacer("k", fallar)
+        except ValueError as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=llamar)]
+    hilos[0].start()
+    entrar.wait()
+    hilos += [threading.Thread(target=llamar) for _ in range(3)]
+    for hilo in hilos[1:]:
+        hilo.start()
+    time.sleep(0.05)
+    salir.set()
+    for hilo in hilos:
+        hilo.join()
+    assert len(errores) == 4 and vuelo.en_vuelo() == 0
+
+
+def test_peticiones_sincronas_identicas_comparten_pipeline(clientes, chat):
+    embeddings, _ = clientes
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+    llamadas_embedding = len(embeddings.llamadas)
+    metricas.registro.reiniciar()
+    liberar = threading.Event()
+    crear = chat.create
+
+    def create_bloqueado(*args, **kwargs):
+        liberar.wait()
+        return crear(*args, **kwargs)
+
+    chat.create = create_bloqueado
+    resultados = []
+    preguntas = ["¿Cómo se instala el equipo?"] + ["  ¿cómo se instala  el EQUIPO? "] * 4
+    hilos = [threading.Thread(target=lambda p=p: resultados.append(rag_state.ejecutar_rag(p))) for p in preguntas]
+    hilos[0].start()
+    _esperar(lambda: rag_state._vuelo_rag.en_vuelo() == 1)
+    for hilo in hilos[1:]:
+        hilo.start()
+    _esperar(lambda: _coalescidas("sincrono") == 4)
+    liberar.set()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(chat.llamadas) == 1
+    assert len(embeddings.llamadas) == llamadas_embedding + 1
+    assert [r["respuesta"] for r in resultados] == ["Respuesta simulada."] * 5
+    assert rag_state._vuelo_rag.en_vuelo() == 0
+
+
+def test_peticiones_async_identicas_comparten_pipeline(clientes, chat):
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+
+    async def escenario():
+        return await asyncio.gather(*(rag_state.ejecutar_rag_async("¿Cómo se instala el equipo?") for _ in range(5)))
+
+    resultados = asyncio.run(escenario())
+    assert len(chat.llamadas) == 1
+    assert all(r["respuesta"] == "Respuesta simulada." and r["cache"] is False for r in resultados)
+    # Cada petición recibe su propia copia del resultado
+    resultados[0]["tiempos"]["x"] = 1
+    assert "x" not in resultados[1]["tiempos"]
+
+
+def test_stream_async_reparte_eventos_y_sobrevive_a_una_desconexion(clientes, chat):
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+    chat.respuesta = "una respuesta bastante larga con muchas palabras para el stream"
+
+    async def leer(pregunta, maximo=None):
+        eventos = []
+        flujo = rag_state.responder_pregunta_rag_stream_async(pregunta)
+        async for evento in flujo:
+            eventos.append(evento)
+            await asyncio.sleep(0)
+            if maximo and len(eventos) >= maximo:
+                await flujo.aclose()
+                break
+        return eventos
+
+    async def escenario():
+        return await asyncio.gather(
+            leer("¿Cómo se instala el equipo?"),
+            leer("¿cómo se instala el equipo?", maximo=2),
+            leer("¿Cómo se instala el equipo? "),
+        )
+
+    completo, cortado, tercero = asyncio.run(escenario())
+    assert len(chat.llamadas) == 1
+    assert completo == tercero
+    assert completo[-1]["tipo"] == "fin" and completo[-1]["respuesta"] == chat.respuesta
+    assert cortado == completo[:2]
+    assert rag_state._difusion_rag_async.en_vuelo() == 0
+
+
+def test_stream_sincrono_comparte_generacion(clientes, chat, monkeypatch):
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+    monkeypatch.setattr(rag_state.cache_respuestas, "buscar", lambda *a: None)
+    metricas.registro.reiniciar()
+    liberar = threading.Event()
+    crear = chat.create
+
+    def create_bloqueado(*args, **kwargs):
+        liberar.wait()
+        return crear(*args, **kwargs)
+
+    chat.create = create_bloqueado
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(list(rag_state.responder_pregunta_rag_stream("¿Qué dice?"))))
+             for _ in range(3)]
+    for hilo in hilos:
+        hilo.start()
+    _esperar(lambda: _coalescidas("stream") == 2)
+    liberar.set()
+    for hilo in hilos:
+        hilo.join()
+    assert len(chat.llamadas) == 1
+    assert resultados[0] == resultados[1] == resultados[2]
+    assert resultados[0][-1]["respuesta"] == "Respuesta simulada."
+
+
+def test_coalescencia_desactivable(clientes, chat, monkeypatch):
+    monkeypatch.setattr(coalescencia, "COALESCENCIA", False)
+    monkeypatch.setattr(rag_state.cache_respuestas, "buscar", lambda *a: None)
+    rag_state.ingestar_chunks(["texto"], "a.txt")
+
+    async def escenario():
+        return await asyncio.gather(*(rag_state.ejecutar_rag_async("¿Qué dice el texto?") for _ in range(3)))
+
+    asyncio.run(escenario())
+    assert len(chat.llamadas) == 3
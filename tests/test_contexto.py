@@ -0,0 +1,77 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import app.states.rag_state as rag_state
+from app import contexto, metricas
+from app.vectores import Match
+
+
+def _m(id_, score, texto, fuente="doc.pdf", posicion=None):
+    return Match(id_, score, {"texto": texto, "fuente": fuente, "posicion": posicion})
+
+
+def test_elimina_duplicados_exactos_y_casi_exactos():
+    base = "el equipo debe revisarse cada seis meses por personal autorizado del servicio técnico oficial"
+    empaquetado = contexto.empaquetar([
+        _m("a", 0.9, base, "a.pdf", 1),
+        _m("b", 0.8, "  El equipo debe revisarse cada seis meses por personal autorizado del servicio técnico oficial ", "b.pdf", 7),
+        _m("c", 0.7, base + " oficial", "c.pdf", 3),
+        _m("d", 0.6, "texto distinto sobre la garantía", "a.pdf", 9),
+    ])
+    assert empaquetado["duplicados"] == 2
+    assert empaquetado["chunks_usados"] == 2
+    assert empaquetado["texto"] == base + contexto.SEPARADOR + "texto distinto sobre la garantía"
+    assert empaquetado["tokens_ahorrados"] > 0
+
+
+def test_une_chunks_contiguos_sin_repetir_el_solape():
+    empaquetado = contexto.empaquetar([
+        _m("b", 0.7, "segunda parte. Tercera frase", posicion=1),
+        _m("a", 0.9, "Primera frase y segunda parte.", posicion=0),
+        _m("x", 0.5, "Otro documento", fuente="otro.pdf", posicion=1),
+    ])
+    assert empaquetado["fusionados"] == 1
+    assert empaquetado["texto"].split(contexto.SEPARADOR) == [
+        "Primera frase y segunda parte. Tercera frase",
+        "Otro documento",
+    ]
+
+
+def test_no_une_documentos_con_el_mismo_nombre_de_ambitos_distintos():
+    matches = [
+        Match("a", 0.9, {"texto": "Contrato de Ana, cláusula uno.", "fuente": "contrato.pdf", "documento": "ui:a/contrato.pdf", "posicion": 0}),
+        Match("b", 0.8, {"texto": "Contrato de Luis, cláusula dos.", "fuente": "contrato.pdf", "documento": "ui:b/contrato.pdf", "posicion": 1}),
+    ]
+    empaquetado = contexto.empaquetar(matches)
+    assert empaquetado["fusionados"] == 0
+    assert empaquetado["texto"].split(contexto.SEPARADOR) == ["Contrato de Ana, cláusula uno.", "Contrato de Luis, cláusula dos."]
+
+
+def test_respeta_el_presupuesto_por_orden_de_score():
+    empaquetado = contexto.empaquetar([
+        _m("a", 0.9, "a" * 400, posicion=0),
+        _m("b", 0.8, "b" * 400, posicion=5),
+        _m("c", 0.7, "c" * 40, posicion=9),
+    ], max_tokens=120)
+    assert empaquetado["texto"] == "a" * 400 + contexto.SEPARADOR + "c" * 40
+    assert empaquetado["fuera_de_presupuesto"] == 1
+    # Si el mejor chunk no cabe se recorta en lugar de devolver un contexto vacío
+    recortado = contexto.empaquetar([_m("a", 0.9, "a" * 1000)], max_tokens=50)
+    assert recortado["texto"] == "a" * 200
+
+
+def test_filtrar_por_score():
+    matches = [_m("a", 0.9, "a"), _m("b", 0.1, "b")]
+    assert [m.id for m in contexto.filtrar_por_score(matches, 0.5)] == ["a"]
+
+
+def test_rag_registra_tokens_ahorrados(clientes, chat):
+    metricas.registro.reiniciar()
+    repetido = "párrafo repetido en dos subidas del mismo documento con el mismo contenido"
+    # El mismo párrafo subido en dos documentos distintos llega dos veces a la búsqueda
+    rag_state.ingestar_chunks([repetido, "otro párrafo distinto"], "doc.txt")
+    rag_state.ingestar_chunks([repetido], "copia.txt")
+    rag_state.ejecutar_rag("pregunta")
+    assert chat.llamadas[-1][-1]["content"].count(repetido) == 1
+    contadores = metricas.registro.resumen()["contadores"]
+    assert contadores["rag_contexto_tokens_ahorrados_total"][""] > 0
@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import docx
+from docx.enum.text import WD_BREAK
+import app.states.rag_state as rag_state
+from app import extraccion
+from app.ingesta import TrabajoIngesta
+from benchmarks import documentos
+
+
+def test_pdf_en_paralelo_mantiene_orden_y_numeros(tmp_path, monkeypatch):
+    path = documentos.generar_pdf(tmp_path / "grande.pdf", paginas=9)
+    monkeypatch.setattr(extraccion, "EXTRACCION_PROCESOS", 1)
+    secuencial = list(extraccion.paginas_pdf(str(path)))
+    monkeypatch.setattr(extraccion, "EXTRACCION_PROCESOS", 2)
+    monkeypatch.setattr(extraccion, "EXTRACCION_PAGINAS_POR_TAREA", 2)
+    paralelo = list(extraccion.paginas_pdf(str(path)))
+    assert paralelo == secuencial
+    assert [n for n, _ in paralelo] == list(range(1, 10))
+    assert paralelo[4][1].startswith("Página 5")
+
+
+def test_docx_usa_saltos_de_pagina(tmp_path):
+    documento = docx.Document()
+    documento.add_paragraph("uno")
+    documento.add_paragraph("dos")
+    documento.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+    documento.add_paragraph("tres")
+    documento.save(str(tmp_path / "doc.docx"))
+    assert list(extraccion.paginas_docx(str(tmp_path / "doc.docx"))) == [(1, "uno\ndos"), (2, "\ntres")]
+
+
+def test_ingesta_guarda_la_pagina_en_los_metadatos(clientes, tmp_path):
+    embeddings, index = clientes
+    path = documentos.generar_pdf(tmp_path / "manual.pdf", paginas=3)
+    trabajo = TrabajoIngesta("manual.pdf")
+    asyncio.run(rag_state.ingestar_archivo(path, "manual.pdf", trabajo))
+    metadatos = [meta for lote in index.upserts for (_, _, meta) in lote]
+    assert trabajo.subidos == len(metadatos) > 3
+    assert {meta["pagina"] for meta in metadatos} == {1, 2, 3}
+    paginas = dict(extraccion.paginas_pdf(str(path)))
+    assert all(meta["texto"] in paginas[meta["pagina"]] for meta in metadatos)
+
+
+def test_subida_se_copia_por_bloques(tmp_path, monkeypatch):
+    class Subida:
+        def __init__(self, datos):
+            self.datos = datos
+            self.lecturas = []
+
+        async def read(self, tamano=-1):
+            self.lecturas.append(tamano)
+            bloque, self.datos = self.datos[:tamano], self.datos[tamano:]
+            return bloque
+
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: tmp_path)
+    monkeypatch.setattr(rag_state, "SUBIDA_BLOQUE_BYTES", 1000)
+    subida = Subida(b"x" * 2500)
+    path = asyncio.run(rag_state.guardar_archivo_subido(subida, "doc.txt"))
+    assert path.read_bytes() == b"x" * 2500
+    assert subida.lecturas == [1000] * 4
@@ -0,0 +1,129 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import time
+import pytest
+import app.states.rag_state as rag_state
+from fastapi.testclient import TestClient
+from app import fanout, metricas
+from app.api import api
+from app.vectores import LocalStore, Match
+
+
+def test_fusion_por_score_con_cuota_y_sin_repetidos():
+    uno = [Match("a", 0.9), Match("b", 0.8), Match("c", 0.7)]
+    dos = [Match("x", 0.85), Match("a", 0.6), Match("y", 0.5)]
+    assert [m.id for m in fanout.fusionar([uno, dos], 10, cuota=0)] == ["a", "x", "b", "c", "y"]
+    assert [m.id for m in fanout.fusionar([uno, dos], 3, cuota=2)] == ["a", "x", "b"]
+    assert [m.id for m in fanout.fusionar([uno, dos], 10, cuota=1)] == ["a", "x"]
+
+
+def test_normalizar_y_validar(monkeypatch):
+    # Sin configurar sólo se permite el namespace por defecto
+    assert fanout.NAMESPACES_PERMITIDOS == (rag_state.PINECONE_NAMESPACE,)
+    assert "otro" in fanout.validar([rag_state.PINECONE_NAMESPACE, "otro"])
+    assert fanout.normalizar(None, "Pruebas") == ["Pruebas"]
+    assert fanout.normalizar([" b", "a", "b", ""], "Pruebas") == ["a", "b"]
+    monkeypatch.setattr(fanout, "NAMESPACES_PERMITIDOS", ("a", "b"))
+    assert fanout.validar(["a", "b"]) is None
+    assert "c" in fanout.validar(["a", "c"])
+    monkeypatch.setattr(fanout, "FANOUT_MAX_NAMESPACES", 1)
+    assert "Máximo" in fanout.validar(["a", "b"])
+
+
+def test_busqueda_en_varios_namespaces(tmp_path, monkeypatch):
+    store = LocalStore(str(tmp_path))
+    store.upsert([("a1", [1.0, 0.0], {"texto": "a1"}), ("a2", [0.6, 0.8], {"texto": "a2"})], "a")
+    store.upsert([("b1", [0.8, 0.6], {"texto": "b1"})], "b")
+    monkeypatch.setattr(rag_state, "vector_store_instance", store)
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", False)
+    matches = rag_state.buscar_namespaces("pregunta", [1.0, 0.0], ["a", "b"], top_k=3)
+    assert [m.id for m in matches] == ["a1", "b1", "a2"]
+    matches = asyncio.run(rag_state.buscar_namespaces_async("pregunta", [1.0, 0.0], ["a", "b"], top_k=3))
+    assert [m.id for m in matches] == ["a1", "b1", "a2"]
+
+
+def test_namespace_lento_se_descarta(monkeypatch):
+    monkeypatch.setattr(fanout, "FANOUT_TIMEOUT_SEGUNDOS", 0.1)
+    monkeypatch.setattr(fanout, "NAMESPACES_PERMITIDOS", ("lento", "rapido"))
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", False)
+    monkeypatch.setattr(rag_state, "vector_store_instance", object())
+    metricas.registro.reiniciar()
+
+    def buscar(embedding, top_k=10, namespace=None, hasta=None):
+        if namespace == "lento":
+            time.sleep(0.5)
+        return [Match(f"{namespace}-1", 0.5)]
+
+    monkeypatch.setattr(rag_state, "buscar_matches", buscar)
+    inicio = time.perf_counter()
+    matches = asyncio.run(rag_state.buscar_namespaces_async("pregunta", [1.0], ["lento", "rapido"]))
+    assert time.perf_counter() - inicio < 0.4
+    assert [m.id for m in matches] == ["rapido-1"]
+    assert 'motivo="timeout",namespace="lento",tipo="densa"' in metricas.registro.prometheus()
+
+
+def test_namespace_saturado_no_ocupa_mas_hilos(monkeypatch):
+    monkeypatch.setattr(fanout, "FANOUT_TIMEOUT_SEGUNDOS", 0.1)
+    monkeypatch.setattr(fanout, "FANOUT_EN_VUELO_NAMESPACE", 1)
+    monkeypatch.setattr(fanout, "NAMESPACES_PERMITIDOS", ("colgado", "rapido"))
+    monkeypatch.setattr(fanout, "_en_vuelo", {})
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", False)
+    metricas.registro.reiniciar()
+    lanzadas = []
+
+    def buscar(embedding, top_k=10, namespace=None, hasta=None):
+        lanzadas.append(namespace)
+        if namespace == "colgado":
+            time.sleep(0.5)
+        return [Match(f"{namespace}-1", 0.5)]
+
+    monkeypatch.setattr(rag_state, "buscar_matches", buscar)
+    for _ in range(2):
+        assert [m.id for m in rag_state.buscar_namespaces("pregunta", [1.0], ["colgado", "rapido"])] == ["rapido-1"]
+    # La segunda vez el namespace colgado ya tiene su consulta en vuelo: ni se lanza
+    assert lanzadas.count("colgado") == 1
+    assert 'motivo="saturado",namespace="colgado",tipo="densa"' in metricas.registro.prometheus()
+
+
+def test_busqueda_con_plazo_vencido_no_llega_al_almacen(clientes):
+    _, index = clientes
+    with pytest.raises(TimeoutError):
+        rag_state.buscar_matches([1.0, 0.0], 5, hasta=time.monotonic() - 1)
+    assert index.consultas == []
+
+
+def test_sin_ningun_namespace_la_busqueda_falla(monkeypatch):
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", False)
+
+    def caido(embedding, top_k=10, namespace=None, hasta=None):
+        raise RuntimeError("índice caído")
+
+    monkeypatch.setattr(rag_state, "buscar_matches", caido)
+    with pytest.raises(RuntimeError, match="Ningún namespace"):
+        rag_state.buscar_namespaces("pregunta", [1.0], ["a", "b"])
+
+
+def test_api_rechaza_namespaces_no_permitidos(clientes, monkeypatch):
+    monkeypatch.setattr(fanout, "NAMESPACES_PERMITIDOS", ("Pruebas", "otro"))
+    client = TestClient(api)
+    respuesta = client.post("/api/rag", json={"pregunta": "¿Cómo se instala el equipo?", "namespaces": ["secreto"]})
+    assert respuesta.status_code == 422
+    assert respuesta.json()["detail"]["codigo"] == "namespaces"
+    respuesta = client.post("/api/rag", json={"pregunta": "¿Cómo se instala el equipo?", "namespaces": ["Pruebas", "otro"]})
+    assert respuesta.status_code == 200
+
+
+def test_etiquetas_de_metricas_acotadas_y_escapadas(tmp_path):
+    metricas.registro.reiniciar()
+    fanout._descartar(('x"}\nfalsa 1', "densa"), "timeout")
+    metricas.registro.incrementar("rag_prueba_total", origen='a"b\nc')
+    texto = metricas.registro.prometheus()
+    assert 'namespace="otro"' in texto
+    assert 'rag_prueba_total{origen="a\\"b\\nc"} 1' in texto
+    assert "\nfalsa 1" not in texto
+    # Consultar un namespace inexistente no lo crea en el almacén local
+    store = LocalStore(str(tmp_path))
+    assert store.query([1.0, 0.0], 5, "inventado") == []
+    assert not (tmp_path / "inventado").exists()
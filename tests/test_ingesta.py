@@ -0,0 +1,234 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import app.states.rag_state as rag_state
+
+
+def test_lotes_respetan_items_y_caracteres():
+    textos = ["a" * 10] * 5
+    assert [len(l) for l in rag_state._agrupar_en_lotes(textos, 2, 1000)] == [2, 2, 1]
+    assert [len(l) for l in rag_state._agrupar_en_lotes(textos, 10, 25)] == [2, 2, 1]
+    # Un texto más grande que el límite va solo en su lote
+    assert list(rag_state._agrupar_en_lotes(["a" * 50, "b"], 10, 20)) == [["a" * 50], ["b"]]
+
+
+def test_ingesta_por_lotes(clientes):
+    embeddings, index = clientes
+    chunks = [f"chunk {i}" for i in range(10)]
+    progreso = []
+    resultado = rag_state.ingestar_chunks(chunks, "doc.txt", on_progreso=lambda *a: progreso.append(a))
+
+    assert resultado == {"extraidos": 10, "embebidos": 10, "subidos": 10, "fallidos": 0, "sin_cambios": 0, "eliminados": 0}
+    assert sorted(len(l) for l in embeddings.llamadas) == [2, 4, 4]
+    assert sorted(len(u) for u in index.upserts) == [1, 3, 3, 3]
+    posiciones = sorted(meta["posicion"] for lote in index.upserts for (_, _, meta) in lote)
+    assert posiciones == list(range(10))
+    assert ("embebidos", 10, 10) in progreso
+
+
+def test_reintento_de_upsert_no_reembebe(clientes):
+    embeddings, index = clientes
+    index.fallos = 1
+    resultado = rag_state.ingestar_chunks([f"c{i}" for i in range(3)], "doc.txt")
+
+    assert resultado["subidos"] == 3
+    assert len(embeddings.llamadas) == 1
+
+
+def test_lote_de_embedding_fallido_se_reintenta(clientes):
+    embeddings, index = clientes
+    embeddings.fallos = 1
+    resultado = rag_state.ingestar_chunks([f"c{i}" for i in range(6)], "doc.txt")
+
+    assert resultado["fallidos"] == 0
+    assert resultado["subidos"] == 6
+    # Sólo el lote que falló se repite
+    assert len(embeddings.llamadas) == 3
+
+
+def test_pipeline_acota_peticiones_en_vuelo(clientes, monkeypatch):
+    import threading
+    import time
+    embeddings, index = clientes
+    activos = {"ahora": 0, "max": 0}
+    candado = threading.Lock()
+    crear = embeddings.create
+
+    def create_lento(input, model, **kwargs):
+        with candado:
+            activos["ahora"] += 1
+            activos["max"] = max(activos["max"], activos["ahora"])
+        time.sleep(0.01)
+        with candado:
+            activos["ahora"] -= 1
+        return crear(input, model)
+
+    monkeypatch.setattr(embeddings, "create", create_lento)
+    monkeypatch.setattr(rag_state, "INGESTA_EMBED_WORKERS", 4)
+    monkeypatch.setattr(rag_state, "INGESTA_MAX_EN_VUELO", 2)
+    resultado = rag_state.ingestar_chunks((f"c{i}" for i in range(40)), "doc.txt")
+
+    assert resultado["subidos"] == 40
+    assert activos["max"] <= 2
+
+
+def test_trabajo_en_segundo_plano_y_cancelacion(clientes, tmp_path):
+    from app import ingesta
+    archivo = tmp_path / "doc.txt"
+    archivo.write_text(" ".join(f"frase de prueba {i}." for i in range(300)), encoding="utf-8")
+
+    async def escenario():
+        trabajo = rag_state.lanzar_ingesta(archivo, "doc.txt")
+        while not trabajo.terminado:
+            await asyncio.sleep(0.01)
+
+        async def bloquear(_):
+            await asyncio.sleep(10)
+
+        lento = ingesta.lanzar("lento.txt", bloquear)
+        await asyncio.sleep(0)
+        assert lento.cancelar()
+        while not lento.terminado:
+            await asyncio.sleep(0.01)
+        return trabajo, lento
+
+    trabajo, lento = asyncio.run(escenario())
+    assert trabajo.estado == "completado"
+    assert trabajo.subidos == trabajo.extraidos > 0
+    assert ingesta.obtener(trabajo.id) is trabajo
+    assert lento.estado == "cancelado"
+    # El archivo subido se borra al terminar el trabajo
+    assert not archivo.exists()
+
+
+def test_archivo_se_borra_aunque_la_ingesta_falle_o_se_cancele(clientes, tmp_path):
+    vacio = tmp_path / "vacio.txt"
+    vacio.write_text("", encoding="utf-8")
+    pendiente = tmp_path / "pendiente.txt"
+    pendiente.write_text("texto " * 100, encoding="utf-8")
+
+    async def escenario():
+        fallido = rag_state.lanzar_ingesta(vacio, "vacio.txt")
+        cancelado = rag_state.lanzar_ingesta(pendiente, "pendiente.txt")
+        await asyncio.sleep(0)
+        cancelado.cancelar()
+        while not (fallido.terminado and cancelado.terminado):
+            await asyncio.sleep(0.01)
+        return fallido, cancelado
+
+    fallido, cancelado = asyncio.run(escenario())
+    assert fallido.estado == "error" and cancelado.estado == "cancelado"
+    assert not vacio.exists() and not pendiente.exists()
+
+
+def test_api_ingest_y_consulta(clientes, tmp_path, monkeypatch):
+    import time
+    from fastapi.testclient import TestClient
+    from app.api import api
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: tmp_path)
+
+    with TestClient(api) as client:
+        r = client.post("/api/ingest", files={"file": ("manual.txt", "contenido del manual " * 100)})
+        assert r.status_code == 200
+        job_id = r.json()["job_id"]
+        for _ in range(200):
+            estado = client.get(f"/api/ingest/{job_id}").json()
+            if estado["estado"] in ("completado", "error", "cancelado"):
+                break
+            time.sleep(0.01)
+        assert estado["estado"] == "completado"
+        assert estado["subidos"] > 0
+        assert client.get("/api/ingest/no-existe").status_code == 404
+
+
+def test_reingesta_usa_cache_de_embeddings(clientes):
+    embeddings, index = clientes
+    # Otro documento con los mismos textos: ids distintos, pero los embeddings salen de la caché
+    rag_state.ingestar_chunks(["a", "b", "c"], "doc.txt")
+    rag_state.ingestar_chunks(["a", "b", "c", "d"], "copia.txt")
+
+    assert [sorted(l) for l in embeddings.llamadas] == [["a", "b", "c"], ["d"]]
+    assert rag_state.cache_embeddings.estadisticas()["hits"] == 3
+
+
+def test_reingesta_incremental_sube_cambios_y_borra_obsoletos(clientes):
+    embeddings, index = clientes
+    primera = rag_state.ingestar_chunks(["a", "b", "c", "d"], "manual.pdf")
+    ids = {id_ for lote in index.upserts for (id_, _, _) in lote}
+    assert primera["subidos"] == 4
+
+    segunda = rag_state.ingestar_chunks(["a", "b", "c modificado", "d"], "manual.pdf")
+    assert segunda == {"extraidos": 4, "embebidos": 1, "subidos": 1, "fallidos": 0, "sin_cambios": 3, "eliminados": 1}
+    assert embeddings.llamadas[-1] == ["c modificado"]
+    assert index.borrados == [rag_state.id_chunk("manual.pdf", "c")]
+    assert rag_state.obtener_manifiestos().obtener(rag_state.PINECONE_NAMESPACE, "manual.pdf") == (
+        ids - {rag_state.id_chunk("manual.pdf", "c")}
+    ) | {rag_state.id_chunk("manual.pdf", "c modificado")}
+
+    # Una subida idéntica no toca ni embeddings ni índice
+    llamadas, upserts = len(embeddings.llamadas), len(index.upserts)
+    tercera = rag_state.ingestar_chunks(["a", "b", "c modificado", "d"], "manual.pdf")
+    assert tercera["sin_cambios"] == 4 and tercera["subidos"] == 0
+    assert (len(embeddings.llamadas), len(index.upserts)) == (llamadas, upserts)
+    assert rag_state.indice_lexico.documentos(rag_state.PINECONE_NAMESPACE) == 4
+
+
+def test_documentos_con_el_mismo_nombre_no_se_pisan(clientes):
+    _, index = clientes
+    uno = rag_state.documento_de("Manual.pdf", "key:uno")
+    otro = rag_state.documento_de("manual.pdf", "key:otro")
+    rag_state.ingestar_chunks(["a", "b"], "manual.pdf", documento=uno)
+    rag_state.ingestar_chunks(["c", "d"], "manual.pdf", documento=otro)
+    assert index.borrados == []
+    assert rag_state.obtener_manifiestos().obtener(rag_state.PINECONE_NAMESPACE, uno) == {
+        rag_state.id_chunk(uno, "a"), rag_state.id_chunk(uno, "b")
+    }
+    assert rag_state.obtener_manifiestos().total(rag_state.PINECONE_NAMESPACE) == 4
+    assert rag_state.obtener_manifiestos().fuentes(rag_state.PINECONE_NAMESPACE) == ["manual.pdf"]
+    # Volver a subirlo con la misma identidad sí reemplaza sólo lo suyo
+    rag_state.ingestar_chunks(["a"], "manual.pdf", documento=uno)
+    assert index.borrados == [rag_state.id_chunk(uno, "b")]
+
+
+def test_reingesta_reescribe_la_posicion_de_los_chunks_que_se_mueven(clientes):
+    _, index = clientes
+    rag_state.ingestar_chunks(["a", "b", "c"], "manual.pdf")
+    # Un párrafo nuevo al principio desplaza a los conservados: sólo cambian sus metadatos
+    resultado = rag_state.ingestar_chunks(["nuevo", "a", "b", "c"], "manual.pdf")
+    assert resultado["sin_cambios"] == 3 and resultado["subidos"] == 1
+    metadatos = {meta["texto"]: meta for lote in index.upserts for (_, _, meta) in lote}
+    assert {texto: meta["posicion"] for texto, meta in metadatos.items()} == {"nuevo": 0, "a": 1, "b": 2, "c": 3}
+    assert all(meta["documento"] == "manual.pdf" for meta in metadatos.values())
+    assert rag_state.indice_lexico.buscar("b", 1, rag_state.PINECONE_NAMESPACE)[0].metadata["posicion"] == 2
+    # Sin movimientos no hay nada que reescribir
+    actualizados = len(index.actualizados)
+    rag_state.ingestar_chunks(["nuevo", "a", "b", "c"], "manual.pdf")
+    assert len(index.actualizados) == actualizados == 3
+
+
+def test_manifiesto_en_disco_migra_el_formato_anterior(tmp_path):
+    import sqlite3
+    from app.manifiestos import Manifiestos
+    path = str(tmp_path / "manifiestos.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE chunks (namespace TEXT NOT NULL, fuente TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (namespace, fuente, id))")
+    db.execute("INSERT INTO chunks VALUES ('ns', 'doc.txt', 'x')")
+    db.commit()
+    db.close()
+    assert Manifiestos(path).obtener("ns", "doc.txt") == {"x"}
+    assert Manifiestos(path).posiciones("ns", "doc.txt") == {"x": None}
+    Manifiestos(path).reemplazar("ns", "key:a/doc.txt", ["y"], "doc.txt")
+    # Persiste entre instancias (reinicios)
+    manifiestos = Manifiestos(path)
+    assert manifiestos.obtener("ns", "key:a/doc.txt") == {"y"} and manifiestos.total("ns") == 2
+
+
+def test_chunks_fallidos_se_reintentan_en_la_siguiente_subida(clientes):
+    embeddings, index = clientes
+    index.fallos = rag_state.INGESTA_MAX_REINTENTOS
+    primera = rag_state.ingestar_chunks(["a", "b"], "doc.txt")
+    assert primera["fallidos"] == 2
+    assert rag_state.obtener_manifiestos().obtener(rag_state.PINECONE_NAMESPACE, "doc.txt") == set()
+    segunda = rag_state.ingestar_chunks(["a", "b"], "doc.txt")
+    assert segunda["subidos"] == 2 and segunda["sin_cambios"] == 0
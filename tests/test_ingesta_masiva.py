@@ -0,0 +1,245 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import io
+import time
+import zipfile
+import pytest
+import app.states.rag_state as rag_state
+from app import extraccion, ingesta
+
+
+def test_limite_justo_reparte_turnos_entre_archivos():
+    async def escenario():
+        limite = ingesta.LimiteJusto(1)
+        orden = []
+
+        async def peticion(clave):
+            async with limite.para(clave):
+                orden.append(clave)
+                await asyncio.sleep(0)
+
+        await limite.adquirir("ocupado")
+        tareas = [asyncio.create_task(peticion(c)) for c in ("a", "a", "a", "b", "c")]
+        await asyncio.sleep(0)
+        limite.liberar()
+        await asyncio.gather(*tareas)
+        return orden, limite.en_uso
+
+    orden, en_uso = asyncio.run(escenario())
+    assert orden == ["a", "b", "c", "a", "a"]
+    assert en_uso == 0
+
+
+def test_limite_justo_cancelacion_en_cola():
+    async def escenario():
+        limite = ingesta.LimiteJusto(1)
+        await limite.adquirir("a")
+        esperando = asyncio.create_task(limite.adquirir("b"))
+        await asyncio.sleep(0)
+        esperando.cancel()
+        await asyncio.sleep(0)
+        limite.liberar()
+        return limite.en_uso
+
+    assert asyncio.run(escenario()) == 0
+
+
+def test_trabajos_esperan_turno_como_pendientes(monkeypatch):
+    monkeypatch.setattr(ingesta, "INGESTA_TRABAJOS_CONCURRENTES", 1)
+
+    async def escenario():
+        liberar = asyncio.Event()
+
+        async def bloquear(_):
+            await liberar.wait()
+
+        primero = ingesta.lanzar("a.txt", bloquear)
+        segundo = ingesta.lanzar("b.txt", bloquear)
+        await asyncio.sleep(0.01)
+        estados = (primero.estado, segundo.estado)
+        liberar.set()
+        while not (primero.terminado and segundo.terminado):
+            await asyncio.sleep(0.01)
+        return estados, primero.estado, segundo.estado
+
+    estados, final_a, final_b = asyncio.run(escenario())
+    assert estados == ("procesando", "pendiente")
+    assert final_a == final_b == "completado"
+
+
+def _zip(entradas):
+    datos = io.BytesIO()
+    with zipfile.ZipFile(datos, "w") as archivo:
+        for nombre, contenido in entradas.items():
+            archivo.writestr(nombre, contenido)
+    return datos.getvalue()
+
+
+def test_expandir_zip_filtra_y_no_sale_del_destino(tmp_path):
+    origen = tmp_path / "lote.zip"
+    origen.write_bytes(_zip({"a.txt": "uno", "carpeta/b.txt": "dos", "../../fuera.txt": "tres", "foto.png": "x"}))
+    destino = tmp_path / "destino"
+    destino.mkdir()
+    extraidos, rechazados = extraccion.expandir_zip(origen, destino)
+    assert sorted(nombre for _, nombre in extraidos) == ["../../fuera.txt", "a.txt", "carpeta/b.txt"]
+    assert all(path.parent == destino for path, _ in extraidos)
+    assert rechazados == [("foto.png", "Tipo de archivo no soportado.")]
+
+
+def test_api_ingesta_masiva_con_zip(clientes, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: tmp_path)
+    archivo_zip = _zip({"docs/uno.txt": "primer manual " * 50, "docs/dos.txt": "segundo manual " * 50, "nota.md": "x"})
+
+    with TestClient(api) as client:
+        r = client.post("/api/ingest/batch", files=[
+            ("files", ("lote.zip", archivo_zip)),
+            ("files", ("tres.txt", "tercer manual " * 50)),
+            ("files", ("imagen.png", "x")),
+        ])
+        assert r.status_code == 200
+        cuerpo = r.json()
+        assert sorted(t["nombre"] for t in cuerpo["trabajos"]) == ["docs/dos.txt", "docs/uno.txt", "tres.txt"]
+        assert sorted(x["nombre"] for x in cuerpo["rechazados"]) == ["imagen.png", "lote.zip/nota.md"]
+        for trabajo in cuerpo["trabajos"]:
+            for _ in range(200):
+                estado = client.get(f"/api/ingest/{trabajo['job_id']}").json()
+                if estado["estado"] in ingesta.ESTADOS_FINALES:
+                    break
+                time.sleep(0.01)
+            assert estado["estado"] == "completado"
+            assert estado["subidos"] > 0
+    fuentes = rag_state.obtener_manifiestos().fuentes(rag_state.PINECONE_NAMESPACE)
+    assert fuentes == ["docs/dos.txt", "docs/uno.txt", "tres.txt"]
+    assert not list(tmp_path.glob("*_lote.zip"))
+    # Ni los extraídos ni los subidos sueltos quedan en disco tras la ingesta
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+
+
+class _SesionSimulada:
+    # Lo justo de un estado de Reflex para ejecutar el evento en segundo plano fuera del servidor
+    def __init__(self):
+        self.trabajos_ingesta = []
+        self.mensaje_procesamiento = "Procesando documento..."
+        self._lote_actual = ""
+        self._sondeo_activo = False
+        self._subidas_pendientes = []
+        self.usuario_id = ""
+
+    def subir(self, *subidas):
+        # Lo que deja procesar_archivo antes de encadenar lanzar_subidas, que no recibe argumentos
+        self._subidas_pendientes = self._subidas_pendientes + list(subidas)
+        return rag_state.RAGState.lanzar_subidas.fn(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_un_sondeo_por_sesion_y_resumen_del_ultimo_lote(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_state, "INGESTA_POLL_SEGUNDOS", 0.01)
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: tmp_path)
+    liberar = asyncio.Event()
+
+    async def ingestar(path, nombre, trabajo, documento=None):
+        await liberar.wait()
+        trabajo.mensaje = f"listo {nombre}"
+
+    monkeypatch.setattr(rag_state, "ingestar_archivo", ingestar)
+
+    def subir(nombre, contenido):
+        path = tmp_path / nombre
+        path.write_bytes(contenido)
+        return [str(path), nombre]
+
+    async def escenario():
+        sesion = _SesionSimulada()
+        zip_ = subir("lote.zip", _zip({"uno.txt": "primer manual", "dos.txt": "segundo manual"}))
+        primero = asyncio.ensure_future(sesion.subir(zip_))
+        while not sesion._sondeo_activo:
+            await asyncio.sleep(0.01)
+        # Con un sondeo en marcha, el segundo lote sólo registra sus trabajos y vuelve
+        await asyncio.wait_for(sesion.subir(subir("tres.txt", b"tercer manual")), 1)
+        assert not primero.done()
+        liberar.set()
+        await primero
+        return sesion
+
+    sesion = asyncio.run(escenario())
+    assert sorted(t["nombre"] for t in sesion.trabajos_ingesta) == ["dos.txt", "tres.txt", "uno.txt"]
+    assert all(t["estado"] == "completado" for t in sesion.trabajos_ingesta)
+    # El resumen es sólo del último lote (un archivo), no de los tres
+    assert sesion.mensaje_procesamiento == "listo tres.txt"
+    assert not sesion._sondeo_activo
+    assert not [p for p in tmp_path.iterdir() if p.is_file()]
+
+
+def test_lanzar_subidas_no_toca_archivos_fuera_del_directorio_de_subidas(tmp_path, monkeypatch):
+    subidas = tmp_path / "subidas"
+    subidas.mkdir()
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: subidas)
+    ajenos = {nombre: tmp_path / nombre for nombre in ("secreto.txt", "copia.zip", "datos.bin")}
+    for path in ajenos.values():
+        path.write_bytes(b"no tocar")
+    lanzados = []
+    monkeypatch.setattr(rag_state, "lanzar_ingesta", lambda *args: lanzados.append(args))
+    sesion = _SesionSimulada()
+    # También con una ruta relativa que sale del directorio
+    asyncio.run(sesion.subir(*[[str(p), n] for n, p in ajenos.items()], [str(subidas / ".." / "secreto.txt"), "otro.txt"]))
+    assert lanzados == []
+    assert all(p.read_bytes() == b"no tocar" for p in ajenos.values())
+    assert {t["mensaje"] for t in sesion.trabajos_ingesta} == {"Ruta de subida no válida."}
+    # El evento no acepta rutas ni ámbito del cliente
+    with pytest.raises(TypeError):
+        asyncio.run(rag_state.RAGState.lanzar_subidas.fn(sesion, [[str(ajenos["secreto.txt"]), "secreto.txt"]]))
+
+
+def test_identidad_de_la_ui_es_estable_por_usuario(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: tmp_path)
+    ambitos = []
+    monkeypatch.setattr(rag_state, "lanzar_ingesta_lote", lambda documentos, ambito: ambitos.append(ambito) or [])
+    una, otra = _SesionSimulada(), _SesionSimulada()
+    otra.usuario_id = "../no-es-un-id"
+    for sesion in (una, una, otra):
+        asyncio.run(sesion.subir())
+    assert ambitos[0] == ambitos[1] == "ui:" + una.usuario_id
+    # Un valor de cookie con otro formato se sustituye por un id nuevo
+    assert ambitos[2] == "ui:" + otra.usuario_id != ambitos[0]
+    assert len(otra.usuario_id) == 32
+
+
+def test_sondeo_cancelado_libera_la_sesion(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_state, "INGESTA_POLL_SEGUNDOS", 0.01)
+    monkeypatch.setattr(rag_state.rx, "get_upload_dir", lambda: tmp_path)
+
+    async def ingestar(path, nombre, trabajo, documento=None):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(rag_state, "ingestar_archivo", ingestar)
+    archivo = tmp_path / "uno.txt"
+    archivo.write_text("manual", encoding="utf-8")
+
+    async def escenario():
+        sesion = _SesionSimulada()
+        sondeo = asyncio.ensure_future(sesion.subir([str(archivo), "uno.txt"]))
+        while not sesion._sondeo_activo:
+            await asyncio.sleep(0.01)
+        sondeo.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await sondeo
+        for trabajo in ingesta.listar():
+            trabajo.cancelar()
+        return sesion
+
+    assert not asyncio.run(escenario())._sondeo_activo
+
+
+def test_podar_trabajos_conserva_los_activos():
+    trabajos = [{"id": str(i), "estado": "completado"} for i in range(3)] + [{"id": "3", "estado": "procesando"}]
+    assert [t["id"] for t in rag_state._podar_trabajos(trabajos, 2)] == ["2", "3"]
+    assert rag_state._podar_trabajos(trabajos, 10) is trabajos
@@ -0,0 +1,49 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import app.states.rag_state as rag_state
+from app.metricas import Registro
+
+
+def test_percentiles_y_formato_prometheus():
+    registro = Registro(max_muestras=100)
+    for ms in range(1, 101):
+        registro.observar("busqueda", ms / 1000)
+    registro.incrementar("rag_errores_total", etapa="busqueda")
+    registro.agregar_colector(lambda: [("rag_cache_hits_total", {"cache": "x"}, 3)])
+
+    resumen = registro.resumen()["latencias"]["busqueda"]
+    assert resumen["p50"] == 0.05
+    assert resumen["p95"] == 0.095
+    assert resumen["p99"] == 0.099
+
+    texto = registro.prometheus()
+    assert 'rag_etapa_segundos{etapa="busqueda",quantile="0.99"} 0.099000' in texto
+    assert 'rag_etapa_segundos_count{etapa="busqueda"} 100' in texto
+    assert 'rag_errores_total{etapa="busqueda"} 1' in texto
+    assert "# TYPE rag_cache_hits_total counter" in texto
+
+
+def test_api_devuelve_tiempos_estructurados_y_expone_metricas(clientes, chat):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    rag_state.ingestar_chunks(["texto del manual"], "a.txt")
+
+    with TestClient(api) as client:
+        datos = client.post("/api/rag", json={"pregunta": "¿Qué dice el manual?"}).json()
+        metricas = client.get("/metrics")
+
+    assert datos["respuesta"] == "Respuesta simulada."
+    assert "Tiempo de respuesta" not in datos["respuesta"]
+    assert set(datos["tiempos"]) >= {"embedding", "busqueda", "generacion"}
+    assert metricas.headers["content-type"].startswith("text/plain")
+    assert 'rag_etapa_segundos_count{etapa="generacion"}' in metricas.text
+    assert 'rag_cache_misses_total{cache="respuestas"}' in metricas.text
+
+
+def test_stream_registra_primer_token(clientes, chat):
+    rag_state.ingestar_chunks(["texto"], "a.txt")
+    fin = list(rag_state.responder_pregunta_rag_stream("¿Qué dice el texto?"))[-1]
+
+    assert {"embedding", "busqueda", "primer_token", "generacion"} <= set(fin["tiempos"])
+    assert fin["tiempos"]["primer_token"] <= fin["tiempos"]["generacion"]
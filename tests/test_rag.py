@@ -0,0 +1,157 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import app.states.rag_state as rag_state
+
+
+def test_respuesta_repetida_sale_de_cache(clientes, chat):
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+    primera = rag_state.ejecutar_rag("¿Cómo se instala el equipo?")
+    segunda = rag_state.ejecutar_rag("¿Cómo se instala el equipo?")
+
+    assert primera["cache"] is False
+    assert segunda["cache"] is True
+    assert segunda["respuesta"] == primera["respuesta"] == "Respuesta simulada."
+    assert len(chat.llamadas) == 1
+    assert "desde caché" in rag_state.formatear_respuesta(segunda)
+
+
+def test_cache_se_invalida_si_cambia_el_contexto(clientes, chat):
+    rag_state.ingestar_chunks(["primer documento"], "a.txt")
+    rag_state.ejecutar_rag("¿Qué dice el documento?")
+    rag_state.ingestar_chunks(["segundo documento"], "b.txt")
+    resultado = rag_state.ejecutar_rag("¿Qué dice el documento?")
+
+    assert resultado["cache"] is False
+    assert len(chat.llamadas) == 2
+
+
+def test_errores_no_se_cachean(clientes, chat):
+    chat.respuesta = None
+    rag_state.ingestar_chunks(["texto"], "a.txt")
+    rag_state.ejecutar_rag("¿Qué dice el texto?")
+    rag_state.ejecutar_rag("¿Qué dice el texto?")
+
+    assert len(chat.llamadas) == 2
+
+
+def test_stream_emite_tokens_y_resultado_final(clientes, chat):
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+    eventos = list(rag_state.responder_pregunta_rag_stream("¿Cómo se instala el equipo?"))
+
+    tokens = [e["texto"] for e in eventos if e["tipo"] == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == "Respuesta simulada."
+    assert eventos[-1]["tipo"] == "fin"
+    assert eventos[-1]["respuesta"] == "Respuesta simulada."
+    # La respuesta completa queda en la caché para el camino no streaming
+    assert rag_state.ejecutar_rag("¿Cómo se instala el equipo?")["cache"] is True
+
+
+def test_endpoint_sse(clientes, chat):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    rag_state.ingestar_chunks(["texto"], "a.txt")
+
+    with TestClient(api) as client:
+        r = client.post("/api/rag/stream", json={"pregunta": "¿Qué dice el texto?"})
+    assert r.headers["content-type"].startswith("text/event-stream")
+    bloques = [b for b in r.text.split("\n\n") if b]
+    assert bloques[0].startswith("event: token")
+    assert bloques[-1].startswith("event: fin")
+    assert '"respuesta": "Respuesta simulada."' in bloques[-1]
+
+
+def test_camino_asincrono_concurrente(clientes, chat):
+    import asyncio
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+
+    async def escenario():
+        return await asyncio.gather(*(
+            rag_state.ejecutar_rag_async(f"¿Cómo se instala el equipo número {i}?") for i in range(5)
+        ))
+
+    resultados = asyncio.run(escenario())
+    assert all(r["error"] is None for r in resultados)
+    assert all(r["respuesta"] == "Respuesta simulada." for r in resultados)
+
+
+def test_stream_asincrono(clientes, chat):
+    import asyncio
+    rag_state.ingestar_chunks(["texto"], "a.txt")
+
+    async def escenario():
+        return [e async for e in rag_state.responder_pregunta_rag_stream_async("¿Qué dice el texto?")]
+
+    eventos = asyncio.run(escenario())
+    assert "".join(e["texto"] for e in eventos if e["tipo"] == "token") == "Respuesta simulada."
+    assert eventos[-1]["tipo"] == "fin" and eventos[-1]["error"] is None
+
+
+def test_lote_comparte_embedding_y_conserva_orden(clientes, chat):
+    embeddings, index = clientes
+    rag_state.ingestar_chunks(["texto del manual"], "a.txt")
+    llamadas_previas = len(embeddings.llamadas)
+    preguntas = [f"¿Pregunta número {i} sobre el manual?" for i in range(6)]
+
+    from fastapi.testclient import TestClient
+    from app.api import api
+    with TestClient(api) as client:
+        r = client.post("/api/rag/batch", json={"preguntas": preguntas, "concurrencia": 2})
+
+    resultados = r.json()["resultados"]
+    assert [x["pregunta"] for x in resultados] == preguntas
+    assert all(x["error"] is None and x["respuesta"] == "Respuesta simulada." for x in resultados)
+    assert all("embedding" in x["tiempos"] for x in resultados)
+    assert len(embeddings.llamadas) == llamadas_previas + 1
+
+
+def test_lote_reporta_errores_por_pregunta(clientes, chat, monkeypatch):
+    import asyncio
+    rag_state.ingestar_chunks(["texto"], "a.txt")
+    original = rag_state.buscar_matches
+
+    def buscar_con_fallo(embedding, top_k=10, namespace=None):
+        if embedding[0] == len("falla"):
+            raise RuntimeError("índice caído")
+        return original(embedding, top_k, namespace)
+
+    monkeypatch.setattr(rag_state, "buscar_matches", buscar_con_fallo)
+    resultados = asyncio.run(rag_state.ejecutar_rag_lote_async(["¿Qué dice el texto?", "falla"]))
+
+    assert resultados[0]["error"] is None
+    assert "índice caído" in resultados[1]["error"]
+
+
+def test_camino_asincrono_no_consulta_disco_en_el_bucle(clientes, chat, monkeypatch, tmp_path):
+    import asyncio
+    import threading
+    from app.cache_embeddings import CacheEmbeddings
+    monkeypatch.setattr(rag_state, "cache_embeddings", CacheEmbeddings(1024 * 1024, str(tmp_path / "embeddings.db")))
+    monkeypatch.setattr(rag_state, "BUSQUEDA_HIBRIDA", True)
+    rag_state.ingestar_chunks(["el manual explica la instalación"], "manual.txt")
+    hilos = []
+
+    def espiar(objeto, nombre):
+        original = getattr(objeto, nombre)
+
+        def envoltura(*args, **kwargs):
+            hilos.append((nombre, threading.current_thread() is threading.main_thread()))
+            return original(*args, **kwargs)
+        monkeypatch.setattr(objeto, nombre, envoltura)
+
+    for nombre in ("obtener", "obtener_varios", "guardar", "guardar_varios"):
+        espiar(rag_state.cache_embeddings, nombre)
+    for nombre in ("buscar", "guardar"):
+        espiar(rag_state.cache_respuestas, nombre)
+    espiar(rag_state.obtener_manifiestos(), "total")
+
+    async def escenario():
+        await rag_state.ejecutar_rag_async("¿Cómo se instala?")
+        await rag_state.ejecutar_rag_async("¿Cómo se instala?", ["otro", rag_state.PINECONE_NAMESPACE])
+        await rag_state.ejecutar_rag_lote_async(["¿Y el mantenimiento?"])
+        return [e async for e in rag_state.responder_pregunta_rag_stream_async("¿Qué dice el manual?")]
+
+    asyncio.run(escenario())
+    assert {nombre for nombre, _ in hilos} >= {"obtener", "obtener_varios", "guardar", "buscar", "total"}
+    assert [nombre for nombre, en_bucle in hilos if en_bucle] == []
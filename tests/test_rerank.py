@@ -0,0 +1,65 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import app.states.rag_state as rag_state
+from app import rerank
+from app.vectores import Match
+
+
+def _match(id_, vector, texto):
+    return Match(id_, 0.0, {"texto": texto}, vector)
+
+
+def test_mmr_descarta_casi_duplicados():
+    matches = [
+        _match("a", [1.0, 0.0, 0.0], "instalación del equipo"),
+        _match("a_copia", [0.995, 0.1, 0.0], "instalación del equipo"),
+        _match("b", [0.0, 1.0, 0.0], "mantenimiento del equipo"),
+        _match("c", [0.0, 0.0, 1.0], "garantía"),
+    ]
+    pregunta = [0.8, 0.6, 0.0]
+    elegidos = rerank.reordenar("instalación", pregunta, matches, k=2, lambda_=0.5, peso_lexico=0)
+    assert [m.id for m in elegidos] == ["a_copia", "b"]
+    # Sin diversidad, el orden es el de relevancia
+    elegidos = rerank.reordenar("instalación", pregunta, matches, k=2, lambda_=1.0, peso_lexico=0)
+    assert [m.id for m in elegidos] == ["a_copia", "a"]
+
+
+def test_extra_lexico_desempata():
+    matches = [_match("x", [1.0, 0.0], "otra cosa"), _match("y", [1.0, 0.0], "referencia AB-1234")]
+    assert rerank.solape_lexico("AB-1234", matches).tolist() == [0.0, 1.0]
+    assert rerank.reordenar("AB-1234", [1.0, 0.0], matches, k=1)[0].id == "y"
+
+
+def test_sin_vectores_conserva_el_orden():
+    matches = [Match("a", 0.9, {"texto": "a"}), Match("b", 0.8, {"texto": "b"}), Match("c", 0.7, {"texto": "c"})]
+    assert [m.id for m in rerank.reordenar("pregunta", [1.0, 0.0], matches, k=2)] == ["a", "b"]
+
+
+def test_mmr_vectorizado_coincide_con_la_definicion():
+    rng = np.random.default_rng(0)
+    vectores = rng.normal(size=(25, 8)).astype(np.float32)
+    vectores /= np.linalg.norm(vectores, axis=1, keepdims=True)
+    relevancia = rng.random(25).astype(np.float32)
+    similitudes = vectores @ vectores.T
+    elegidos = rerank.mmr(relevancia, similitudes, 5, 0.6)
+    esperados = []
+    for _ in range(5):
+        puntos = {
+            i: 0.6 * relevancia[i] - 0.4 * max((similitudes[i][j] for j in esperados), default=0.0)
+            for i in range(25) if i not in esperados
+        }
+        esperados.append(max(puntos, key=puntos.get))
+    assert elegidos == esperados
+
+
+def test_rag_envia_solo_los_mejores_chunks(clientes, chat, monkeypatch):
+    monkeypatch.setattr(rerank, "RERANK_FINAL", 3)
+    embeddings, index = clientes
+    rag_state.ingestar_chunks([f"chunk número {i} sobre el tema {i % 4}" for i in range(12)], "doc.txt")
+    resultado = rag_state.ejecutar_rag("¿Qué dice el documento sobre el tema?")
+    assert resultado["error"] is None
+    assert "rerank" in resultado["tiempos"]
+    contexto = chat.llamadas[-1][-1]["content"]
+    assert contexto.count("chunk número") <= 3
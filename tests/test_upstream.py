@@ -0,0 +1,142 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+import pytest
+import app.states.rag_state as rag_state
+from app import upstream
+
+
+class ErrorHttp(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+@pytest.fixture
+def politica(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF_BASE", 0)
+    monkeypatch.setitem(upstream.POLITICAS, "prueba", upstream.Politica(timeout=0.05, reintentos=2, presupuesto=5))
+    upstream.reiniciar()
+    yield
+    upstream.reiniciar()
+
+
+def test_retry_after_y_clasificacion_de_errores():
+    assert upstream.retry_after(ErrorHttp(429, {"retry-after": "2"})) == 2.0
+    assert upstream.retry_after(ErrorHttp(429, {"retry-after-ms": "150"})) == 0.15
+    fecha = upstream.retry_after(ErrorHttp(503, {"retry-after": formatdate(time.time() + 30, usegmt=True)}))
+    assert 25 < fecha <= 30
+    assert upstream.retry_after(ErrorHttp(500)) is None
+    assert upstream.es_reintentable(ErrorHttp(429)) and upstream.es_reintentable(ErrorHttp(502))
+    assert not upstream.es_reintentable(ErrorHttp(400))
+    assert upstream.es_reintentable(TimeoutError())
+
+
+def test_reintenta_429_y_no_reintenta_errores_de_la_peticion(politica):
+    u = upstream.obtener("openai")
+    errores = [ErrorHttp(429, {"retry-after": "0"}), ErrorHttp(503)]
+    timeouts = []
+
+    def operacion(timeout):
+        timeouts.append(timeout)
+        if errores:
+            raise errores.pop(0)
+        return "ok"
+
+    assert u.llamar("prueba", operacion) == "ok"
+    assert timeouts == [0.05] * 3
+    with pytest.raises(ErrorHttp):
+        u.llamar("prueba", lambda timeout: (_ for _ in ()).throw(ErrorHttp(400)))
+    datos = upstream.estadisticas()["openai"]
+    assert (datos["llamadas"], datos["reintentos"], datos["errores"], datos["exitos"]) == (4, 2, 3, 1)
+    assert datos["circuito"] == "cerrado"
+
+
+def test_circuito_falla_rapido_y_se_recupera(politica):
+    u = upstream.Upstream("pinecone", umbral=2, enfriamiento=0.05)
+    llamadas = []
+
+    def caido(timeout):
+        llamadas.append(timeout)
+        raise ErrorHttp(503)
+
+    with pytest.raises(ErrorHttp):
+        u.llamar("prueba", caido)
+    assert u.circuito.estado == "abierto" and len(llamadas) == 2
+    with pytest.raises(upstream.CircuitoAbierto):
+        u.llamar("prueba", caido)
+    assert len(llamadas) == 2
+    time.sleep(0.06)
+    # Semiabierto: pasa una petición de prueba y, si va bien, el circuito se cierra
+    assert u.llamar("prueba", lambda timeout: "ok") == "ok"
+    assert u.circuito.estado == "cerrado"
+    assert u.estadisticas()["rechazadas"] == 1
+
+
+def test_prueba_cancelada_libera_el_circuito(politica):
+    u = upstream.Upstream("pinecone", umbral=1, enfriamiento=0.05)
+    with pytest.raises(ErrorHttp):
+        u.llamar("prueba", lambda timeout: (_ for _ in ()).throw(ErrorHttp(503)))
+    time.sleep(0.06)
+
+    async def colgada(timeout):
+        await asyncio.sleep(1)
+
+    async def cancelar_prueba():
+        tarea = asyncio.create_task(u.llamar_async("prueba", colgada))
+        await asyncio.sleep(0.01)
+        # Mientras la prueba está en vuelo, el resto espera algo más que cero
+        with pytest.raises(upstream.CircuitoAbierto) as rechazo:
+            u.circuito.permitir()
+        assert rechazo.value.segundos > 0
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+
+    asyncio.run(cancelar_prueba())
+    # La prueba cancelada cuenta como fallo: vuelve a abrirse y, pasado el enfriamiento, se recupera
+    assert u.circuito.estado == "abierto"
+    assert u.estadisticas()["canceladas"] == 1
+    time.sleep(0.06)
+    assert u.llamar("prueba", lambda timeout: "ok") == "ok"
+    assert u.circuito.estado == "cerrado"
+
+
+def test_timeout_impuesto_en_el_camino_asincrono(politica):
+    u = upstream.obtener("openai")
+
+    async def lenta(timeout):
+        await asyncio.sleep(1)
+
+    inicio = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(u.llamar_async("prueba", lenta))
+    assert time.perf_counter() - inicio < 0.5
+    datos = u.estadisticas()
+    assert datos["timeouts"] == 3 and datos["reintentos"] == 2
+
+
+def test_rag_reintenta_embedding_y_expone_estadisticas(clientes, politica):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    embeddings, _ = clientes
+    crear = embeddings.create
+    fallos = [ErrorHttp(429, {"retry-after": "0"})]
+
+    def create(input, model, **kwargs):
+        assert kwargs["timeout"] <= upstream.POLITICAS["embedding"].timeout
+        if fallos:
+            raise fallos.pop()
+        return crear(input, model)
+
+    embeddings.create = create
+    assert rag_state.get_embedding("pregunta") is not None
+    with TestClient(api) as client:
+        datos = client.get("/api/upstreams").json()
+    assert datos["openai"]["reintentos"] == 1
+    assert datos["openai"]["exitos"] == 1
@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+from app import validacion
+from benchmarks import bench_validacion
+
+
+@pytest.mark.parametrize("texto, codigo", [
+    ("   ", "vacia"),
+    ("palabra " * 400, "demasiado_larga"),
+    ("¿Cómo se instala el equipo? 😀", "emoji"),
+    ("Как установить это оборудование ☀", "emoji"),
+    ("Как установить оборудование?", "alfabeto"),
+    ("123 456 789", "sin_letras"),
+    ("¿Instalación rápida?", "pocas_palabras"),
+    ("¿Cómo se instala el equipo?", None),
+    ("  Pregunta con ñ, ü y ç (válida)  ", None),
+])
+def test_codigos_de_error(texto, codigo):
+    error = validacion.validar_pregunta(texto)
+    assert (error.codigo if error else None) == codigo
+    # Coincide con la validación anterior de la UI en todo lo que ésta comprobaba
+    if codigo != "demasiado_larga":
+        assert bench_validacion.validar_legado(texto) == codigo
+
+
+def test_limite_de_tokens(monkeypatch):
+    monkeypatch.setattr(validacion, "PREGUNTA_MAX_TOKENS", 5)
+    assert validacion.validar_pregunta("una pregunta de más de veinte caracteres").codigo == "demasiados_tokens"
+
+
+def test_api_rechaza_antes_de_llamar_a_los_proveedores(clientes, chat):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    embeddings, _ = clientes
+    with TestClient(api) as client:
+        r = client.post("/api/rag", json={"pregunta": "hola 😀"})
+        assert r.status_code == 422
+        assert r.json()["detail"] == {"codigo": "emoji", "mensaje": "No se permiten emojis en la pregunta."}
+        assert client.get("/api/rag/stream", params={"pregunta": "dos palabras"}).status_code == 422
+    assert embeddings.llamadas == [] and chat.llamadas == []
+
+
+def test_lote_informa_las_invalidas_y_responde_las_validas(clientes, chat):
+    from fastapi.testclient import TestClient
+    from app.api import api
+    embeddings, _ = clientes
+    with TestClient(api) as client:
+        r = client.post("/api/rag/batch", json={"preguntas": ["", "¿Cómo se instala el equipo?", "hola 😀"]})
+        assert r.status_code == 200
+        resultados = r.json()["resultados"]
+        assert [x["pregunta"] for x in resultados] == ["", "¿Cómo se instala el equipo?", "hola 😀"]
+        assert resultados[0]["validacion"] == {"codigo": "vacia", "mensaje": "Por favor,escribe una pregunta."}
+        assert resultados[0]["error"] == "Por favor,escribe una pregunta."
+        assert resultados[1]["error"] is None and resultados[1]["respuesta"] == "Respuesta simulada."
+        assert resultados[2]["validacion"]["codigo"] == "emoji"
+        # Sólo la válida llega a los proveedores
+        assert embeddings.llamadas == [["¿Cómo se instala el equipo?"]] and len(chat.llamadas) == 1
+        # Un lote sin ninguna válida no llama a nadie
+        r = client.post("/api/rag/batch", json={"preguntas": ["", "dos palabras"]})
+        assert r.status_code == 200 and all(x["validacion"] for x in r.json()["resultados"])
+    assert len(chat.llamadas) == 1
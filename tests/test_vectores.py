@@ -0,0 +1,158 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import threading
+import numpy as np
+import app.states.rag_state as rag_state
+from app import vectores as modulo_vectores
+from app.ivf import IndiceIVF
+from app.vectores import LocalStore
+
+
+def _vectores(n, dimension=8):
+    return [(f"id-{i}", [float((i * 7 + j) % 5) for j in range(dimension)], {"texto": f"chunk {i}", "posicion": i}) for i in range(n)]
+
+
+def test_local_top_k_ordenado_y_crece(tmp_path):
+    store = LocalStore(str(tmp_path))
+    vectores = _vectores(3000)
+    store.upsert(vectores, "ns")
+    objetivo = vectores[1234][1]
+    matches = store.query(objetivo, 5, "ns", include_values=True)
+    assert len(matches) == 5
+    assert matches[0].score > 0.999
+    assert [m.score for m in matches] == sorted((m.score for m in matches), reverse=True)
+    assert len(matches[0].values) == 8
+    assert matches[0].metadata["texto"].startswith("chunk")
+
+
+def test_local_namespaces_aislados_y_borrado(tmp_path):
+    store = LocalStore(str(tmp_path))
+    store.upsert([("a", [1.0, 0.0], {"texto": "a"})], "uno")
+    store.upsert([("b", [1.0, 0.0], {"texto": "b"})], "dos")
+    assert [m.id for m in store.query([1.0, 0.0], 10, "uno")] == ["a"]
+    store.delete(["a"], "uno")
+    assert store.query([1.0, 0.0], 10, "uno") == []
+    assert [m.id for m in store.query([1.0, 0.0], 10, "dos")] == ["b"]
+
+
+def test_local_persiste_y_upsert_reemplaza(tmp_path):
+    store = LocalStore(str(tmp_path))
+    store.upsert([("a", [1.0, 0.0], {"texto": "viejo"}), ("b", [0.0, 1.0], {"texto": "b"})], "ns")
+    store.upsert([("a", [0.0, 1.0], {"texto": "nuevo"})], "ns")
+    store.delete(["b"], "ns")
+    reabierto = LocalStore(str(tmp_path))
+    matches = reabierto.query([0.0, 1.0], 10, "ns")
+    assert [(m.id, m.metadata["texto"]) for m in matches] == [("a", "nuevo")]
+
+
+def test_local_actualiza_metadatos_sin_tocar_el_vector(tmp_path):
+    store = LocalStore(str(tmp_path))
+    store.upsert([("a", [1.0, 0.0], {"texto": "a", "posicion": 0})], "ns")
+    store.actualizar_metadatos([("a", {"posicion": 3}), ("no-existe", {"posicion": 1})], "ns")
+    store.actualizar_metadatos([("a", {"posicion": 1})], "otro")
+    reabierto = LocalStore(str(tmp_path))
+    [match] = reabierto.query([1.0, 0.0], 10, "ns")
+    assert match.metadata == {"texto": "a", "posicion": 3} and match.score > 0.999
+    assert not (tmp_path / "otro").exists()
+
+
+def test_rag_con_backend_local(tmp_path, clientes, chat, monkeypatch):
+    monkeypatch.setattr(rag_state, "vector_store_instance", LocalStore(str(tmp_path)))
+    chat.respuesta = "Respuesta local"
+    asyncio.run(rag_state.ingestar_pipeline(["uno", "dos dos", "tres tres tres"], "doc.txt"))
+    resultado = rag_state.ejecutar_rag("dos dos")
+    assert resultado["error"] is None
+    assert resultado["respuesta"] == "Respuesta local"
+    matches = rag_state.buscar_matches([7.0, 1.0], top_k=3)
+    assert {m.metadata["fuente"] for m in matches} == {"doc.txt"}
+
+
+def _agrupados(n, dimension=16, semilla=0):
+    generador = np.random.default_rng(semilla)
+    centros = generador.normal(size=(20, dimension))
+    datos = centros[generador.integers(0, 20, n)] + 0.3 * generador.normal(size=(n, dimension))
+    return [(f"id-{i}", datos[i].tolist(), {"posicion": i}) for i in range(n)]
+
+
+def test_ivf_se_entrena_y_encuentra_vecinos(tmp_path):
+    store = LocalStore(str(tmp_path), min_vectores_ann=500)
+    vectores = _agrupados(800)
+    store.upsert(vectores[:400], "ns")
+    assert not store.espacio("ns").ann.entrenado
+    store.upsert(vectores[400:], "ns")
+    assert store.espacio("ns").esperar_entrenamiento(30)
+    aciertos = sum(vectores[i][0] in {m.id for m in store.query(vectores[i][1], 5, "ns")} for i in range(0, 800, 20))
+    assert aciertos >= 36
+
+
+def test_ivf_altas_incrementales_borrados_y_persistencia(tmp_path):
+    store = LocalStore(str(tmp_path), min_vectores_ann=300)
+    vectores = _agrupados(300)
+    store.upsert(vectores, "ns")
+    assert store.espacio("ns").esperar_entrenamiento(30)
+    nuevo = ("nuevo", _agrupados(1, semilla=7)[0][1], {"posicion": -1})
+    store.upsert([nuevo], "ns")
+    assert store.query(nuevo[1], 1, "ns")[0].id == "nuevo"
+    store.delete(["nuevo"], "ns")
+    assert "nuevo" not in {m.id for m in store.query(nuevo[1], 5, "ns")}
+    reabierto = LocalStore(str(tmp_path), min_vectores_ann=300)
+    espacio = reabierto.espacio("ns")
+    assert espacio.ann.entrenado
+    assert reabierto.query(vectores[10][1], 1, "ns")[0].id == "id-10"
+
+
+def test_ivf_se_entrena_sin_bloquear_consultas(tmp_path, monkeypatch):
+    soltar = threading.Event()
+    entrenar = IndiceIVF.entrenar
+
+    def entrenar_lento(self, muestra, *args, **kwargs):
+        assert soltar.wait(10)
+        entrenar(self, muestra, *args, **kwargs)
+
+    monkeypatch.setattr(IndiceIVF, "entrenar", entrenar_lento)
+    store = LocalStore(str(tmp_path), min_vectores_ann=300)
+    vectores = _agrupados(300)
+    store.upsert(vectores, "ns")
+    espacio = store.espacio("ns")
+    # Mientras se entrena se sigue buscando (por fuerza bruta) y admitiendo altas
+    assert not espacio.ann.entrenado
+    assert store.query(vectores[5][1], 1, "ns")[0].id == "id-5"
+    nuevo = ("nuevo", _agrupados(1, semilla=7)[0][1], {"posicion": -1})
+    store.upsert([nuevo], "ns")
+    soltar.set()
+    assert espacio.esperar_entrenamiento(30)
+    assert store.query(nuevo[1], 1, "ns")[0].id == "nuevo"
+
+
+def test_filas_borradas_se_reutilizan_y_el_log_se_compacta(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_vectores, "LOCAL_VECTOR_COMPACTAR_MIN", 10)
+    store = LocalStore(str(tmp_path))
+    for ronda in range(5):
+        store.upsert([(f"r{ronda}-{i}", [1.0, float(i)], {"texto": f"{ronda}-{i}"}) for i in range(8)], "ns")
+        if ronda < 4:
+            store.delete([f"r{ronda}-{i}" for i in range(8)], "ns")
+    espacio = store.espacio("ns")
+    assert espacio.n == 8
+    with open(espacio.path_metadatos, encoding="utf-8") as f:
+        assert sum(1 for _ in f) <= 2 * 8 + 10
+    reabierto = LocalStore(str(tmp_path))
+    assert {m.id for m in reabierto.query([1.0, 0.0], 20, "ns")} == {f"r4-{i}" for i in range(8)}
+    # Las filas libres se recuperan al reabrir
+    reabierto.delete(["r4-0"], "ns")
+    reabierto.upsert([("otro", [1.0, 0.0], {"texto": "otro"})], "ns")
+    assert reabierto.espacio("ns").n == 8
+
+
+def test_ivf_compacta_entradas_repetidas(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_vectores, "LOCAL_VECTOR_COMPACTAR_MIN", 10)
+    store = LocalStore(str(tmp_path), min_vectores_ann=300)
+    vectores = _agrupados(300)
+    store.upsert(vectores, "ns")
+    espacio = store.espacio("ns")
+    assert espacio.esperar_entrenamiento(30)
+    for _ in range(3):
+        store.upsert(vectores[:200], "ns")
+    assert espacio.ann.entradas <= 2 * 300
+    assert store.query(vectores[150][1], 1, "ns")[0].id == "id-150"